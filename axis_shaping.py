@@ -0,0 +1,121 @@
+import math
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_DEADZONE = 0.1
+DEFAULT_EXPO = 0.3
+DEFAULT_SLEW_RATE = 4.0  # full scale per second, 0 -> 1 in 0.25 s
+DEFAULT_TABLE_SIZE = 256
+SLEW_TICK = 0.01  # seconds between updates while an axis is still slewing
+MAX_SLEW_DT = 0.2  # seconds, longest gap credited to one step of a stalled caller
+
+
+def expo_curve(expo: float) -> Callable[[float], float]:
+    """RC-style expo: linear for expo 0, cubic for expo 1"""
+    return lambda u: (1.0 - expo) * u + expo * u * u * u
+
+
+class ResponseCurve:
+    """Deadzone plus response curve of a stick magnitude as a lookup table
+
+    The deadzone is removed and the remaining range rescaled to 0..1 before
+    `function` is applied, so the output starts at 0 right at the edge of
+    the deadzone instead of jumping. Evaluation is a table lookup with
+    linear interpolation, so its cost does not depend on the curve.
+    """
+
+    def __init__(self, deadzone: float = DEFAULT_DEADZONE, expo: float = DEFAULT_EXPO,
+                 function: Optional[Callable[[float], float]] = None,
+                 size: int = DEFAULT_TABLE_SIZE):
+        if not 0.0 <= deadzone < 1.0:
+            raise ValueError("deadzone must be in 0..1")
+        function = function or expo_curve(expo)
+        self.deadzone = deadzone
+        self.table: List[float] = []
+        for index in range(size + 1):
+            u = index / size
+            u = 0.0 if u <= deadzone else (u - deadzone) / (1.0 - deadzone)
+            self.table.append(min(1.0, max(0.0, function(u))))
+        self._scale = size
+        self._last = size
+
+    def __call__(self, magnitude: float) -> float:
+        """Shaped magnitude for a raw magnitude in 0..1"""
+        if magnitude <= self.deadzone:
+            return 0.0
+        position = min(magnitude, 1.0) * self._scale
+        index = int(position)
+        if index >= self._last:
+            return self.table[self._last]
+        low = self.table[index]
+        return low + (self.table[index + 1] - low) * (position - index)
+
+
+class AxisShaper:
+    """Input shaping between the controller and the mixer
+
+    The translation stick (x, y) gets a radial deadzone and curve, so the
+    direction is kept and diagonals are not cut off like with a square
+    per-axis deadzone; rotation gets its own one-dimensional curve. The
+    result is then slew-rate limited per axis in full scale per second
+    (None disables the limit). While an axis has not reached its target,
+    `settled` is False and the caller should call shape() again after
+    SLEW_TICK even without new input. Each step is credited the time since
+    the previous call, so a caller updating slower than the tick still gets
+    the full slew rate; only gaps longer than `max_dt` are cut.
+    """
+
+    def __init__(self, translation: Optional[ResponseCurve] = None,
+                 rotation: Optional[ResponseCurve] = None,
+                 slew_rates: Optional[Sequence[Optional[float]]] = (
+                     DEFAULT_SLEW_RATE, DEFAULT_SLEW_RATE, DEFAULT_SLEW_RATE),
+                 tick: float = SLEW_TICK, max_dt: float = MAX_SLEW_DT):
+        self.translation = translation or ResponseCurve()
+        self.rotation = rotation or ResponseCurve()
+        self.slew_rates = tuple(slew_rates) if slew_rates is not None else (None, None, None)
+        self.tick = tick
+        self.max_dt = max_dt
+        self.output = [0.0, 0.0, 0.0]
+        self.target = [0.0, 0.0, 0.0]
+        self._time: Optional[float] = None
+
+    @property
+    def settled(self) -> bool:
+        return self.output == self.target
+
+    def reset(self):
+        """Drop to zero immediately, e.g. after losing the controller"""
+        self.output = [0.0, 0.0, 0.0]
+        self.target = [0.0, 0.0, 0.0]
+        self._time = None
+
+    def shape(self, x: float, y: float, r: float,
+              now: Optional[float] = None) -> Tuple[float, float, float]:
+        if now is None:
+            now = time.monotonic()
+        magnitude = math.hypot(x, y)
+        if magnitude > 0.0:
+            scale = self.translation(magnitude) / magnitude
+            x *= scale
+            y *= scale
+        r = math.copysign(self.rotation(abs(r)), r)
+        settled = self.settled
+        self.target = [x, y, r]
+
+        # While settled the elapsed time says nothing about the slew, so the
+        # first step after an idle phase gets one tick
+        if self._time is None or settled:
+            dt = self.tick
+        else:
+            dt = min(now - self._time, self.max_dt)
+        self._time = now
+        output = self.output
+        for axis, rate in enumerate(self.slew_rates):
+            target = self.target[axis]
+            if rate is None:
+                output[axis] = target
+                continue
+            step = rate * dt
+            delta = target - output[axis]
+            output[axis] = target if abs(delta) <= step else output[axis] + math.copysign(step, delta)
+        return output[0], output[1], output[2]
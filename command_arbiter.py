@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from control_loop import ControlLoop
+
+logger = logging.getLogger(__name__)
+
+# name: (priority, timeout in seconds). Operators on site win over remote
+# clients, remote clients over scripted motion. The pad and keyboard send
+# on every change plus a keepalive, web clients and scripts at a low rate.
+DEFAULT_SOURCES = {
+    'teleop': (30, 1.0),
+    'keyboard': (20, 1.0),
+    'web': (10, 0.5),
+    'script': (0, 2.0)
+}
+DEFAULT_RATE = 60  # Hz
+IDLE = 'idle'  # source name of the zero command emitted while no source is fresh
+
+# output(x, y, r, source, input_time)
+Output = Callable[[float, float, float, str, Optional[float]], None]
+
+
+class Command(NamedTuple):
+    """Body velocity command of one source, x/y/r in -1..1"""
+    x: float
+    y: float
+    r: float
+    timestamp: Optional[float]  # time.monotonic() of the input it was computed from, if any
+    received: float  # time.monotonic() when it reached the arbiter
+    sequence: int
+    lease: Optional[float] = None  # seconds the command stays fresh, None for the source timeout
+
+
+class CommandSource:
+    """Registered command source with its priority and timeout"""
+
+    def __init__(self, name: str, priority: int, timeout: float):
+        self.name = name
+        self.priority = priority
+        self.timeout = timeout
+        self.command: Optional[Command] = None
+        self.accepted = 0
+        self.expired = 0
+
+    def fresh(self, now: float) -> bool:
+        command = self.command
+        if command is None:
+            return False
+        timeout = command.lease if command.lease is not None else self.timeout
+        return now - command.received <= timeout
+
+
+class CommandArbiter:
+    """Single writer of the motor commands of all control sources
+
+    Sources submit timestamped (x, y, r) commands whenever they like. Once
+    per period of the loop the fresh source with the highest priority is
+    selected and its command handed to `output`; a source whose last
+    command is older than its timeout no longer counts, and with no fresh
+    source a zero command is emitted. A new command that would win the
+    selection is applied right away from the arbiter thread instead of at
+    the next period, so the pad keeps its event latency. Only the first
+    emission of a command carries its input timestamp; the periodic
+    repeats pass None.
+    """
+
+    def __init__(self, output: Output, rate: float = DEFAULT_RATE,
+                 sources: Optional[Dict[str, Tuple[int, float]]] = None):
+        self.output = output
+        self.loop = ControlLoop(rate)
+        self.sources: Dict[str, CommandSource] = {}
+        self.active = IDLE
+        self.switches = 0
+        self._sequence = 0
+        self._emitted = -1
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for name, (priority, timeout) in (sources or DEFAULT_SOURCES).items():
+            self.add_source(name, priority, timeout)
+
+    def add_source(self, name: str, priority: int, timeout: float) -> CommandSource:
+        with self._lock:
+            source = CommandSource(name, priority, timeout)
+            self.sources[name] = source
+            return source
+
+    def submit(self, name: str, x: float, y: float, r: float,
+               timestamp: Optional[float] = None, lease: Optional[float] = None):
+        """Hand in the current command of a source; raises KeyError for unknown sources
+
+        `timestamp` is the time.monotonic() time of the input the command
+        was computed from and is passed on for latency measurement; leave
+        it None for keepalives that repeat an earlier command. `lease`
+        replaces the source timeout for this command, so a client streaming
+        at a low rate can say how long its command may be held.
+        """
+        now = time.monotonic()
+        with self._lock:
+            source = self.sources[name]
+            self._sequence += 1
+            source.command = Command(float(x), float(y), float(r), timestamp, now,
+                                     self._sequence, lease)
+            source.accepted += 1
+            active = self.sources.get(self.active)
+            wins = active is None or name == active.name or source.priority > active.priority
+        if wins:
+            self._wake.set()
+
+    def release(self, name: str):
+        """Drop the command of a source so lower priorities take over at once"""
+        with self._lock:
+            self.sources[name].command = None
+        self._wake.set()
+
+    def select(self, now: Optional[float] = None) -> Tuple[str, Optional[Command]]:
+        """Name and command of the source that currently wins, (IDLE, None) if none"""
+        if now is None:
+            now = time.monotonic()
+        best: Optional[CommandSource] = None
+        with self._lock:
+            for source in self.sources.values():
+                if source.command is None:
+                    continue
+                if not source.fresh(now):
+                    # Count every timed-out command once, then forget it
+                    source.expired += 1
+                    source.command = None
+                    logger.debug("Command of %s expired", source.name)
+                    continue
+                if best is None or source.priority > best.priority:
+                    best = source
+        if best is None:
+            return IDLE, None
+        return best.name, best.command
+
+    def step(self, now: Optional[float] = None):
+        """Select the winning command and emit it"""
+        name, command = self.select(now)
+        if name != self.active:
+            self.switches += 1
+            logger.info(f"Command source: {self.active} -> {name}")
+            self.active = name
+        if command is None:
+            self.output(0.0, 0.0, 0.0, name, None)
+            return
+        input_time = command.timestamp if command.sequence != self._emitted else None
+        self._emitted = command.sequence
+        self.output(command.x, command.y, command.r, name, input_time)
+
+    def _sleep(self, timeout: float):
+        # Wakes early for a command that wins the selection and applies it
+        if self._wake.wait(timeout):
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.step()
+
+    def run(self):
+        """Emit once per period until stop() is called"""
+        while not self._stop.is_set():
+            self.step()
+            self.loop.wait(self._sleep)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='command-arbiter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the arbiter thread; the last emitted command stays applied"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Accepted and expired commands per source"""
+        with self._lock:
+            return {name: {'priority': source.priority, 'timeout': source.timeout,
+                           'accepted': source.accepted, 'expired': source.expired}
+                    for name, source in self.sources.items()}
+
+    def summary(self) -> str:
+        parts = [f"{name} {values['accepted']} accepted/{values['expired']} expired"
+                 for name, values in self.stats().items()]
+        return f"{', '.join(parts)}; {self.switches} source switches; {self.loop.summary()}"
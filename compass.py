@@ -1,7 +1,13 @@
+import argparse
 import smbus
 import time
 import math
 import os
+import struct
+import numpy as np
+from imu_service import ImuService, mag_to_accel_frame
+from mag_calibration import fit_ellipsoid, load_calibration, save_calibration
+from orientation_filter import heading_from_field
 
 class MPU9250:
     # MPU9250 I2C address
@@ -15,6 +21,25 @@ class MPU9250:
     PWR_MGMT_2 = 0x6C
     INT_PIN_CFG = 0x37
     INT_ENABLE = 0x38
+    SMPLRT_DIV = 0x19
+    CONFIG = 0x1A
+    GYRO_CONFIG = 0x1B
+    ACCEL_CONFIG = 0x1C
+    ACCEL_CONFIG2 = 0x1D
+    FIFO_EN = 0x23
+    FIFO_COUNTH = 0x72
+    FIFO_R_W = 0x74
+
+    # FIFO: accel and gyro X/Y/Z as big-endian 16 bit, 12 bytes per sample
+    FIFO_EN_ACCEL_GYRO = 0x78
+    USER_CTRL_FIFO_EN = 0x40
+    USER_CTRL_FIFO_RST = 0x04
+    FIFO_SIZE = 512
+    FIFO_PACKET = 12
+    I2C_BLOCK_MAX = 32  # bytes per SMBus block read
+    GYRO_RATE = 1000.0  # Hz internal sample rate with the DLPF enabled
+    ACCEL_RANGES = {2: 0x00, 4: 0x08, 8: 0x10, 16: 0x18}  # g -> ACCEL_FS_SEL
+    GYRO_RANGES = {250: 0x00, 500: 0x08, 1000: 0x10, 2000: 0x18}  # deg/s -> GYRO_FS_SEL
 
     # AK8963 registers
     WHO_AM_I_AK8963 = 0x00
@@ -23,6 +48,14 @@ class MPU9250:
     AK8963_CNTL1 = 0x0A
     AK8963_CNTL2 = 0x0B
     AK8963_ASAX = 0x10
+    AK8963_ST2 = 0x09
+
+    # ST1, X/Y/Z little-endian 16 bit, ST2 in one block read starting at ST1;
+    # reading ST2 also releases the data registers for the next measurement
+    MAG_BLOCK = struct.Struct('<B3hB')
+    MAG_SCALE = 4912.0 / 32760.0  # uT per count at 16-bit output
+    ST1_DRDY = 0x01
+    ST2_HOFL = 0x08
 
     # Aachen-specific calibration
     AACHEN_DECLINATION = 2.0  # degrees East
@@ -30,21 +63,37 @@ class MPU9250:
     AACHEN_INCLINATION = 66.0  # degrees
 
     def __init__(self, bus_num=1):
+        self.bus_num = bus_num
         self.bus = smbus.SMBus(bus_num)
         self.mag_calibration = [0, 0, 0]
-
-        # Initialize calibration values
-        self.mag_x_min = float('inf')
-        self.mag_x_max = float('-inf')
-        self.mag_y_min = float('inf')
-        self.mag_y_max = float('-inf')
-        self.mag_z_min = float('inf')
-        self.mag_z_max = float('-inf')
+        # Per-axis uT per count including the factory sensitivity adjustment
+        self.mag_scale = [self.MAG_SCALE] * 3
+
+        # Bus statistics: I2C transactions, seconds spent in them and
+        # magnetometer samples delivered
+        self.transactions = 0
+        self.bus_time = 0.0
+        self.mag_samples = 0
+
+        # Accel/gyro FIFO, set up by configure_fifo()
+        self.fifo_rate = None
+        self.accel_scale = 2.0 / 32768.0  # g per count
+        self.gyro_scale = math.radians(250.0) / 32768.0  # rad/s per count
+        self.fifo_samples = 0
+        self.fifo_overflows = 0
+
+        # Hard/soft-iron calibration, loaded per sensor in init_ak8963() or
+        # fitted from REQUIRED_SAMPLES raw samples after start_calibration()
+        self.sensor_id = None
+        self.calibration = None
+        self.calibration_samples = []
+        self.calibrating = False
+        self.persist_calibration = False
 
         # Aachen-specific calibration flags
         self.is_calibrated = False
         self.samples_collected = 0
-        self.REQUIRED_SAMPLES = 100  # Number of samples needed for calibration
+        self.REQUIRED_SAMPLES = 1000  # Number of samples needed for calibration (10 s at 100 Hz)
 
     def initialize(self):
         who_am_i = self.read_byte(self.MPU9250_ADDRESS, self.WHO_AM_I_MPU9250)
@@ -99,6 +148,15 @@ class MPU9250:
 
         for i in range(3):
             self.mag_calibration[i] = (float(raw_data[i] - 128) / 256.0 + 1.0)
+        self.mag_scale = [self.MAG_SCALE * adjustment for adjustment in self.mag_calibration]
+
+        # The factory sensitivity values tell individual chips apart
+        self.sensor_id = f"i2c-{self.bus_num}-ak8963-{raw_data[0]:02x}{raw_data[1]:02x}{raw_data[2]:02x}"
+        self.calibration = load_calibration(self.sensor_id)
+        if self.calibration is not None:
+            self.is_calibrated = True
+            print(f"Loaded calibration for {self.sensor_id} "
+                  f"(offset {np.round(self.calibration.offset, 1).tolist()} μT)")
 
         print("Magnetometer Sensitivity Adjustment Values:")
         print(f"X-axis: {self.mag_calibration[0]:.3f}")
@@ -115,94 +173,169 @@ class MPU9250:
         print("AK8963 initialized")
 
     def read_mag_data(self):
-        if not (self.read_byte(self.AK8963_ADDRESS, self.AK8963_ST1) & 0x01):
-            return None
+        """One magnetometer sample in uT, None if none is ready or it overflowed
 
-        raw_data = self.read_bytes(self.AK8963_ADDRESS, self.AK8963_XOUT_L, 7)
+        ST1, the six data bytes and ST2 are fetched in a single block read,
+        so every call costs exactly one I2C transaction.
+        """
+        raw_data = self.read_bytes(self.AK8963_ADDRESS, self.AK8963_ST1, self.MAG_BLOCK.size)
+        st1, x, y, z, st2 = self.MAG_BLOCK.unpack(bytes(raw_data))
 
-        if raw_data[6] & 0x08:
+        if not (st1 & self.ST1_DRDY) or st2 & self.ST2_HOFL:
             return None
 
-        mag_count = [
-            int.from_bytes(raw_data[0:2], byteorder='little', signed=True),
-            int.from_bytes(raw_data[2:4], byteorder='little', signed=True),
-            int.from_bytes(raw_data[4:6], byteorder='little', signed=True)
-        ]
-
-        mag_data = [
-            mag_count[i] * 4912.0 / 32760.0 * self.mag_calibration[i]
-            for i in range(3)
-        ]
+        scale = self.mag_scale
+        mag_data = [x * scale[0], y * scale[1], z * scale[2]]
+        self.mag_samples += 1
 
-        # Update calibration data
-        self.update_calibration(mag_data)
+        # Calibration is fitted on raw samples, also when replacing an old one
+        if self.calibrating:
+            self.update_calibration(mag_data)
 
+        if self.calibration is not None:
+            return self.calibration.apply(mag_data).tolist()
         return mag_data
 
+    def configure_fifo(self, rate=1000, accel_range=2, gyro_range=250, dlpf=1):
+        """Sample accel and gyro at `rate` Hz (up to 1000) into the hardware FIFO
+
+        accel_range in g and gyro_range in deg/s select the full scale, dlpf
+        the digital low-pass setting (1: 184 Hz gyro bandwidth). At 1 kHz the
+        FIFO fills 12 kB/s, which needs the bus at 400 kHz.
+        """
+        if accel_range not in self.ACCEL_RANGES or gyro_range not in self.GYRO_RANGES:
+            raise ValueError("Unsupported accel or gyro range")
+        divider = max(0, min(255, round(self.GYRO_RATE / rate) - 1))
+        self.fifo_rate = self.GYRO_RATE / (divider + 1)
+        self.accel_scale = accel_range / 32768.0
+        self.gyro_scale = math.radians(gyro_range) / 32768.0
+
+        self.write_byte(self.MPU9250_ADDRESS, self.CONFIG, dlpf & 0x07)
+        self.write_byte(self.MPU9250_ADDRESS, self.SMPLRT_DIV, divider)
+        self.write_byte(self.MPU9250_ADDRESS, self.GYRO_CONFIG, self.GYRO_RANGES[gyro_range])
+        self.write_byte(self.MPU9250_ADDRESS, self.ACCEL_CONFIG, self.ACCEL_RANGES[accel_range])
+        self.write_byte(self.MPU9250_ADDRESS, self.ACCEL_CONFIG2, 0x01)  # accel DLPF 184 Hz
+        self.write_byte(self.MPU9250_ADDRESS, self.FIFO_EN, self.FIFO_EN_ACCEL_GYRO)
+        self.reset_fifo()
+        print(f"MPU9250 FIFO: accel/gyro at {self.fifo_rate:.0f} Hz")
+
+    def reset_fifo(self):
+        self.write_byte(self.MPU9250_ADDRESS, self.USER_CTRL, self.USER_CTRL_FIFO_RST)
+        self.write_byte(self.MPU9250_ADDRESS, self.USER_CTRL, self.USER_CTRL_FIFO_EN)
+
+    def read_fifo(self):
+        """Drain all complete samples from the FIFO
+
+        Returns (timestamps, accel, gyro): time.monotonic() estimates from
+        the sample rate, accel in g and gyro in rad/s as (n, 3) arrays, all
+        decoded in one vectorized step. The count costs one transaction and
+        the data as many 32-byte block reads as needed. A full FIFO means it
+        overflowed: 512 bytes are no whole number of packets, so the oldest
+        packet was overwritten and the boundaries are lost; the FIFO is then
+        reset and nothing is returned.
+        """
+        high, low = self.read_bytes(self.MPU9250_ADDRESS, self.FIFO_COUNTH, 2)
+        count = ((high & 0x1F) << 8) | low
+        now = time.monotonic()
+        if count >= self.FIFO_SIZE:
+            self.fifo_overflows += 1
+            self.reset_fifo()
+            count = 0
+        count -= count % self.FIFO_PACKET
+
+        data = bytearray()
+        while len(data) < count:
+            length = min(self.I2C_BLOCK_MAX, count - len(data))
+            data += bytes(self.read_bytes(self.MPU9250_ADDRESS, self.FIFO_R_W, length))
+
+        raw = np.frombuffer(bytes(data), dtype='>i2').reshape(-1, 6)
+        samples = len(raw)
+        self.fifo_samples += samples
+        # The newest sample is the one just taken, the others one period apart before it
+        timestamps = now - np.arange(samples - 1, -1, -1) / (self.fifo_rate or self.GYRO_RATE)
+        return timestamps, raw[:, :3] * self.accel_scale, raw[:, 3:] * self.gyro_scale
+
+    def start_calibration(self, persist=True):
+        """Collect the next REQUIRED_SAMPLES raw samples and fit a new calibration
+
+        The sensor has to be rotated through all orientations meanwhile. A
+        stored calibration stays in use until the new fit is accepted; with
+        `persist` the new one is then saved for this sensor.
+        """
+        self.calibration_samples = []
+        self.samples_collected = 0
+        self.persist_calibration = persist
+        self.calibrating = True
+
     def update_calibration(self, mag_data):
-        """Update calibration values and check field strength"""
-        if not self.is_calibrated:
-            self.mag_x_min = min(self.mag_x_min, mag_data[0])
-            self.mag_x_max = max(self.mag_x_max, mag_data[0])
-            self.mag_y_min = min(self.mag_y_min, mag_data[1])
-            self.mag_y_max = max(self.mag_y_max, mag_data[1])
-            self.mag_z_min = min(self.mag_z_min, mag_data[2])
-            self.mag_z_max = max(self.mag_z_max, mag_data[2])
-
-            self.samples_collected += 1
-            if self.samples_collected >= self.REQUIRED_SAMPLES:
-                self.is_calibrated = True
+        """Collect a raw sample and fit the hard/soft-iron calibration once there are enough"""
+        self.calibration_samples.append(mag_data)
+        self.samples_collected += 1
+        if self.samples_collected < self.REQUIRED_SAMPLES:
+            return
+        try:
+            calibration = fit_ellipsoid(self.calibration_samples,
+                                        expected_field=self.AACHEN_FIELD_STRENGTH / 1000.0)
+        except ValueError as e:
+            # Not rotated through enough orientations or disturbed, start over
+            print(f"Calibration rejected: {str(e)}")
+            self.calibration_samples = []
+            self.samples_collected = 0
+            return
+        self.calibration = calibration
+        self.calibration_samples = []
+        self.calibrating = False
+        self.is_calibrated = True
+        if self.persist_calibration and self.sensor_id is not None:
+            save_calibration(self.sensor_id, calibration)
+        print(f"Calibrated: field {calibration.radius:.1f} μT, residual {calibration.residual:.2f} μT")
 
     def calculate_heading(self, mag_data):
         """Calculate heading with Aachen-specific corrections"""
-        x = mag_data[0]
-        y = mag_data[1]
-
-        # Apply soft iron correction if calibrated
-        if self.is_calibrated:
-            x_centered = x - (self.mag_x_max + self.mag_x_min) / 2
-            y_centered = y - (self.mag_y_max + self.mag_y_min) / 2
-
-            # Scale correction
-            x_scale = (self.mag_x_max - self.mag_x_min) / 2
-            y_scale = (self.mag_y_max - self.mag_y_min) / 2
-            avg_scale = (x_scale + y_scale) / 2
-
-            if avg_scale != 0:
-                x_centered = x_centered * (avg_scale / x_scale)
-                y_centered = y_centered * (avg_scale / y_scale)
-        else:
-            x_centered = x
-            y_centered = y
-
-        # Calculate heading
-        heading = math.atan2(y_centered, x_centered)
-
-        # Convert to degrees
-        heading_deg = math.degrees(heading)
-
-        # Add Aachen's magnetic declination
-        heading_deg += self.AACHEN_DECLINATION
-
-        # Normalize to 0-360
-        heading_deg = (heading_deg + 360) % 360
-
-        return heading_deg
+        # Samples from read_mag_data() are already hard/soft-iron corrected
+        # once calibrated; the 3x3 matrix includes the Z axis. The heading is
+        # taken in the accel/gyro frame, with the same convention as the
+        # fused heading of the orientation filter.
+        return heading_from_field(mag_to_accel_frame(mag_data), self.AACHEN_DECLINATION)
+
+    def bus_stats(self):
+        """I2C transactions and bus time in total and per magnetometer sample"""
+        samples = self.mag_samples
+        return {
+            'transactions': self.transactions,
+            'bus_time': self.bus_time,
+            'samples': samples,
+            'transactions_per_sample': self.transactions / samples if samples else 0.0,
+            'bus_time_per_sample': self.bus_time / samples if samples else 0.0
+        }
 
     def get_calibration_status(self):
         """Return calibration progress"""
+        if self.calibrating:
+            return f"Calibrating: {(self.samples_collected / self.REQUIRED_SAMPLES * 100):.1f}%"
         if self.is_calibrated:
             return "Calibrated"
-        return f"Calibrating: {(self.samples_collected / self.REQUIRED_SAMPLES * 100):.1f}%"
+        return "Not calibrated (run with --calibrate)"
 
     def write_byte(self, address, register, value):
+        start = time.perf_counter()
         self.bus.write_byte_data(address, register, value)
+        self.bus_time += time.perf_counter() - start
+        self.transactions += 1
 
     def read_byte(self, address, register):
-        return self.bus.read_byte_data(address, register)
+        start = time.perf_counter()
+        value = self.bus.read_byte_data(address, register)
+        self.bus_time += time.perf_counter() - start
+        self.transactions += 1
+        return value
 
     def read_bytes(self, address, register, length):
-        return self.bus.read_i2c_block_data(address, register, length)
+        start = time.perf_counter()
+        data = self.bus.read_i2c_block_data(address, register, length)
+        self.bus_time += time.perf_counter() - start
+        self.transactions += 1
+        return data
 
 def create_direction_indicator(heading):
     """Create a visual direction indicator with cardinal points"""
@@ -225,20 +358,35 @@ def create_direction_indicator(heading):
     return ''.join(indicator) + f" {heading:>6.1f}°"
 
 def main():
+    parser = argparse.ArgumentParser(description="MPU9250 compass for Aachen")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="fit a new hard/soft-iron calibration and store it for this sensor")
+    args = parser.parse_args()
+
+    compass = None
+    service = None
     try:
         compass = MPU9250()
         compass.initialize()
+        if args.calibrate:
+            compass.start_calibration()
+
+        # Sampling runs at 100 Hz in the background, the display only reads the newest sample
+        service = ImuService(compass)
+        service.start()
 
         print("\nStarting compass readings (optimized for Aachen)...")
-        print("Please rotate the sensor 360° slowly for calibration")
+        if compass.calibrating:
+            print("Please rotate the sensor slowly through all orientations for calibration")
 
         while True:
-            mag_data = compass.read_mag_data()
+            sample = service.wait_for_sample(1.0)
 
-            if mag_data is None:
+            if sample is None:
                 continue
 
-            heading = compass.calculate_heading(mag_data)
+            mag_data = sample.mag
+            heading = sample.heading
 
             # Clear screen
             os.system('clear' if os.name == 'posix' else 'cls')
@@ -246,10 +394,10 @@ def main():
             # Print calibration status
             print(f"Calibration Status: {compass.get_calibration_status()}")
             if compass.is_calibrated:
-                print(f"\nCalibration Ranges:")
-                print(f"X: {compass.mag_x_min:.1f} to {compass.mag_x_max:.1f} μT")
-                print(f"Y: {compass.mag_y_min:.1f} to {compass.mag_y_max:.1f} μT")
-                print(f"Z: {compass.mag_z_min:.1f} to {compass.mag_z_max:.1f} μT")
+                calibration = compass.calibration
+                print(f"\nHard-iron offset: {np.round(calibration.offset, 1).tolist()} μT")
+                print(f"Field strength: {calibration.radius:.1f} μT "
+                      f"(residual {calibration.residual:.2f} μT)")
 
             # Print current values
             print(f"\nMagnetic Field (μT):")
@@ -265,6 +413,12 @@ def main():
 
     except KeyboardInterrupt:
         print("\nExiting...")
+        if service is not None:
+            service.stop()
+        if compass is not None:
+            stats = compass.bus_stats()
+            print(f"I2C: {stats['transactions_per_sample']:.2f} transactions and "
+                  f"{stats['bus_time_per_sample'] * 1e3:.2f} ms bus time per sample")
     except Exception as e:
         print(f"Error: {str(e)}")
 
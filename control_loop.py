@@ -0,0 +1,106 @@
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+class ControlLoop:
+    """Fixed-rate loop timing on absolute monotonic deadlines
+
+    Deadlines lie on a fixed grid start + k * period, so sleep inaccuracy
+    never accumulates into drift. An iteration that starts after its
+    deadline counts as an overrun; the loop then continues immediately and
+    realigns to the next grid point instead of bursting to catch up.
+    Statistics cover the last `window` iterations and can be read from
+    other threads while the loop runs.
+    """
+
+    def __init__(self, rate: float = 100.0, window: int = 1000):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.iterations = 0
+        self.overruns = 0
+        self._deadline: Optional[float] = None
+        self._last_wake: Optional[float] = None
+        self._periods: deque = deque(maxlen=window)
+        self._jitter: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def wait(self, sleep: Optional[Callable[[float], object]] = None) -> bool:
+        """Sleep until the next deadline, False if it had already passed
+
+        `sleep` is called with the remaining time until the deadline is
+        reached. It may return early, e.g. an input wait that wakes on
+        controller events, and is then called again.
+        """
+        sleep = sleep or time.sleep
+        now = time.monotonic()
+        if self._deadline is None:
+            self._deadline = now + self.period
+        on_time = now <= self._deadline
+        if on_time:
+            remaining = self._deadline - now
+            while remaining > 0:
+                sleep(remaining)
+                remaining = self._deadline - time.monotonic()
+        wake = time.monotonic()
+        with self._lock:
+            self.iterations += 1
+            if on_time:
+                self._jitter.append(wake - self._deadline)
+            else:
+                self.overruns += 1
+                self._jitter.append(now - self._deadline)
+            if self._last_wake is not None:
+                self._periods.append(wake - self._last_wake)
+        self._last_wake = wake
+        if on_time:
+            self._deadline += self.period
+        else:
+            # Skip the missed grid points and stay in phase
+            missed = int((wake - self._deadline) // self.period) + 1
+            self._deadline += missed * self.period
+        return on_time
+
+    def reset(self):
+        """Restart the deadline grid and clear the statistics"""
+        with self._lock:
+            self.iterations = 0
+            self.overruns = 0
+            self._deadline = None
+            self._last_wake = None
+            self._periods.clear()
+            self._jitter.clear()
+
+    def run(self, step: Callable[[], bool], stop: Optional[threading.Event] = None):
+        """Call step() once per period until it returns False or `stop` is set"""
+        while stop is None or not stop.is_set():
+            if step() is False:
+                return
+            self.wait()
+
+    def stats(self) -> Dict[str, float]:
+        """Mean period, p99 and max wake-up lateness and the overrun count"""
+        with self._lock:
+            periods = list(self._periods)
+            jitter = sorted(self._jitter)
+            iterations = self.iterations
+            overruns = self.overruns
+        return {
+            'rate': self.rate,
+            'iterations': iterations,
+            'overruns': overruns,
+            'period_mean': statistics.mean(periods) if periods else 0.0,
+            'jitter_p99': jitter[min(len(jitter) - 1, int(0.99 * len(jitter)))] if jitter else 0.0,
+            'jitter_max': jitter[-1] if jitter else 0.0
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (f"{stats['iterations']} iterations at {stats['rate']:.0f} Hz, "
+                f"period {stats['period_mean'] * 1e3:.2f} ms, "
+                f"jitter p99 {stats['jitter_p99'] * 1e6:.0f} us, max {stats['jitter_max'] * 1e6:.0f} us, "
+                f"{stats['overruns']} overruns")
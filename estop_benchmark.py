@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Measure emergency-stop latency while ramps and teleop frames are running
+
+Each trial starts long ramps on all motors plus a teleop thread applying
+random frames at the given rate, then triggers MotorController.emergency_stop()
+at a random moment. Reported are the time until the lock-free fast path had
+written 0 to all four EN pins and the time until the locked pass finished,
+after which no writer can produce a non-zero duty. With the simulated
+backend the recorded duty writes are also checked for non-zero duties
+reaching an EN pin between the fast path and the return of the stop call
+(a frame already past its flag check) and after the return (a real bug).
+
+    python3 estop_benchmark.py                     # simulated GPIO
+    python3 estop_benchmark.py --backend rpi       # on the robot
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from gpio_backend import SimulatedGPIOBackend, create_backend
+from motor_control import GPIOPins, MotorController
+
+EN_PINS = (GPIOPins.EN_A, GPIOPins.EN_B, GPIOPins.EN_C, GPIOPins.EN_D)
+
+
+def _teleop(controller: MotorController, rate: float, stop: threading.Event):
+    period = 1.0 / rate
+    deadline = time.monotonic()
+    while not stop.is_set():
+        controller.apply_frame(
+            {motor: random.choice(('forward', 'backward')) for motor in range(1, 5)},
+            {motor: random.uniform(20, 100) for motor in range(1, 5)})
+        deadline += period
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            stop.wait(delay)
+
+
+def _late_writes(gpio, after: float, before: float = float('inf')) -> int:
+    """Count non-zero duty writes to an EN pin recorded between `after` and `before`"""
+    return sum(1 for t, pin, kind, value in gpio.events()
+               if after < t < before and kind == gpio.DUTY and pin in EN_PINS and value > 0)
+
+
+def _summary(values):
+    ordered = sorted(values)
+    p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    return (f"min {ordered[0] * 1e6:.1f} us, mean {statistics.mean(ordered) * 1e6:.1f} us, "
+            f"p99 {p99 * 1e6:.1f} us, max {ordered[-1] * 1e6:.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=('sim', 'rpi'), default='sim')
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--teleop-rate', type=float, default=200.0, help="frames per second")
+    args = parser.parse_args()
+
+    gpio = create_backend(args.backend)
+    fast = []
+    latencies = []
+    window_writes = 0
+    late_writes = 0
+    with MotorController(gpio=gpio) as controller:
+        for _ in range(args.trials):
+            controller.reset_emergency_stop()
+            for motor in range(1, 5):
+                controller.ramp_motor(motor, 100, 2.0, start_speed=0)
+            stop_teleop = threading.Event()
+            teleop = threading.Thread(target=_teleop,
+                                      args=(controller, args.teleop_rate, stop_teleop))
+            teleop.start()
+            time.sleep(random.uniform(0.02, 0.08))
+
+            latencies.append(controller.emergency_stop())
+            end = time.perf_counter()
+            fast.append(controller.estop_fast_latency)
+
+            # Keep the load running for a moment to catch writes sneaking past the stop
+            time.sleep(0.02)
+            stop_teleop.set()
+            teleop.join()
+            if isinstance(gpio, SimulatedGPIOBackend):
+                window_writes += _late_writes(gpio, controller.estop_zeroed_at, end)
+                late_writes += _late_writes(gpio, end)
+                gpio.clear()
+
+    print(f"{args.trials} trials, teleop at {args.teleop_rate:.0f} Hz, ramps on all motors")
+    print(f"EN pins at 0 (fast path): {_summary(fast)}")
+    print(f"guaranteed stopped: {_summary(latencies)}")
+    if isinstance(gpio, SimulatedGPIOBackend):
+        print(f"non-zero duty writes between fast path and return: {window_writes}")
+        print(f"non-zero duty writes after stop: {late_writes}")
+
+
+if __name__ == "__main__":
+    main()
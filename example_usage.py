@@ -6,25 +6,27 @@ def main():
         movement = MotorMovement(controller)
         
         try:
-            # Example movement sequence
-            print("Moving forward...")
-            movement.forward()
-            
-            print("Turning right...")
-            movement.right()
-            
-            print("Moving backward...")
-            movement.backward()
-            
-            print("Turning left...")
-            movement.left()
+            # Example movement sequence, queued back-to-back on the motion executor
+            print("Queueing forward, right, backward, left...")
+            movement.forward(wait=False)
+            movement.right(wait=False)
+            movement.backward(wait=False)
+            last_move = movement.left(wait=False)
+
+            # Wait for the last queued move (the others run before it)
+            last_move.result()
+            print("Movement sequence completed")
             
         except KeyboardInterrupt:
             print("\nProgram interrupted by user")
+            movement.cancel()
             controller.emergency_stop()
         except Exception as e:
             print(f"An error occurred: {str(e)}")
+            movement.cancel()
             controller.emergency_stop()
+        finally:
+            movement.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,270 @@
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Present on every Raspberry Pi, with the board name
+DEVICE_TREE_MODEL = '/proc/device-tree/model'
+
+
+class PWMChannel(ABC):
+    """Interface of a PWM output, matching RPi.GPIO.PWM"""
+
+    @abstractmethod
+    def start(self, duty: float):
+        pass
+
+    @abstractmethod
+    def ChangeDutyCycle(self, duty: float):
+        pass
+
+    @abstractmethod
+    def ChangeFrequency(self, frequency: float):
+        pass
+
+    @abstractmethod
+    def stop(self):
+        pass
+
+
+class GPIOBackend(ABC):
+    """Interface the motor code talks to instead of the RPi.GPIO module
+
+    Method names and constants mirror RPi.GPIO so a backend can be used
+    wherever the module was used before.
+    """
+    BCM = 11
+    OUT = 0
+    IN = 1
+    HIGH = 1
+    LOW = 0
+
+    @abstractmethod
+    def setmode(self, mode):
+        pass
+
+    @abstractmethod
+    def setwarnings(self, flag: bool):
+        pass
+
+    @abstractmethod
+    def setup(self, pin: int, mode):
+        pass
+
+    @abstractmethod
+    def output(self, pin: int, level: int):
+        pass
+
+    @abstractmethod
+    def PWM(self, pin: int, frequency: float) -> PWMChannel:
+        pass
+
+    @abstractmethod
+    def cleanup(self):
+        pass
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """Backend driving the real pins through RPi.GPIO"""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        self.BCM = GPIO.BCM
+        self.OUT = GPIO.OUT
+        self.IN = GPIO.IN
+        self.HIGH = GPIO.HIGH
+        self.LOW = GPIO.LOW
+        # Bind the module functions directly so the hot path has no extra call
+        self.setmode = GPIO.setmode
+        self.setwarnings = GPIO.setwarnings
+        self.setup = GPIO.setup
+        self.output = GPIO.output
+        self.PWM = GPIO.PWM
+        self.cleanup = GPIO.cleanup
+
+    # The instance attributes above shadow these; they only implement the
+    # abstract interface for the class itself
+    def setmode(self, mode):
+        self._gpio.setmode(mode)
+
+    def setwarnings(self, flag: bool):
+        self._gpio.setwarnings(flag)
+
+    def setup(self, pin: int, mode):
+        self._gpio.setup(pin, mode)
+
+    def output(self, pin: int, level: int):
+        self._gpio.output(pin, level)
+
+    def PWM(self, pin: int, frequency: float) -> PWMChannel:
+        return self._gpio.PWM(pin, frequency)
+
+    def cleanup(self):
+        self._gpio.cleanup()
+
+
+class SimulatedGPIOBackend(GPIOBackend):
+    """In-memory backend recording every pin transition and duty change
+
+    Events are appended to parallel typed arrays (time, pin, kind, value),
+    about 17 bytes per event, so the control loop can run off-robot at
+    full speed and be analyzed afterwards.
+    """
+    SETUP = 0
+    OUTPUT = 1
+    PWM_START = 2
+    DUTY = 3
+    FREQUENCY = 4
+    PWM_STOP = 5
+    CLEANUP = 6
+
+    def __init__(self, record: bool = True):
+        self.record = record
+        self._lock = threading.Lock()
+        self.mode = None
+        self.levels: Dict[int, int] = {}
+        self.duties: Dict[int, float] = {}
+        self.clear()
+
+    def clear(self):
+        """Drop all recorded events"""
+        with self._lock:
+            self.times = array('d')
+            self.pins = array('B')
+            self.kinds = array('B')
+            self.values = array('f')
+
+    def _record(self, pin: int, kind: int, value: float):
+        if not self.record:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self.times.append(now)
+            self.pins.append(pin)
+            self.kinds.append(kind)
+            self.values.append(value)
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag: bool):
+        pass
+
+    def setup(self, pin: int, mode):
+        self.levels.setdefault(pin, self.LOW)
+        self._record(pin, self.SETUP, mode)
+
+    def output(self, pin: int, level: int):
+        self.levels[pin] = level
+        self._record(pin, self.OUTPUT, level)
+
+    def PWM(self, pin: int, frequency: float) -> 'SimulatedPWM':
+        return SimulatedPWM(self, pin, frequency)
+
+    def cleanup(self):
+        self.levels.clear()
+        self.duties.clear()
+        self._record(0, self.CLEANUP, 0)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def events(self) -> Iterator[Tuple[float, int, int, float]]:
+        """Iterate over recorded (time, pin, kind, value) tuples"""
+        with self._lock:
+            return iter(list(zip(self.times, self.pins, self.kinds, self.values)))
+
+    def to_numpy(self):
+        """Return the recorded events as a NumPy structured array"""
+        import numpy as np
+        with self._lock:
+            events = np.empty(len(self.times), dtype=[
+                ('time', 'f8'), ('pin', 'u1'), ('kind', 'u1'), ('value', 'f4')])
+            events['time'] = np.frombuffer(self.times, dtype='f8')
+            events['pin'] = np.frombuffer(self.pins, dtype='u1')
+            events['kind'] = np.frombuffer(self.kinds, dtype='u1')
+            events['value'] = np.frombuffer(self.values, dtype='f4')
+        return events
+
+
+class SimulatedPWM(PWMChannel):
+    """PWM channel of the simulated backend"""
+
+    def __init__(self, backend: SimulatedGPIOBackend, pin: int, frequency: float):
+        self.backend = backend
+        self.pin = pin
+        self.frequency = frequency
+
+    def start(self, duty: float):
+        self._check(duty)
+        self.backend.duties[self.pin] = duty
+        self.backend._record(self.pin, self.backend.PWM_START, duty)
+
+    def ChangeDutyCycle(self, duty: float):
+        self._check(duty)
+        self.backend.duties[self.pin] = duty
+        self.backend._record(self.pin, self.backend.DUTY, duty)
+
+    def ChangeFrequency(self, frequency: float):
+        self.frequency = frequency
+        self.backend._record(self.pin, self.backend.FREQUENCY, frequency)
+
+    def stop(self):
+        self.backend.duties.pop(self.pin, None)
+        self.backend._record(self.pin, self.backend.PWM_STOP, 0)
+
+    @staticmethod
+    def _check(duty: float):
+        if not 0.0 <= duty <= 100.0:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+
+
+_default_backend: Optional[GPIOBackend] = None
+_default_lock = threading.Lock()
+
+
+def is_raspberry_pi() -> bool:
+    try:
+        with open(DEVICE_TREE_MODEL, 'rb') as f:
+            return b'Raspberry Pi' in f.read()
+    except OSError:
+        return False
+
+
+def create_backend(name: str = 'auto') -> GPIOBackend:
+    """Create a backend by name: 'rpi', 'sim' or 'auto' (rpi if available)
+
+    'auto' only falls back to the simulator off the Pi. On the robot a
+    missing RPi.GPIO is an error, otherwise the motors would silently not
+    move; set ROBODOM_GPIO=sim there to simulate on purpose.
+    """
+    if name == 'rpi':
+        return RPiGPIOBackend()
+    if name == 'sim':
+        return SimulatedGPIOBackend()
+    if name == 'auto':
+        try:
+            return RPiGPIOBackend()
+        except ImportError:
+            if is_raspberry_pi():
+                raise RuntimeError("RPi.GPIO is not installed on this Raspberry Pi; "
+                                   "install it or set ROBODOM_GPIO=sim to simulate")
+            logger.warning("RPi.GPIO not available, using simulated GPIO backend")
+            return SimulatedGPIOBackend()
+    raise ValueError(f"Unknown GPIO backend: {name}")
+
+
+def get_backend() -> GPIOBackend:
+    """Return the process-wide backend selected by $ROBODOM_GPIO (default auto)"""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = create_backend(os.environ.get('ROBODOM_GPIO', 'auto'))
+        return _default_backend
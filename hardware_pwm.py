@@ -0,0 +1,150 @@
+import os
+import time
+from typing import Dict, Tuple
+
+from gpio_backend import PWMChannel
+
+SYSFS_PWM_ROOT = '/sys/class/pwm'
+
+# BCM pin -> (pwmchip, channel). This is the Raspberry Pi 5 layout where
+# GPIO 12, 13, 18 and 19 are the four independent channels of PWM0
+# (dtoverlay=pwm-2chan,... or pinctrl set to the PWM function). On a Pi 4
+# only two channels exist: 12/18 share channel 0 and 13/19 share channel 1,
+# so pass a different map there and expect paired motors to share a duty.
+HARDWARE_PWM_CHANNELS: Dict[int, Tuple[int, int]] = {
+    12: (0, 0),
+    13: (0, 1),
+    18: (0, 2),
+    19: (0, 3)
+}
+
+EXPORT_TIMEOUT = 1.0
+
+
+class HardwarePWM(PWMChannel):
+    """Kernel pwmchip sysfs PWM with the same interface as RPi.GPIO.PWM
+
+    The waveform is generated by the PWM peripheral, so there is no timing
+    thread per motor. A duty change is a single pwrite() on a file
+    descriptor that stays open for the lifetime of the channel. Values are
+    newline terminated like `echo` writes them, which also keeps shorter
+    values readable when the target is a regular file in a fake tree.
+    """
+
+    def __init__(self, pin: int, frequency: float,
+                 sysfs_root: str = SYSFS_PWM_ROOT,
+                 channels: Dict[int, Tuple[int, int]] = HARDWARE_PWM_CHANNELS):
+        if pin not in channels:
+            raise ValueError(f"GPIO {pin} has no hardware PWM channel")
+        chip, channel = channels[pin]
+        self.pin = pin
+        self.chip_path = os.path.join(sysfs_root, f"pwmchip{chip}")
+        self.channel = channel
+        self.path = os.path.join(self.chip_path, f"pwm{channel}")
+        self.period_ns = self._period_ns(frequency)
+        self.duty = 0.0
+        self._duty_fd = None
+        self._exported_here = False
+
+    @staticmethod
+    def _period_ns(frequency: float) -> int:
+        if frequency <= 0:
+            raise ValueError(f"Invalid PWM frequency: {frequency}")
+        return int(round(1e9 / frequency))
+
+    def _write(self, name: str, value):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(f"{value}\n")
+
+    def _export(self):
+        if os.path.isdir(self.path):
+            return
+        with open(os.path.join(self.chip_path, 'export'), 'w') as f:
+            f.write(str(self.channel))
+        self._exported_here = True
+        # udev needs a moment to create the channel and fix its permissions
+        deadline = time.monotonic() + EXPORT_TIMEOUT
+        while not os.access(os.path.join(self.path, 'duty_cycle'), os.W_OK):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Timeout exporting {self.path}")
+            time.sleep(0.01)
+
+    def _duty_ns(self, duty: float) -> int:
+        return int(self.period_ns * duty / 100.0)
+
+    def start(self, duty: float):
+        """Export the channel, program period and duty and enable the output"""
+        self._export()
+        self._write('enable', 0)
+        # The kernel rejects a duty_cycle larger than the period, so clear it first
+        self._write('duty_cycle', 0)
+        self._write('period', self.period_ns)
+        self._duty_fd = os.open(os.path.join(self.path, 'duty_cycle'), os.O_WRONLY)
+        self.ChangeDutyCycle(duty)
+        self._write('enable', 1)
+
+    def ChangeDutyCycle(self, duty: float):
+        if not 0.0 <= duty <= 100.0:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        if self._duty_fd is None:
+            raise RuntimeError(f"PWM on GPIO {self.pin} not started")
+        os.pwrite(self._duty_fd, b'%d\n' % self._duty_ns(duty), 0)
+        self.duty = duty
+
+    def ChangeFrequency(self, frequency: float):
+        period_ns = self._period_ns(frequency)
+        if self._duty_fd is None:
+            self.period_ns = period_ns
+            return
+        os.pwrite(self._duty_fd, b'0\n', 0)
+        self._write('period', period_ns)
+        self.period_ns = period_ns
+        self.ChangeDutyCycle(self.duty)
+
+    def stop(self):
+        """Disable the output and release the channel, also after a failed start()"""
+        if self._duty_fd is not None:
+            os.pwrite(self._duty_fd, b'0\n', 0)
+            os.close(self._duty_fd)
+            self._duty_fd = None
+            self._write('enable', 0)
+        if self._exported_here:
+            with open(os.path.join(self.chip_path, 'unexport'), 'w') as f:
+                f.write(str(self.channel))
+            self._exported_here = False
+
+
+def create_pwm(gpio, pin: int, frequency: float, pwm_mode: str = 'software',
+               sysfs_root: str = SYSFS_PWM_ROOT):
+    """Create a software (RPi.GPIO) or hardware (sysfs) PWM on an EN pin"""
+    if pwm_mode == 'software':
+        return gpio.PWM(pin, frequency)
+    if pwm_mode == 'hardware':
+        return HardwarePWM(pin, frequency, sysfs_root)
+    raise ValueError(f"Unknown PWM mode: {pwm_mode}")
+
+
+def make_fake_pwmchip(root: str, chip: int = 0, npwm: int = 4) -> str:
+    """Create a fake pwmchip sysfs tree under root, returns root
+
+    All channels are pre-created so export is a no-op, which is enough to
+    exercise HardwarePWM and the benchmark without a Raspberry Pi.
+    """
+    chip_path = os.path.join(root, f"pwmchip{chip}")
+    os.makedirs(chip_path, exist_ok=True)
+    for name, value in (('npwm', npwm), ('export', ''), ('unexport', '')):
+        with open(os.path.join(chip_path, name), 'w') as f:
+            f.write(f"{value}\n")
+    for channel in range(npwm):
+        channel_path = os.path.join(chip_path, f"pwm{channel}")
+        os.makedirs(channel_path, exist_ok=True)
+        for name in ('period', 'duty_cycle', 'enable'):
+            with open(os.path.join(channel_path, name), 'w') as f:
+                f.write('0\n')
+    return root
+
+
+def read_attribute(root: str, chip: int, channel: int, name: str) -> int:
+    """Read an integer channel attribute such as duty_cycle or enable"""
+    with open(os.path.join(root, f"pwmchip{chip}", f"pwm{channel}", name)) as f:
+        return int(f.readline())
@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from orientation_filter import MadgwickFilter, Quaternion, heading_from_quaternion
+
+logger = logging.getLogger(__name__)
+
+MAG_RATE = 100.0  # Hz, AK8963 continuous measurement mode 2
+RETRY_INTERVAL = 0.001  # seconds between polls while the next sample is not ready yet
+DEFAULT_HISTORY = 3000  # samples, 30 s at 100 Hz
+DEFAULT_INERTIAL_HISTORY = 10000  # samples, 10 s at 1 kHz
+
+# Columns of the history array
+T, MAG_X, MAG_Y, MAG_Z, HEADING = range(5)
+# Columns of the inertial history array
+ACCEL_X, ACCEL_Y, ACCEL_Z, GYRO_X, GYRO_Y, GYRO_Z = range(1, 7)
+
+
+def mag_to_accel_frame(mag) -> Tuple[float, float, float]:
+    """AK8963 axes in the accel/gyro frame: X and Y swapped, Z inverted"""
+    return mag[1], mag[0], -mag[2]
+
+
+class ImuSample(NamedTuple):
+    """One magnetometer sample with the heading derived from it"""
+    timestamp: float  # time.monotonic() when the sample was read
+    mag: Tuple[float, float, float]  # uT
+    heading: float  # degrees, 0..360
+    sequence: int
+
+
+class InertialSample(NamedTuple):
+    """Newest accel/gyro sample from the FIFO"""
+    timestamp: float
+    accel: Tuple[float, float, float]  # g
+    gyro: Tuple[float, float, float]  # rad/s
+
+
+class Orientation(NamedTuple):
+    """Fused orientation after the newest FIFO sample"""
+    timestamp: float
+    quaternion: Quaternion  # (w, x, y, z)
+    heading: float  # degrees, 0..360, declination applied
+
+
+class SampleRing:
+    """Bounded NumPy history of fixed-width rows, oldest rows overwritten"""
+
+    def __init__(self, capacity: int, columns: int):
+        self._rows = np.zeros((capacity, columns))
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def append(self, row):
+        with self._lock:
+            self._rows[self.written % len(self._rows)] = row
+            self.written += 1
+
+    def extend(self, rows: np.ndarray):
+        """Append a block of rows with at most two slice assignments"""
+        capacity = len(self._rows)
+        rows = rows[-capacity:]
+        with self._lock:
+            start = self.written % capacity
+            first = min(len(rows), capacity - start)
+            self._rows[start:start + first] = rows[:first]
+            self._rows[:len(rows) - first] = rows[first:]
+            self.written += len(rows)
+
+    def last(self, count: Optional[int] = None) -> np.ndarray:
+        """Copy of the last `count` rows, oldest first"""
+        with self._lock:
+            capacity = len(self._rows)
+            available = min(self.written, capacity)
+            count = available if count is None else min(count, available)
+            end = self.written % capacity
+            if count <= end:
+                return self._rows[end - count:end].copy()
+            return np.concatenate((self._rows[capacity - (count - end):], self._rows[:end]))
+
+
+class ImuService:
+    """Sample the compass in a background thread and publish the results
+
+    The thread follows the sensor's own 100 Hz clock: after a sample it
+    sleeps until shortly before the next one is due and then polls with a
+    short retry interval, so no sample is missed and the bus is not polled
+    in a loop. Readers get the newest sample from `latest`, a single
+    reference that is replaced atomically and needs no lock, and windows of
+    past samples from a bounded NumPy ring. Nobody but the thread touches
+    the bus.
+
+    If the compass has its accel/gyro FIFO configured, the thread also
+    drains it after every magnetometer sample and at least once per
+    magnetometer period while the magnetometer fails, so a run of bad mag
+    reads cannot let it overflow; at 1 kHz that is about ten samples, well
+    within the 512-byte FIFO. They go to `latest_inertial`
+    and a second ring, and each block runs through a Madgwick filter with
+    the newest magnetometer sample. The filter integrates every gyro
+    sample, but `latest_orientation` is published once per drain, i.e.
+    about every 10 ms. Until the compass is calibrated the magnetometer is
+    left out of the fusion, since hard iron would pull the heading off;
+    roll and pitch are still corrected and the heading follows the gyro.
+    """
+
+    def __init__(self, compass, rate: float = MAG_RATE, history: int = DEFAULT_HISTORY,
+                 inertial_history: int = DEFAULT_INERTIAL_HISTORY):
+        self.compass = compass
+        self.period = 1.0 / rate
+        self.latest: Optional[ImuSample] = None
+        self.latest_inertial: Optional[InertialSample] = None
+        self.latest_orientation: Optional[Orientation] = None
+        self.filter = MadgwickFilter()
+        self.declination = getattr(compass, 'AACHEN_DECLINATION', 0.0)
+        self.samples = 0
+        self.inertial_samples = 0
+        self.polls = 0
+        self.errors = 0
+        self._history = SampleRing(history, 5)
+        self._inertial_history = SampleRing(inertial_history, 7)
+        self._next_drain = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='imu-service', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    @property
+    def heading(self) -> Optional[float]:
+        sample = self.latest
+        return sample.heading if sample is not None else None
+
+    @property
+    def fused_heading(self) -> Optional[float]:
+        """Heading from the orientation filter, refreshed once per FIFO drain, None without FIFO"""
+        orientation = self.latest_orientation
+        return orientation.heading if orientation is not None else None
+
+    def wait_for_sample(self, timeout: float) -> Optional[ImuSample]:
+        """Newest sample, waiting up to `timeout` for the first one"""
+        deadline = time.monotonic() + timeout
+        while self.latest is None and time.monotonic() < deadline:
+            if self._stop.wait(self.period):
+                break
+        return self.latest
+
+    def history(self, count: Optional[int] = None) -> np.ndarray:
+        """Copy of the last `count` samples, oldest first, one row (t, x, y, z, heading) each"""
+        return self._history.last(count)
+
+    def inertial_history(self, count: Optional[int] = None) -> np.ndarray:
+        """Last `count` FIFO samples as rows (t, ax, ay, az, gx, gy, gz), oldest first"""
+        return self._inertial_history.last(count)
+
+    def _publish(self, now: float, mag):
+        heading = self.compass.calculate_heading(mag)
+        self.samples += 1
+        self._history.append((now, mag[0], mag[1], mag[2], heading))
+        self.latest = ImuSample(now, (mag[0], mag[1], mag[2]), heading, self.samples)
+
+    def _drain_fifo(self):
+        timestamps, accel, gyro = self.compass.read_fifo()
+        if not len(timestamps):
+            return
+        self._inertial_history.extend(np.column_stack((timestamps, accel, gyro)))
+        self.inertial_samples += len(timestamps)
+        self.latest_inertial = InertialSample(float(timestamps[-1]), tuple(accel[-1].tolist()),
+                                              tuple(gyro[-1].tolist()))
+        sample = self.latest
+        mag = None
+        if sample is not None and getattr(self.compass, 'is_calibrated', False):
+            mag = np.array(mag_to_accel_frame(sample.mag))
+        quaternions = self.filter.update_batch(gyro, accel, mag, 1.0 / self.compass.fifo_rate)
+        quaternion = tuple(quaternions[-1].tolist())
+        self.latest_orientation = Orientation(float(timestamps[-1]), quaternion,
+                                              heading_from_quaternion(quaternion, self.declination))
+
+    def _drain(self, now: float):
+        """Drain the FIFO, if configured, and schedule the next drain one period later"""
+        self._next_drain = now + self.period
+        if not getattr(self.compass, 'fifo_rate', None):
+            return
+        try:
+            self._drain_fifo()
+        except OSError as e:
+            self.errors += 1
+            logger.warning(f"IMU FIFO read failed: {str(e)}")
+
+    def _run(self):
+        next_poll = time.monotonic()
+        self._next_drain = next_poll + self.period
+        while not self._stop.is_set():
+            delay = next_poll - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            try:
+                mag = self.compass.read_mag_data()
+            except OSError as e:
+                # A disturbed bus transfer; skip this sample instead of dying
+                self.errors += 1
+                logger.warning(f"IMU read failed: {str(e)}")
+                now = time.monotonic()
+                next_poll = now + self.period
+                # The FIFO keeps filling whatever the magnetometer does
+                if now >= self._next_drain:
+                    self._drain(now)
+                continue
+            self.polls += 1
+            now = time.monotonic()
+            if mag is None:
+                next_poll = now + RETRY_INTERVAL
+                if now >= self._next_drain:
+                    self._drain(now)
+                continue
+            self._publish(now, mag)
+            self._drain(now)
+            # Wake a little before the sensor's next sample is due
+            next_poll = now + self.period * 0.9
+
+    def stats(self):
+        return {
+            'samples': self.samples,
+            'inertial_samples': self.inertial_samples,
+            'polls': self.polls,
+            'errors': self.errors,
+            'polls_per_sample': self.polls / self.samples if self.samples else 0.0
+        }
+
+
+def start_imu_service(bus_num: int = 1, fifo_rate: Optional[float] = None,
+                      **kwargs) -> ImuService:
+    """Initialize the MPU9250/AK8963 on an I2C bus and start sampling it
+
+    With `fifo_rate` accel and gyro are sampled through the FIFO as well.
+    """
+    from compass import MPU9250
+    compass = MPU9250(bus_num)
+    compass.initialize()
+    if fifo_rate:
+        compass.configure_fifo(fifo_rate)
+    service = ImuService(compass, **kwargs)
+    service.start()
+    return service
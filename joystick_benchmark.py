@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Benchmark the teleop path input -> mix -> GPIO on a recorded controller stream
+
+Replays a joystick recording through the same steps as live_control
+(joystick_command, AxisShaper, mix, MecanumRobot.set_wheel_duties) onto the simulated
+GPIO backend, so no pad or robot is needed. The report contains the cost
+per input change, the process CPU time, the GPIO writes issued and skipped,
+and a digest of the written pin/value sequence; identical input must give
+an identical digest across releases. Without --realtime the shaper runs on
+the recorded clock, so slew limiting stays deterministic.
+
+    python3 joystick_benchmark.py record drive.rdjs --duration 30   # from the pad
+    python3 joystick_benchmark.py synth drive.rdjs --duration 60    # synthetic stick sweeps
+    python3 joystick_benchmark.py run drive.rdjs                    # as fast as possible
+    python3 joystick_benchmark.py run drive.rdjs --realtime
+"""
+import argparse
+import hashlib
+import math
+import resource
+import statistics
+import time
+
+from axis_shaping import AxisShaper
+from gpio_backend import SimulatedGPIOBackend
+from joystick_input import joystick_command, open_joystick
+from joystick_recording import AXIS, JoystickRecorder, ReplayJoystickInput, read_recording
+from mecanum_kinematics import MAX_DUTY_CYCLE, mix
+
+KEEPALIVE = 0.5
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def record(path: str, backend: str, duration: float):
+    inputs = open_joystick(backend, record=path)
+    print(f"Recording {inputs.name} to {path} for {duration:.0f} s")
+    end = time.monotonic() + duration
+    try:
+        while not inputs.quit and time.monotonic() < end:
+            inputs.wait(min(KEEPALIVE, max(0.0, end - time.monotonic())))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inputs.close()
+
+
+def synthesize(path: str, duration: float, rate: float):
+    """Left stick circling, right stick rotation sweeping, at `rate` changes per second"""
+    recorder = JoystickRecorder(path)
+    for step in range(int(duration * rate)):
+        t = step / rate
+        recorder.write(t, AXIS, 0, math.cos(2 * math.pi * 0.25 * t))
+        recorder.write(t, AXIS, 1, math.sin(2 * math.pi * 0.25 * t))
+        recorder.write(t, AXIS, 2, math.sin(2 * math.pi * 0.1 * t))
+    recorder.close()
+
+
+def run(path: str, realtime: bool) -> dict:
+    """Drive the simulated robot from the recording like live_control does"""
+    from motor_control_4 import MecanumRobot
+    gpio = SimulatedGPIOBackend()
+    robot = MecanumRobot(gpio=gpio)
+    inputs = ReplayJoystickInput(path, realtime=realtime, records=read_recording(path))
+    gpio.clear()
+    robot.shadow.reset_stats()
+    shaper = AxisShaper()
+    costs = []
+    last_sequence = inputs.state.sequence
+    cpu_start = _cpu_seconds()
+    wall_start = time.perf_counter()
+    while True:
+        inputs.wait(KEEPALIVE if shaper.settled else shaper.tick)
+        if inputs.quit:
+            break
+        start = time.perf_counter()
+        x, y, r = shaper.shape(*joystick_command(inputs.state), None if realtime else inputs.offset)
+        input_time = inputs.state.timestamp if inputs.state.sequence != last_sequence else None
+        last_sequence = inputs.state.sequence
+        robot.set_wheel_duties(mix(x, y, r, MAX_DUTY_CYCLE, robot.polarity), input_time)
+        costs.append(time.perf_counter() - start)
+    wall = time.perf_counter() - wall_start
+    cpu = _cpu_seconds() - cpu_start
+    digest = hashlib.sha1()
+    digest.update(gpio.pins.tobytes())
+    digest.update(gpio.kinds.tobytes())
+    digest.update(gpio.values.tobytes())
+    return {'records': len(inputs.records), 'iterations': len(costs), 'costs': costs,
+            'wall': wall, 'cpu': cpu, 'writes': robot.shadow.stats(), 'digest': digest.hexdigest(),
+            'latency': robot.latency.summary()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    rec = commands.add_parser('record', help="record the controller stream")
+    rec.add_argument('path')
+    rec.add_argument('--backend', choices=('auto', 'evdev', 'pygame'), default=None)
+    rec.add_argument('--duration', type=float, default=30.0)
+    synth = commands.add_parser('synth', help="write a synthetic recording")
+    synth.add_argument('path')
+    synth.add_argument('--duration', type=float, default=60.0)
+    synth.add_argument('--rate', type=float, default=100.0, help="changes per second")
+    bench = commands.add_parser('run', help="replay a recording into the drive path")
+    bench.add_argument('path')
+    bench.add_argument('--realtime', action='store_true', help="keep the recorded timing")
+    bench.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.path, args.backend, args.duration)
+    elif args.command == 'synth':
+        synthesize(args.path, args.duration, args.rate)
+    else:
+        for _ in range(args.repeat):
+            result = run(args.path, args.realtime)
+            costs = sorted(result['costs']) or [0.0]
+            p99 = costs[min(len(costs) - 1, int(0.99 * len(costs)))]
+            print(f"{result['records']} records, {result['iterations']} mixes in {result['wall']:.3f} s, "
+                  f"CPU {result['cpu']:.3f} s")
+            print(f"  per mix: mean {statistics.mean(costs) * 1e6:.1f} us, "
+                  f"p99 {p99 * 1e6:.1f} us, max {costs[-1] * 1e6:.1f} us")
+            print(f"  GPIO writes: {result['writes']['issued']} issued, "
+                  f"{result['writes']['suppressed']} suppressed, digest {result['digest'][:16]}")
+            print(f"  {result['latency']}")
+
+
+if __name__ == "__main__":
+    main()
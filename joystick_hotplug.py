@@ -0,0 +1,168 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import threading
+from typing import Callable, Optional
+
+from joystick_input import EvdevJoystickInput, JoystickInput, JoystickState, find_evdev_joystick
+
+logger = logging.getLogger(__name__)
+
+INPUT_DIRECTORIES = ('/dev/input', '/dev/input/by-id')
+# IN_ATTRIB catches udev fixing up permissions after the node was created
+IN_ATTRIB, IN_CREATE, IN_DELETE = 0x004, 0x100, 0x200
+RESCAN_INTERVAL = 0.25  # seconds, fallback when inotify is not available
+
+
+class DeviceWatcher:
+    """Background thread tracking whether a joystick device is present
+
+    Sleeps in inotify on /dev/input and wakes on every created, removed or
+    changed device node, so a reconnected pad is noticed within
+    milliseconds. Without inotify the directories are rescanned every
+    RESCAN_INTERVAL seconds.
+    """
+
+    def __init__(self, find: Callable[[], Optional[str]] = find_evdev_joystick,
+                 directories=INPUT_DIRECTORIES):
+        self.find = find
+        self.directories = directories
+        self.path: Optional[str] = None
+        self.present = threading.Event()
+        self._stop = threading.Event()
+        self._wake_read, self._wake_write = os.pipe()
+        self._inotify = self._init_inotify()
+        self._thread: Optional[threading.Thread] = None
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return libc, fd
+
+    def _add_watches(self):
+        libc, fd = self._inotify
+        for directory in self.directories:
+            # Adding an existing watch again is a no-op; by-id only exists
+            # while at least one device is connected
+            if os.path.isdir(directory):
+                libc.inotify_add_watch(fd, directory.encode(), IN_CREATE | IN_DELETE | IN_ATTRIB)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='joystick-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        os.write(self._wake_write, b'\0')
+        self._thread.join()
+        self._thread = None
+        if self._inotify is not None:
+            os.close(self._inotify[1])
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def rescan(self):
+        """Forget the reported device until the next change or rescan"""
+        self.present.clear()
+
+    def wait_for_device(self, timeout: float) -> Optional[str]:
+        """Path of a present device, waiting up to `timeout` for one"""
+        if self.present.wait(timeout):
+            return self.path
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._inotify is not None:
+                self._add_watches()
+            path = self.find()
+            self.path = path
+            if path is None:
+                self.present.clear()
+            else:
+                self.present.set()
+            self._wait_for_change()
+
+    def _wait_for_change(self):
+        fds = [self._wake_read]
+        if self._inotify is not None:
+            fds.append(self._inotify[1])
+        readable, _, _ = select.select(fds, [], [], RESCAN_INTERVAL)
+        for fd in readable:
+            try:
+                os.read(fd, 4096)
+            except BlockingIOError:
+                pass
+
+
+class HotplugEvdevJoystickInput(JoystickInput):
+    """Evdev controller input that survives the pad going away
+
+    When the device disappears the state drops to neutral and `connected`
+    turns False; wait() then blocks on the DeviceWatcher and reopens the
+    pad as soon as it is back, reading its current state from the kernel.
+    `device` pins a specific path, otherwise the first joystick under
+    /dev/input/by-id is used.
+    """
+
+    def __init__(self, device: Optional[str] = None):
+        super().__init__(JoystickState(), device or 'evdev')
+        self.device = device
+        self.inputs: Optional[EvdevJoystickInput] = None
+        self.connected = False
+        self.connections = 0
+        self.watcher = DeviceWatcher(self._find)
+        self.watcher.start()
+        self._connect(0.1)
+
+    def _find(self) -> Optional[str]:
+        if self.device is not None:
+            return self.device if os.path.exists(self.device) else None
+        return find_evdev_joystick()
+
+    def _connect(self, timeout: float) -> bool:
+        path = self.watcher.wait_for_device(timeout)
+        if path is None:
+            return False
+        try:
+            self.inputs = EvdevJoystickInput(path, state=self.state)
+        except OSError as e:
+            # Usually udev has not fixed the permissions yet; IN_ATTRIB wakes us again
+            logger.debug(f"Opening joystick {path} failed: {str(e)}")
+            self.watcher.rescan()
+            return False
+        self.name = self.inputs.name
+        self.connected = True
+        self.connections += 1
+        logger.info(f"Joystick connected: {self.name}")
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        if self.inputs is None:
+            # Opening reads the current state from the kernel, so this counts as a change
+            return self._connect(timeout)
+        changed = self.inputs.wait(timeout)
+        if self.inputs.quit:
+            # Lost: EvdevJoystickInput already reset the state to neutral
+            self.inputs.close()
+            self.inputs = None
+            self.connected = False
+            self.watcher.rescan()
+            logger.warning(f"Joystick lost: {self.name}")
+            return True
+        return changed
+
+    def close(self):
+        self.watcher.stop()
+        if self.inputs is not None:
+            self.inputs.close()
+            self.inputs = None
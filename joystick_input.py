@@ -0,0 +1,427 @@
+import fcntl
+import glob
+import os
+import select
+import struct
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+
+class JoystickState:
+    """Latest axis, button and hat values of one controller
+
+    `timestamp` is the monotonic time the newest change was received and
+    `sequence` counts changes, so consumers can tell whether anything moved
+    since they last looked.
+    """
+
+    def __init__(self, num_axes: int = 6, num_buttons: int = 11, num_hats: int = 1):
+        self.axes: List[float] = [0.0] * num_axes
+        self.buttons: List[int] = [0] * num_buttons
+        self.hats: List[Tuple[int, int]] = [(0, 0)] * num_hats
+        self.timestamp = time.monotonic()
+        self.sequence = 0
+
+    def axis(self, index: int) -> float:
+        return self.axes[index] if index < len(self.axes) else 0.0
+
+    def button(self, index: int) -> int:
+        return self.buttons[index] if index < len(self.buttons) else 0
+
+    def hat(self, index: int) -> Tuple[int, int]:
+        return self.hats[index] if index < len(self.hats) else (0, 0)
+
+    def set_axis(self, index: int, value: float, timestamp: float) -> bool:
+        if index >= len(self.axes):
+            self.axes.extend([0.0] * (index + 1 - len(self.axes)))
+        if self.axes[index] == value:
+            return False
+        self.axes[index] = value
+        self._touch(timestamp)
+        return True
+
+    def set_button(self, index: int, value: int, timestamp: float) -> bool:
+        if index >= len(self.buttons):
+            self.buttons.extend([0] * (index + 1 - len(self.buttons)))
+        if self.buttons[index] == value:
+            return False
+        self.buttons[index] = value
+        self._touch(timestamp)
+        return True
+
+    def set_hat(self, index: int, value: Tuple[int, int], timestamp: float) -> bool:
+        if index >= len(self.hats):
+            self.hats.extend([(0, 0)] * (index + 1 - len(self.hats)))
+        if self.hats[index] == value:
+            return False
+        self.hats[index] = value
+        self._touch(timestamp)
+        return True
+
+    def reset(self, timestamp: float):
+        """Return every control to neutral, e.g. when the controller is lost"""
+        self.axes = [0.0] * len(self.axes)
+        self.buttons = [0] * len(self.buttons)
+        self.hats = [(0, 0)] * len(self.hats)
+        self._touch(timestamp)
+
+    def _touch(self, timestamp: float):
+        self.timestamp = timestamp
+        self.sequence += 1
+
+
+class JoystickInput(ABC):
+    """Input stage the drive loop reads the controller through
+
+    wait() blocks until the controller state changed or `timeout` passed
+    and returns whether anything changed, so the mixer only runs on input
+    plus a slow keepalive.
+    """
+
+    def __init__(self, state: Optional[JoystickState] = None, name: str = 'joystick'):
+        self.state = state if state is not None else JoystickState()
+        self.name = name
+        self.quit = False
+        # False while the controller is gone; the state is then all neutral
+        self.connected = True
+
+    @abstractmethod
+    def wait(self, timeout: float) -> bool:
+        pass
+
+    def close(self):
+        pass
+
+
+class PygameJoystickInput(JoystickInput):
+    """Event-driven input from a pygame joystick
+
+    Consumes JOYAXISMOTION, JOYBUTTON* and JOYHATMOTION events instead of
+    polling get_axis() every frame. While the sticks are idle the thread
+    sleeps inside SDL. JOYDEVICEREMOVED zeroes the state and clears
+    `connected`; the next JOYDEVICEADDED reopens the pad without touching
+    the rest of pygame. `joystick` may be None to start disconnected.
+    """
+
+    def __init__(self, joystick=None):
+        import pygame
+        self.pygame = pygame
+        super().__init__(JoystickState(), 'pygame')
+        self.joystick = None
+        self.instance_id = None
+        self.connected = False
+        # Block every event type, then let only the joystick events back in
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.QUIT, pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN,
+                                  pygame.JOYBUTTONUP, pygame.JOYHATMOTION,
+                                  pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED])
+        if joystick is not None:
+            self._attach(joystick)
+
+    @classmethod
+    def open(cls, index: int = 0, hotplug: bool = False) -> 'PygameJoystickInput':
+        """Initialize pygame and open joystick `index`
+
+        Without `hotplug` a missing joystick raises FileNotFoundError,
+        with it the input starts disconnected and waits for the pad.
+        """
+        import pygame
+        pygame.init()
+        pygame.joystick.init()
+        try:
+            joystick = pygame.joystick.Joystick(index)
+            joystick.init()
+        except pygame.error as e:
+            if hotplug:
+                return cls()
+            pygame.quit()
+            raise FileNotFoundError(f"No pygame joystick {index}: {e}") from e
+        return cls(joystick)
+
+    def _attach(self, joystick):
+        self.joystick = joystick
+        self.instance_id = joystick.get_instance_id() if hasattr(joystick, 'get_instance_id') \
+            else joystick.get_id()
+        self.name = joystick.get_name()
+        self.connected = True
+        # Start from the current hardware state so the first frame is correct
+        now = time.monotonic()
+        for index in range(joystick.get_numaxes()):
+            self.state.set_axis(index, joystick.get_axis(index), now)
+        for index in range(joystick.get_numbuttons()):
+            self.state.set_button(index, joystick.get_button(index), now)
+        for index in range(joystick.get_numhats()):
+            self.state.set_hat(index, joystick.get_hat(index), now)
+
+    def wait(self, timeout: float) -> bool:
+        event = self.pygame.event.wait(max(1, int(timeout * 1000)))
+        if event.type == self.pygame.NOEVENT:
+            return False
+        changed = self.handle(event)
+        # Drain whatever else is already queued so one wakeup covers a burst
+        for event in self.pygame.event.get():
+            changed |= self.handle(event)
+        return changed
+
+    def handle(self, event) -> bool:
+        """Apply one pygame event to the state, returns True if it changed"""
+        pygame = self.pygame
+        if event.type == pygame.QUIT:
+            self.quit = True
+            return True
+        if event.type == pygame.JOYDEVICEADDED:
+            if self.connected:
+                return False
+            joystick = pygame.joystick.Joystick(event.device_index)
+            joystick.init()
+            self._attach(joystick)
+            return True
+        if getattr(event, 'instance_id', getattr(event, 'joy', None)) != self.instance_id:
+            return False
+        now = time.monotonic()
+        if event.type == pygame.JOYAXISMOTION:
+            return self.state.set_axis(event.axis, event.value, now)
+        if event.type == pygame.JOYBUTTONDOWN:
+            return self.state.set_button(event.button, 1, now)
+        if event.type == pygame.JOYBUTTONUP:
+            return self.state.set_button(event.button, 0, now)
+        if event.type == pygame.JOYHATMOTION:
+            return self.state.set_hat(event.hat, tuple(event.value), now)
+        if event.type == pygame.JOYDEVICEREMOVED:
+            self.joystick = None
+            self.instance_id = None
+            self.connected = False
+            self.state.reset(now)
+            return True
+        return False
+
+    def close(self):
+        self.pygame.quit()
+
+
+# struct input_event from <linux/input.h>: struct timeval, type, code, value
+INPUT_EVENT = struct.Struct('llHHi')
+INPUT_ABSINFO = struct.Struct('6i')  # value, minimum, maximum, fuzz, flat, resolution
+EV_SYN, EV_KEY, EV_ABS = 0x00, 0x01, 0x03
+SYN_REPORT, SYN_DROPPED = 0, 3
+KEY_BITMAP_SIZE = 0x300 // 8  # KEY_MAX + 1 bits
+
+# Same indices pygame/SDL report for an Xbox pad on the xpad driver, so
+# live_control reads the same axes whichever backend is active
+EVDEV_AXES = {0x00: 0, 0x01: 1, 0x02: 2, 0x03: 3, 0x04: 4, 0x05: 5}  # ABS_X .. ABS_RZ
+EVDEV_BUTTONS = {
+    0x130: 0, 0x131: 1, 0x133: 2, 0x134: 3,  # A, B, X, Y
+    0x136: 4, 0x137: 5,                      # LB, RB
+    0x13a: 6, 0x13b: 7, 0x13c: 8,            # Back, Start, Guide
+    0x13d: 9, 0x13e: 10                      # left and right stick click
+}
+ABS_HAT0X, ABS_HAT0Y = 0x10, 0x11
+
+# Raw ranges used when the device cannot be asked (recorded file or pipe)
+STICK_RANGE = (-32768, 32767)
+TRIGGER_RANGE = (0, 1023)
+DEFAULT_RANGES = {0x00: STICK_RANGE, 0x01: STICK_RANGE, 0x02: TRIGGER_RANGE,
+                  0x03: STICK_RANGE, 0x04: STICK_RANGE, 0x05: TRIGGER_RANGE}
+
+DEVICE_GLOB = '/dev/input/by-id/*-event-joystick'
+
+
+def _ioc_read(number: int, size: int) -> int:
+    # _IOR('E', number, size)
+    return (2 << 30) | (size << 16) | (ord('E') << 8) | number
+
+
+def _ioc_write(number: int, size: int) -> int:
+    # _IOW('E', number, size)
+    return (1 << 30) | (size << 16) | (ord('E') << 8) | number
+
+
+class EvdevJoystickInput(JoystickInput):
+    """Controller input read straight from a Linux input event device
+
+    Needs neither pygame nor SDL. The device is read non-blocking and the
+    events of one SYN_REPORT packet are applied together. `path` may also be
+    a file or pipe of recorded input_event structs; end of file counts as
+    losing the controller. On a real device the kernel is switched to
+    CLOCK_MONOTONIC event timestamps, so state.timestamp is the time the
+    driver saw the input rather than the time it was read.
+    """
+
+    def __init__(self, path: str, ranges: Optional[dict] = None,
+                 state: Optional[JoystickState] = None):
+        super().__init__(state, os.path.basename(path))
+        self.path = path
+        self.ranges = dict(DEFAULT_RANGES)
+        if ranges:
+            self.ranges.update(ranges)
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+        self._buffer = b''
+        self._pending: List[Tuple[int, int, int]] = []
+        self._dropping = False
+        self._hat = [0, 0]
+        try:
+            fcntl.ioctl(self.fd, _ioc_write(0xa0, 4), struct.pack('i', time.CLOCK_MONOTONIC))
+            self.kernel_time = True
+        except OSError:
+            self.kernel_time = False
+        try:
+            name = fcntl.ioctl(self.fd, _ioc_read(0x06, 256), bytes(256))
+            self.name = name.split(b'\0', 1)[0].decode(errors='replace') or self.name
+        except OSError:
+            pass
+        self._sync()
+
+    def wait(self, timeout: float) -> bool:
+        if self.quit or not self._poll.poll(max(0, int(timeout * 1000))):
+            return False
+        chunk = INPUT_EVENT.size * 64
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, chunk)
+            except BlockingIOError:
+                break
+            except OSError:
+                # ENODEV once the controller is unplugged
+                return self._lost()
+            if not data:
+                return self._lost()
+            changed |= self._feed(data)
+            if len(data) < chunk:
+                break
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _lost(self) -> bool:
+        self.quit = True
+        self.connected = False
+        self.state.reset(time.monotonic())
+        return True
+
+    def _feed(self, data: bytes) -> bool:
+        data = self._buffer + data
+        end = len(data) - len(data) % INPUT_EVENT.size
+        self._buffer = data[end:]
+        changed = False
+        for sec, usec, kind, code, value in INPUT_EVENT.iter_unpack(data[:end]):
+            if kind == EV_SYN:
+                if code == SYN_REPORT:
+                    if self._dropping:
+                        # The kernel queue overflowed, read the state back from the device
+                        self._dropping = False
+                        changed |= self._sync()
+                    else:
+                        changed |= self._apply(sec + usec * 1e-6 if self.kernel_time
+                                               else time.monotonic())
+                elif code == SYN_DROPPED:
+                    self._dropping = True
+                    self._pending.clear()
+            elif not self._dropping and (kind == EV_KEY or kind == EV_ABS):
+                self._pending.append((kind, code, value))
+        return changed
+
+    def _apply(self, now: float) -> bool:
+        changed = False
+        for kind, code, value in self._pending:
+            changed |= self._set(kind, code, value, now)
+        self._pending.clear()
+        return changed
+
+    def _set(self, kind: int, code: int, value: int, now: float) -> bool:
+        if kind == EV_KEY:
+            index = EVDEV_BUTTONS.get(code)
+            return index is not None and self.state.set_button(index, 1 if value else 0, now)
+        index = EVDEV_AXES.get(code)
+        if index is not None:
+            low, high = self.ranges[code]
+            scaled = 2.0 * (value - low) / (high - low) - 1.0
+            return self.state.set_axis(index, max(-1.0, min(1.0, scaled)), now)
+        if code == ABS_HAT0X or code == ABS_HAT0Y:
+            # evdev reports up as -1, pygame as +1
+            self._hat[code - ABS_HAT0X] = value if code == ABS_HAT0X else -value
+            return self.state.set_hat(0, (self._hat[0], self._hat[1]), now)
+        return False
+
+    def _sync(self) -> bool:
+        """Load ranges and current values from the device, if it is one"""
+        now = time.monotonic()
+        changed = False
+        for code in list(EVDEV_AXES) + [ABS_HAT0X, ABS_HAT0Y]:
+            try:
+                info = fcntl.ioctl(self.fd, _ioc_read(0x40 + code, INPUT_ABSINFO.size),
+                                   bytes(INPUT_ABSINFO.size))
+            except OSError:
+                continue
+            value, low, high = INPUT_ABSINFO.unpack(info)[:3]
+            if code in EVDEV_AXES and high > low:
+                self.ranges[code] = (low, high)
+            changed |= self._set(EV_ABS, code, value, now)
+        try:
+            keys = fcntl.ioctl(self.fd, _ioc_read(0x18, KEY_BITMAP_SIZE), bytes(KEY_BITMAP_SIZE))
+        except OSError:
+            return changed
+        for code in EVDEV_BUTTONS:
+            changed |= self._set(EV_KEY, code, (keys[code // 8] >> (code % 8)) & 1, now)
+        return changed
+
+
+def joystick_command(state: JoystickState) -> Tuple[float, float, float]:
+    """Raw body command (x, y, r) from the controller layout live_control uses
+
+    Left stick X/Y strafe and drive (Y inverted, up is negative on the pad),
+    axis 2 rotates. Deadzone and response curves are applied afterwards by
+    axis_shaping.AxisShaper.
+    """
+    return state.axis(0), -state.axis(1), -state.axis(2)
+
+
+def find_evdev_joystick() -> Optional[str]:
+    """Path of the first joystick event device, None if there is none"""
+    devices = sorted(glob.glob(DEVICE_GLOB))
+    return devices[0] if devices else None
+
+
+def open_joystick(backend: Optional[str] = None, device: Optional[str] = None,
+                  record: Optional[str] = None, hotplug: bool = False) -> JoystickInput:
+    """Open the controller through 'evdev', 'pygame', 'replay' or 'auto'
+
+    The backend defaults to $ROBODOM_INPUT and the evdev device to
+    $ROBODOM_JOYSTICK or the first joystick under /dev/input/by-id. 'auto'
+    uses evdev when a device is available and pygame otherwise. 'replay'
+    plays the recording `device` back in real time. With `record` (default
+    $ROBODOM_JOYSTICK_RECORD) the stream is also written to that file.
+
+    With `hotplug` a missing or lost controller is not an error: the input
+    reports `connected` False with neutral state until the pad is back.
+    Otherwise FileNotFoundError is raised when no controller is found.
+    """
+    backend = backend or os.environ.get('ROBODOM_INPUT', 'auto')
+    record = record or os.environ.get('ROBODOM_JOYSTICK_RECORD')
+    if backend not in ('auto', 'evdev', 'pygame', 'replay'):
+        raise ValueError(f"Unknown joystick backend: {backend}")
+    device = device or os.environ.get('ROBODOM_JOYSTICK')
+    if backend == 'replay':
+        from joystick_recording import ReplayJoystickInput
+        if device is None:
+            raise FileNotFoundError("No joystick recording given to replay")
+        inputs: JoystickInput = ReplayJoystickInput(device)
+    elif hotplug and (backend == 'evdev' or (backend == 'auto' and (device or find_evdev_joystick()))):
+        from joystick_hotplug import HotplugEvdevJoystickInput
+        inputs = HotplugEvdevJoystickInput(device)
+    elif backend != 'pygame' and (device or find_evdev_joystick()):
+        inputs = EvdevJoystickInput(device or find_evdev_joystick())
+    elif backend == 'evdev':
+        raise FileNotFoundError(f"No joystick event device matching {DEVICE_GLOB}")
+    else:
+        inputs = PygameJoystickInput.open(hotplug=hotplug)
+    if record:
+        from joystick_recording import RecordingJoystickInput
+        inputs = RecordingJoystickInput(inputs, record)
+    return inputs
@@ -0,0 +1,158 @@
+"""Record the controller stream live_control consumes and play it back
+
+A recording is a small header followed by 14-byte records of (seconds since
+start, kind, index, value), one per changed axis, button or hat component.
+The first records hold the complete state at the start of the recording.
+
+    ROBODOM_JOYSTICK_RECORD=drive.rdjs python3 motor_control_4.py   # record
+    ROBODOM_INPUT=replay ROBODOM_JOYSTICK=drive.rdjs python3 motor_control_4.py
+"""
+import struct
+import time
+from typing import BinaryIO, List, Optional, Tuple
+
+from joystick_input import JoystickInput, JoystickState
+
+MAGIC = b'RDJS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHd')  # magic, version, record size, wall-clock start
+RECORD = struct.Struct('<dBBf')  # seconds since start, kind, index, value
+
+AXIS, BUTTON, HAT_X, HAT_Y = 0, 1, 2, 3
+
+Record = Tuple[float, int, int, float]
+
+
+class JoystickRecorder:
+    """Append-only writer of a joystick recording"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: BinaryIO = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time()))
+        self._axes: List[float] = []
+        self._buttons: List[int] = []
+        self._hats: List[Tuple[int, int]] = []
+
+    def write(self, offset: float, kind: int, index: int, value: float):
+        self._file.write(RECORD.pack(offset, kind, index, value))
+
+    def snapshot(self, state: JoystickState, offset: float):
+        """Write every control of `state` that differs from the last snapshot"""
+        for index, value in enumerate(state.axes):
+            if index >= len(self._axes) or self._axes[index] != value:
+                self.write(offset, AXIS, index, value)
+        for index, value in enumerate(state.buttons):
+            if index >= len(self._buttons) or self._buttons[index] != value:
+                self.write(offset, BUTTON, index, value)
+        for index, (x, y) in enumerate(state.hats):
+            old = self._hats[index] if index < len(self._hats) else None
+            if old is None or old[0] != x:
+                self.write(offset, HAT_X, index, x)
+            if old is None or old[1] != y:
+                self.write(offset, HAT_Y, index, y)
+        self._axes = list(state.axes)
+        self._buttons = list(state.buttons)
+        self._hats = list(state.hats)
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path: str) -> List[Record]:
+    """Return the (offset, kind, index, value) records of a recording"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, record_size, _start = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"{path} is not a joystick recording")
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    return list(RECORD.iter_unpack(data[HEADER.size:end]))
+
+
+class RecordingJoystickInput(JoystickInput):
+    """Pass another input through unchanged while recording its changes"""
+
+    def __init__(self, inputs: JoystickInput, path: str):
+        super().__init__(inputs.state, inputs.name)
+        self.inputs = inputs
+        self.recorder = JoystickRecorder(path)
+        self.start = time.monotonic()
+        self.recorder.snapshot(self.state, 0.0)
+
+    def wait(self, timeout: float) -> bool:
+        changed = self.inputs.wait(timeout)
+        self.quit = self.inputs.quit
+        self.connected = self.inputs.connected
+        self.name = self.inputs.name
+        if changed:
+            self.recorder.snapshot(self.state, self.state.timestamp - self.start)
+        return changed
+
+    def close(self):
+        self.inputs.close()
+        self.recorder.close()
+
+
+class ReplayJoystickInput(JoystickInput):
+    """Play a recording back as if it came from the controller
+
+    With `realtime` the records are applied at their recorded offsets
+    (divided by `speed`); otherwise every wait() applies the next group of
+    records sharing one offset without sleeping. After the last record the
+    controls return to neutral and `quit` is set.
+    """
+
+    def __init__(self, path: str, realtime: bool = True, speed: float = 1.0,
+                 records: Optional[List[Record]] = None):
+        super().__init__(JoystickState(), path)
+        self.records = records if records is not None else read_recording(path)
+        self.realtime = realtime
+        self.speed = speed
+        self.position = 0
+        self.offset = 0.0  # recorded time of the last applied record
+        self.start: Optional[float] = None
+
+    def wait(self, timeout: float) -> bool:
+        if self.quit:
+            return False
+        if self.position >= len(self.records):
+            self.quit = True
+            self.state.reset(time.monotonic())
+            return True
+        offset = self.records[self.position][0]
+        if self.realtime:
+            now = time.monotonic()
+            if self.start is None:
+                self.start = now - offset / self.speed
+            delay = self.start + offset / self.speed - now
+            if delay > timeout:
+                time.sleep(timeout)
+                return False
+            if delay > 0:
+                time.sleep(delay)
+            # Catch up on everything that is due by now
+            offset = (time.monotonic() - self.start) * self.speed
+        return self._apply_until(offset)
+
+    def _apply_until(self, offset: float) -> bool:
+        now = time.monotonic()
+        changed = False
+        state = self.state
+        records = self.records
+        while self.position < len(records) and records[self.position][0] <= offset:
+            record_offset, kind, index, value = records[self.position]
+            if self.realtime:
+                # Timestamp of when the input was due, like a kernel event time
+                now = self.start + record_offset / self.speed
+            if kind == AXIS:
+                changed |= state.set_axis(index, value, now)
+            elif kind == BUTTON:
+                changed |= state.set_button(index, int(value), now)
+            else:
+                x, y = state.hat(index)
+                hat = (int(value), y) if kind == HAT_X else (x, int(value))
+                changed |= state.set_hat(index, hat, now)
+            self.position += 1
+            self.offset = record_offset
+        return changed
@@ -0,0 +1,89 @@
+import math
+import time
+from array import array
+from typing import Dict, Optional, TextIO
+
+# Buckets per power of two: 8 gives at most ~9 % error on any percentile
+SUB_BUCKETS = 8
+MAX_OCTAVES = 24  # 1 us .. ~16 s
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with constant-time recording
+
+    Bucket 0 holds everything below 1 us, bucket i covers latencies up to
+    2 ** (i / SUB_BUCKETS) us. Recording is a log2 and an increment without
+    locking; concurrent writers may at worst lose a count, which is fine for
+    a diagnostic.
+    """
+
+    def __init__(self, name: str = 'latency'):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.counts = array('Q', bytes(8 * (MAX_OCTAVES * SUB_BUCKETS + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def record(self, seconds: float):
+        micros = seconds * 1e6
+        if micros < 1.0:
+            index = 0
+        else:
+            index = min(int(math.log2(micros) * SUB_BUCKETS) + 1, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def record_since(self, start: Optional[float]):
+        """Record time.monotonic() - start, nothing if start is None"""
+        if start is not None:
+            self.record(time.monotonic() - start)
+
+    @staticmethod
+    def upper_bound(index: int) -> float:
+        """Upper edge of a bucket in seconds"""
+        return 1e-6 if index == 0 else 2 ** (index / SUB_BUCKETS) * 1e-6
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bucket edge below which `fraction` of the samples lie"""
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self.upper_bound(index), self.maximum)
+        return self.maximum
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.minimum if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.maximum
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (f"{self.name}: {stats['count']} samples, mean {stats['mean'] * 1e3:.2f} ms, "
+                f"p50 {stats['p50'] * 1e3:.2f} ms, p90 {stats['p90'] * 1e3:.2f} ms, "
+                f"p99 {stats['p99'] * 1e3:.2f} ms, max {stats['max'] * 1e3:.2f} ms")
+
+    def dump(self, out: TextIO):
+        """Write the summary and every non-empty bucket as 'upper_ms count'"""
+        out.write(f"# {self.summary()}\n")
+        for index, count in enumerate(self.counts):
+            if count:
+                out.write(f"{self.upper_bound(index) * 1e3:.4f} {count}\n")
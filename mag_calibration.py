@@ -0,0 +1,147 @@
+"""Hard- and soft-iron calibration of the magnetometer by ellipsoid fitting
+
+Rotated through all orientations, an undisturbed magnetometer traces a
+sphere around the origin. Hard iron (magnetized parts near the sensor)
+shifts it by an offset, soft iron (the motors, the chassis) stretches it
+into an ellipsoid. A least-squares ellipsoid fit through the raw samples
+gives both; the correction maps every sample back onto a sphere of the
+same average radius:
+
+    corrected = matrix @ (raw - offset)
+
+A fit is only accepted if the samples cover enough directions, the
+corrected samples lie close to a sphere and, if the local field strength
+is known, the sphere has about that radius; otherwise a sensor turned
+around one axis only, or disturbed by a magnet nearby, would be stored
+as a calibration. Results are stored per sensor in a JSON file and
+loaded at startup.
+"""
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+DEFAULT_FILE = os.environ.get(
+    'ROBODOM_MAG_CALIBRATION',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mag_calibration.json'))
+MIN_SAMPLES = 50
+# Smallest over largest variance of the centred samples: 1 for a sphere
+# covered evenly, near 0 when the sensor was only turned about one axis
+MIN_COVERAGE = 0.1
+MAX_RELATIVE_RESIDUAL = 0.05  # RMS distance from the sphere over its radius
+FIELD_TOLERANCE = 0.3  # relative deviation of the radius from the expected field
+
+
+class MagCalibration:
+    """Offset vector and 3x3 soft-iron matrix of one magnetometer"""
+
+    def __init__(self, offset, matrix, radius: float = 0.0, residual: float = 0.0,
+                 samples: int = 0):
+        self.offset = np.asarray(offset, dtype=float)
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.radius = radius  # uT, average field magnitude after correction
+        self.residual = residual  # RMS deviation from that radius in uT
+        self.samples = samples
+
+    def apply(self, mag) -> np.ndarray:
+        """Correct one (3,) sample or an (n, 3) batch with one matrix product"""
+        return (np.asarray(mag, dtype=float) - self.offset) @ self.matrix.T
+
+    def to_dict(self) -> Dict:
+        return {
+            'offset': self.offset.tolist(),
+            'matrix': self.matrix.tolist(),
+            'radius': self.radius,
+            'residual': self.residual,
+            'samples': self.samples
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'MagCalibration':
+        return cls(data['offset'], data['matrix'], data.get('radius', 0.0),
+                   data.get('residual', 0.0), data.get('samples', 0))
+
+
+def fit_ellipsoid(samples, expected_field: Optional[float] = None,
+                  min_coverage: float = MIN_COVERAGE,
+                  max_residual: float = MAX_RELATIVE_RESIDUAL,
+                  field_tolerance: float = FIELD_TOLERANCE) -> MagCalibration:
+    """Least-squares fit of a general ellipsoid through (n, 3) raw samples
+
+    `expected_field` is the local field strength in uT, if known. Raises
+    ValueError if there are too few samples, they cover too few directions
+    (min_coverage), do not span an ellipsoid, scatter too far around it
+    (max_residual) or give a field strength off by more than
+    field_tolerance.
+    """
+    samples = np.asarray(samples, dtype=float)
+    if samples.ndim != 2 or samples.shape[1] != 3 or len(samples) < MIN_SAMPLES:
+        raise ValueError(f"Need at least {MIN_SAMPLES} samples of shape (n, 3)")
+    mean = samples.mean(axis=0)
+    variances = np.linalg.eigvalsh(np.cov(samples - mean, rowvar=False))
+    coverage = max(variances[0], 0.0) / variances[-1] if variances[-1] > 0 else 0.0
+    if coverage < min_coverage:
+        raise ValueError(f"Samples cover too few directions (spread {coverage:.3f}), "
+                         "rotate the sensor through all orientations")
+    # Centre and scale first, for a well-conditioned system
+    scale = np.abs(samples - mean).max() or 1.0
+    x, y, z = ((samples - mean) / scale).T
+
+    # a x² + b y² + c z² + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1
+    design = np.column_stack((x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z,
+                              2 * x, 2 * y, 2 * z))
+    v, *_ = np.linalg.lstsq(design, np.ones(len(samples)), rcond=None)
+    quadric = np.array([[v[0], v[3], v[4]],
+                        [v[3], v[1], v[5]],
+                        [v[4], v[5], v[2]]])
+    try:
+        centre = -np.linalg.solve(quadric, v[6:9])
+    except np.linalg.LinAlgError:
+        raise ValueError("Samples do not span an ellipsoid")
+    shape = quadric / (1.0 + centre @ quadric @ centre)
+    eigenvalues, eigenvectors = np.linalg.eigh(shape)
+    if np.any(eigenvalues <= 0):
+        raise ValueError("Samples do not span an ellipsoid")
+
+    # Map the ellipsoid onto a sphere with the geometric mean of its radii
+    radii = 1.0 / np.sqrt(eigenvalues)
+    radius = float(np.prod(radii) ** (1.0 / 3.0)) * scale
+    matrix = eigenvectors @ np.diag(np.sqrt(eigenvalues)) @ eigenvectors.T * (radius / scale)
+    offset = mean + centre * scale
+    calibration = MagCalibration(offset, matrix, radius, samples=len(samples))
+    magnitudes = np.linalg.norm(calibration.apply(samples), axis=1)
+    calibration.residual = float(np.sqrt(np.mean((magnitudes - radius) ** 2)))
+    if calibration.residual > max_residual * radius:
+        raise ValueError(f"Samples do not lie on an ellipsoid (residual "
+                         f"{calibration.residual:.2f} uT at {radius:.1f} uT)")
+    if expected_field and abs(radius - expected_field) > field_tolerance * expected_field:
+        raise ValueError(f"Field strength {radius:.1f} uT is far from the expected "
+                         f"{expected_field:.1f} uT, check for magnets near the sensor")
+    return calibration
+
+
+def load_calibration(sensor: str, path: str = DEFAULT_FILE) -> Optional[MagCalibration]:
+    """Stored calibration of a sensor, None if there is none"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    entry = data.get(sensor)
+    return MagCalibration.from_dict(entry) if entry else None
+
+
+def save_calibration(sensor: str, calibration: MagCalibration, path: str = DEFAULT_FILE):
+    """Store the calibration of a sensor, keeping the entries of other sensors"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[sensor] = calibration.to_dict()
+    # Written to a temporary file first, so a crash never leaves a truncated file
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporary, path)
@@ -1,7 +1,14 @@
-import RPi.GPIO as GPIO
 import time
 import threading
 import keyboard  # For real-time key detection
+from pin_shadow import PinShadow
+from gpio_backend import get_backend
+from command_arbiter import CommandArbiter
+from latency_histogram import LatencyHistogram
+from mecanum_kinematics import frame, mix
+
+# RPi.GPIO on the robot, simulated elsewhere (selectable via $ROBODOM_GPIO)
+GPIO = get_backend()
 
 # Explicitly set the mode before any other GPIO operations
 GPIO.setmode(GPIO.BCM)
@@ -29,6 +36,23 @@ IN1_D = 24
 IN2_D = 23
 
 MAX_DUTY_CYCLE = 100
+# Seconds between checks that every key believed held is still pressed
+HELD_KEY_CHECK = 0.2
+
+# Body velocity (x strafe, y forward, r rotation) per key, laid out on the
+# number pad; keys held together are added up, opposite keys cancel out
+KEY_VECTORS = {
+    '8': (0, 1, 0),    # forward
+    '2': (0, -1, 0),   # backward
+    '4': (-1, 0, 0),   # strafe left
+    '6': (1, 0, 0),    # strafe right
+    '7': (-1, 1, 0),   # forward left
+    '9': (1, 1, 0),    # forward right
+    '1': (-1, -1, 0),  # backward left
+    '3': (1, -1, 0),   # backward right
+    'q': (0, 0, -1),   # turn left
+    'e': (0, 0, 1)     # turn right
+}
 
 # Setup pins
 GPIO.setup(EN_A, GPIO.OUT)
@@ -58,6 +82,12 @@ pwm_B.start(0)
 pwm_C.start(0)
 pwm_D.start(0)
 
+# Shadow register of the last written pin levels and duty cycles,
+# so that unchanged values are not written to the GPIO layer again
+shadow = PinShadow(GPIO)
+for en_pin in (EN_A, EN_B, EN_C, EN_D):
+    shadow.record_duty(en_pin, 0)
+
 def cleanup_motors():
     """Safely stop PWM and clean up GPIO resources."""
     pwm_A.stop()
@@ -65,6 +95,7 @@ def cleanup_motors():
     pwm_C.stop()
     pwm_D.stop()
     GPIO.cleanup()
+    shadow.forget()
 
 def set_motor_direction(motor, direction):
     """Set motor direction."""
@@ -79,26 +110,26 @@ def set_motor_direction(motor, direction):
     else:
         return
     if direction == 'forward':
-        GPIO.output(in1, GPIO.HIGH)
-        GPIO.output(in2, GPIO.LOW)
+        shadow.output(in1, GPIO.HIGH)
+        shadow.output(in2, GPIO.LOW)
     elif direction == 'backward':
-        GPIO.output(in1, GPIO.LOW)
-        GPIO.output(in2, GPIO.HIGH)
+        shadow.output(in1, GPIO.LOW)
+        shadow.output(in2, GPIO.HIGH)
     else:
-        GPIO.output(in1, GPIO.LOW)
-        GPIO.output(in2, GPIO.LOW)
+        shadow.output(in1, GPIO.LOW)
+        shadow.output(in2, GPIO.LOW)
 
 def set_motor_speed(motor, speed):
     """Set motor speed."""
     speed = min(max(speed, 0), MAX_DUTY_CYCLE)
     if motor == 1:
-        pwm_A.ChangeDutyCycle(speed)
+        shadow.change_duty_cycle(EN_A, pwm_A, speed)
     elif motor == 2:
-        pwm_B.ChangeDutyCycle(speed)
+        shadow.change_duty_cycle(EN_B, pwm_B, speed)
     elif motor == 3:
-        pwm_C.ChangeDutyCycle(speed)
+        shadow.change_duty_cycle(EN_C, pwm_C, speed)
     elif motor == 4:
-        pwm_D.ChangeDutyCycle(speed)
+        shadow.change_duty_cycle(EN_D, pwm_D, speed)
 
 def drive_all_motors(direction, speed):
     """Drive all motors in the same direction with the same speed."""
@@ -112,19 +143,104 @@ def stop_all_motors():
         set_motor_direction(motor, 'stop')
         set_motor_speed(motor, 0)
 
+def key_command(pressed):
+    """Body velocity for the set of held keys, every axis clamped to -1..1"""
+    x = y = r = 0
+    for key in pressed:
+        dx, dy, dr = KEY_VECTORS[key]
+        x += dx
+        y += dy
+        r += dr
+    return max(-1, min(x, 1)), max(-1, min(y, 1)), max(-1, min(r, 1))
+
+class KeyboardTeleop:
+    """Drive the motors from key-down/key-up events
+
+    Every event updates the set of held keys and the resulting command is
+    submitted to a CommandArbiter as source 'keyboard'; the arbiter thread
+    is the only writer of the pins. A changed command carries the time of
+    its key event, so the arbiter applies it at once and the latency is
+    measured; auto-repeat of a held key only renews the command, which
+    otherwise times out in the arbiter. The shadow register keeps the
+    arbiter's periodic repeats from touching the pins.
+
+    That timeout is the dead-man switch: without events from the hook the
+    robot stops after the keyboard timeout of the arbiter. A key-up that
+    got lost while the hook keeps running is caught sooner by
+    check_held(), which drops keys that are no longer pressed.
+    """
+
+    def __init__(self):
+        self.pressed = set()
+        self.command = (0, 0, 0)
+        self.lock = threading.Lock()
+        # Key event until the pins are written
+        self.latency = LatencyHistogram('key to PWM')
+        self.arbiter = CommandArbiter(self.apply)
+        self.lost_releases = 0
+
+    def handle(self, event):
+        key = event.name.lower() if event.name else None
+        if key not in KEY_VECTORS:
+            return
+        with self.lock:
+            if event.event_type == keyboard.KEY_DOWN:
+                self.pressed.add(key)
+            else:
+                self.pressed.discard(key)
+            command = key_command(self.pressed)
+            input_time = None
+            if command != self.command:
+                self.command = command
+                # The hook stamps events with the wall clock, the arbiter works on monotonic time
+                input_time = time.monotonic() - (time.time() - event.time)
+            self.arbiter.submit('keyboard', *command, input_time)
+
+    def check_held(self):
+        """Release held keys the keyboard no longer reports as pressed"""
+        with self.lock:
+            released = {key for key in self.pressed if not keyboard.is_pressed(key)}
+            if not released:
+                return
+            self.pressed -= released
+            self.lost_releases += len(released)
+            self.command = key_command(self.pressed)
+            self.arbiter.submit('keyboard', *self.command, time.monotonic())
+
+    def apply(self, x, y, r, source=None, input_time=None):
+        """Output of the arbiter: mix the body velocity and write the pins"""
+        directions, speeds = frame(mix(x, y, r, MAX_DUTY_CYCLE))
+        for motor in range(1, 5):
+            if speeds[motor] == 0:
+                set_motor_direction(motor, 'stop')
+            else:
+                set_motor_direction(motor, directions[motor])
+            set_motor_speed(motor, speeds[motor])
+        self.latency.record_since(input_time)
+
 def main():
+    teleop = KeyboardTeleop()
     try:
-        print("Press '8' to drive forward. Release to stop.")
+        print("Number pad 8/2/4/6 and 7/9/1/3 to drive, Q/E to turn; keys combine. Release to stop.")
+        teleop.arbiter.start()
+        keyboard.hook(teleop.handle)
+        # Driving happens in the hook; this thread only checks for lost key-ups
         while True:
-            if keyboard.is_pressed('8'):
-                drive_all_motors('forward', MAX_DUTY_CYCLE)
-            else:
-                stop_all_motors()
-            time.sleep(0.1)  # Small delay to reduce CPU usage
+            time.sleep(HELD_KEY_CHECK)
+            teleop.check_held()
     except KeyboardInterrupt:
         print("\nProgram terminated by user.")
     finally:
+        keyboard.unhook_all()
+        teleop.arbiter.stop()
         stop_all_motors()
+        stats = shadow.stats()
+        print(f"GPIO writes: {stats['issued']} issued, {stats['suppressed']} suppressed.")
+        if teleop.latency.count:
+            print(teleop.latency.summary())
+        print(f"Arbiter: {teleop.arbiter.summary()}")
+        if teleop.lost_releases:
+            print(f"Lost key releases caught: {teleop.lost_releases}")
         cleanup_motors()
 
 if __name__ == "__main__":
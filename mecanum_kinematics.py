@@ -0,0 +1,60 @@
+import numpy as np
+from typing import Dict, Tuple
+
+MAX_DUTY_CYCLE = 100
+
+# Wheel i = MIXING[i] . (x, y, r) for motor 1 (front left), 2 (front right),
+# 3 (rear left) and 4 (rear right):
+#   m1 = y + x + r,  m2 = y - x - r,  m3 = y - x + r,  m4 = y + x - r
+MIXING_MATRIX = np.array([
+    [1.0, 1.0, 1.0],
+    [-1.0, 1.0, -1.0],
+    [-1.0, 1.0, 1.0],
+    [1.0, 1.0, -1.0]
+])
+UNMIXING_MATRIX = np.linalg.pinv(MIXING_MATRIX)
+
+# Per-wheel sign between the commanded and the electrical direction. Motor 2
+# of the robot is mounted/wired reversed.
+WHEEL_POLARITY = np.array([1.0, -1.0, 1.0, 1.0])
+
+
+def mix(x, y, r, max_duty: float = MAX_DUTY_CYCLE, polarity=None) -> np.ndarray:
+    """Turn body velocities into signed wheel duties
+
+    x (strafe), y (forward) and r (rotation) are in -1..1 and may be scalars
+    or arrays of any matching shape; the result has a trailing axis of
+    length 4, one signed duty per motor. Each command is normalized by its
+    largest wheel value (at least 1) so no duty exceeds max_duty, and the
+    sign is flipped for wheels with negative polarity.
+    """
+    body = np.stack(np.broadcast_arrays(
+        np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(r, dtype=float)), axis=-1)
+    wheels = body @ MIXING_MATRIX.T
+    norm = np.maximum(np.abs(wheels).max(axis=-1, keepdims=True), 1.0)
+    duties = wheels * (max_duty / norm)
+    if polarity is not None:
+        duties *= polarity
+    return duties
+
+
+def unmix(duties, max_duty: float = MAX_DUTY_CYCLE, polarity=None) -> np.ndarray:
+    """Turn signed wheel duties back into body velocities (x, y, r)
+
+    The least-squares inverse of mix(). Commands whose wheel values were
+    normalized by mix() come back scaled down by the same factor.
+    """
+    wheels = np.asarray(duties, dtype=float) / max_duty
+    if polarity is not None:
+        wheels = wheels * polarity
+    return wheels @ UNMIXING_MATRIX.T
+
+
+def frame(duties) -> Tuple[Dict[int, str], Dict[int, float]]:
+    """Split the signed duties of one command into direction and speed per motor"""
+    directions = {}
+    speeds = {}
+    for motor, duty in enumerate(np.asarray(duties, dtype=float).tolist(), start=1):
+        directions[motor] = 'forward' if duty >= 0 else 'backward'
+        speeds[motor] = abs(duty)
+    return directions, speeds
@@ -0,0 +1,102 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MotionExecutor:
+    """Long-lived worker thread executing submitted movements in order
+
+    submit() queues a movement and returns a Future right away, so moves can
+    be queued back-to-back and the worker starts the next one as soon as
+    the previous one returns. Every movement gets its own cancel event as
+    the `cancel` keyword argument and is expected to stop early once it is
+    set.
+    """
+
+    def __init__(self, name: str = 'motion-executor'):
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._current: Optional[Tuple[Future, threading.Event]] = None
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue a movement, returns a Future resolved with its return value"""
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit to a shut down motion executor")
+            future: Future = Future()
+            self._queue.put((future, threading.Event(), fn, args, kwargs))
+        return future
+
+    def cancel(self, future: Future) -> bool:
+        """Cancel a queued movement or signal the running one to stop"""
+        if future.cancel():
+            return True
+        with self._lock:
+            if self._current is not None and self._current[0] is future:
+                self._current[1].set()
+                return True
+        return False
+
+    def cancel_all(self):
+        """Cancel every queued movement and signal the running one to stop"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+            else:
+                self._queue.put(None)
+                break
+        with self._lock:
+            if self._current is not None:
+                self._current[1].set()
+
+    def on_worker_thread(self) -> bool:
+        """Whether the caller is a movement running on the worker itself"""
+        return threading.current_thread() is self._thread
+
+    def pending(self) -> int:
+        """Number of movements waiting behind the running one"""
+        return self._queue.qsize()
+
+    def shutdown(self, wait: bool = True, cancel: bool = False):
+        """Stop accepting movements and end the worker after the queue is done"""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+        if cancel:
+            self.cancel_all()
+        self._queue.put(None)
+        if wait and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, cancel, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._current = (future, cancel)
+            try:
+                result = fn(*args, cancel=cancel, **kwargs)
+            except BaseException as e:
+                logger.error(f"Error in movement {getattr(fn, '__name__', fn)}: {str(e)}")
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._current = None
@@ -1,19 +1,23 @@
-import RPi.GPIO as GPIO
 import time
 import threading
 import logging
-from typing import Dict, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional
 from datetime import datetime
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('motor_controller.log'),
-        logging.StreamHandler()
-    ]
-)
+from pin_shadow import PinShadow
+from hardware_pwm import create_pwm
+from gpio_backend import GPIOBackend, PWMChannel, get_backend
+from ramp_scheduler import RampScheduler
+from motion_executor import MotionExecutor
+from concurrent.futures import Future
+from motor_logging import setup_logging
+from telemetry_ring import TelemetryRing
+from latency_histogram import LatencyHistogram
+from mecanum_kinematics import frame, mix
+from velocity_lease import VelocityLease
+
+# Configure logging: callers only enqueue, a background thread writes the
+# file and terminal output, per-motor command records are rate-limited
+setup_logging('motor_controller.log')
 logger = logging.getLogger(__name__)
 
 class GPIOPins:
@@ -42,66 +46,118 @@ class MotorConfig:
     """Motor configuration constants"""
     MAX_DUTY_CYCLE = 100
     PWM_FREQUENCY = 1000
+    PWM_MODE = 'software'  # 'software' (RPi.GPIO) or 'hardware' (kernel pwmchip)
     DEFAULT_STEP_DELAY = 0.02
+    RAMP_TICK = 0.01  # seconds between two ramp scheduler updates
+    LEASE_DECAY_TIME = 0.3  # seconds to ramp to 0 after a velocity lease expired
+    TELEMETRY_FILE = 'motor_telemetry.bin'  # binary frame ring, None to disable
     DEFAULT_RUN_TIME = 1.0
     MIN_SPEED = 0
     STARTUP_SPEED = 10
 
+class FrameTiming(NamedTuple):
+    """Timing and write statistics of one applied four-wheel frame"""
+    duration: float  # seconds spent inside the critical section
+    pin_writes: int
+    duty_writes: int
+    skipped_writes: int
+    input_latency: Optional[float] = None  # input sample to writes completed, if tagged
+
 class MotorController:
     """Main class for controlling the 4-motor system"""
+
+    # IN1/IN2 levels for every direction; anything unknown means stop
+    DIRECTION_LEVELS = {
+        'forward': (GPIOBackend.HIGH, GPIOBackend.LOW),
+        'backward': (GPIOBackend.LOW, GPIOBackend.HIGH),
+        'stop': (GPIOBackend.LOW, GPIOBackend.LOW)
+    }
     
-    def __init__(self):
+    def __init__(self, pwm_mode: str = MotorConfig.PWM_MODE,
+                 gpio: Optional[GPIOBackend] = None,
+                 telemetry_file: Optional[str] = MotorConfig.TELEMETRY_FILE):
         """Initialize the motor controller with GPIO setup and PWM instances"""
+        self.gpio = gpio if gpio is not None else get_backend()
+        # Every applied frame is recorded here instead of as text log lines
+        self.telemetry = TelemetryRing(telemetry_file) if telemetry_file else None
+        # Input-to-actuation latency of frames tagged with an input timestamp
+        self.latency = LatencyHistogram('input to PWM')
+        self.pwm_mode = pwm_mode
         self._cleanup_done = False
         self._cleanup_lock = threading.Lock()
         self._motor_locks: Dict[int, threading.Lock] = {
             i: threading.Lock() for i in range(1, 5)
         }
-        self.pwm_instances: Dict[str, Optional[GPIO.PWM]] = {
+        self.pwm_instances: Dict[str, Optional[PWMChannel]] = {
             'A': None, 'B': None, 'C': None, 'D': None
         }
-        self._emergency_stop = False
-        self._emergency_stop_lock = threading.Lock()
+        # Last level written to every IN pin and last duty per EN pin,
+        # used to skip writes that would not change anything
+        self.shadow = PinShadow(self.gpio)
+        # Checked by every writer while holding the motor locks; the stop
+        # itself never waits for those locks before the EN pins are at 0
+        self._emergency_stop = threading.Event()
+        self.estop_fast_latency = 0.0
+        self.estop_zeroed_at: Optional[float] = None
+        self._emergency_stop_callbacks: List[Callable[[], None]] = []
         self.setup_gpio()
+        # One scheduler thread advances the duty ramps of all motors
+        self.ramps = RampScheduler(self._apply_ramp_duties, MotorConfig.RAMP_TICK,
+                                   self.get_motor_duty)
+        self.ramps.start()
+        # Streamed velocity commands stay applied for their lease, then decay to 0
+        self.leases = VelocityLease(self._apply_lease, self._decay_lease,
+                                    MotorConfig.LEASE_DECAY_TIME)
+        self.leases.start()
+        self.add_emergency_stop_callback(self.leases.cancel)
         logger.info("Motor controller initialized")
 
     def setup_gpio(self):
         """Setup GPIO pins and initialize PWM"""
         try:
-            GPIO.setmode(GPIO.BCM)
+            self.gpio.setmode(self.gpio.BCM)
             
+            # EN pins stay in their PWM alternate function in hardware mode
+            software_pwm = self.pwm_mode == 'software'
+
             # Setup Motor 1
-            GPIO.setup(GPIOPins.EN_A, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN1_A, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN2_A, GPIO.OUT)
+            if software_pwm:
+                self.gpio.setup(GPIOPins.EN_A, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN1_A, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN2_A, self.gpio.OUT)
             
             # Setup Motor 2
-            GPIO.setup(GPIOPins.EN_B, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN1_B, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN2_B, GPIO.OUT)
+            if software_pwm:
+                self.gpio.setup(GPIOPins.EN_B, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN1_B, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN2_B, self.gpio.OUT)
             
             # Setup Motor 3
-            GPIO.setup(GPIOPins.EN_C, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN1_C, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN2_C, GPIO.OUT)
+            if software_pwm:
+                self.gpio.setup(GPIOPins.EN_C, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN1_C, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN2_C, self.gpio.OUT)
             
             # Setup Motor 4
-            GPIO.setup(GPIOPins.EN_D, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN1_D, GPIO.OUT)
-            GPIO.setup(GPIOPins.IN2_D, GPIO.OUT)
+            if software_pwm:
+                self.gpio.setup(GPIOPins.EN_D, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN1_D, self.gpio.OUT)
+            self.gpio.setup(GPIOPins.IN2_D, self.gpio.OUT)
             
             # Initialize PWM
-            self.pwm_instances['A'] = GPIO.PWM(GPIOPins.EN_A, MotorConfig.PWM_FREQUENCY)
-            self.pwm_instances['B'] = GPIO.PWM(GPIOPins.EN_B, MotorConfig.PWM_FREQUENCY)
-            self.pwm_instances['C'] = GPIO.PWM(GPIOPins.EN_C, MotorConfig.PWM_FREQUENCY)
-            self.pwm_instances['D'] = GPIO.PWM(GPIOPins.EN_D, MotorConfig.PWM_FREQUENCY)
+            self.pwm_instances['A'] = create_pwm(self.gpio, GPIOPins.EN_A, MotorConfig.PWM_FREQUENCY, self.pwm_mode)
+            self.pwm_instances['B'] = create_pwm(self.gpio, GPIOPins.EN_B, MotorConfig.PWM_FREQUENCY, self.pwm_mode)
+            self.pwm_instances['C'] = create_pwm(self.gpio, GPIOPins.EN_C, MotorConfig.PWM_FREQUENCY, self.pwm_mode)
+            self.pwm_instances['D'] = create_pwm(self.gpio, GPIOPins.EN_D, MotorConfig.PWM_FREQUENCY, self.pwm_mode)
             
             # Start PWM with 0% duty cycle
             for pwm in self.pwm_instances.values():
                 if pwm:
                     pwm.start(0)
+            for en_pin in (GPIOPins.EN_A, GPIOPins.EN_B, GPIOPins.EN_C, GPIOPins.EN_D):
+                self.shadow.record_duty(en_pin, 0.0)
             
-            logger.info("GPIO setup completed successfully")
+            logger.info(f"GPIO setup completed successfully ({self.pwm_mode} PWM)")
         except Exception as e:
             logger.error(f"Failed to setup GPIO: {str(e)}")
             self.cleanup()
@@ -119,7 +175,19 @@ class MotorController:
             raise ValueError(f"Invalid motor number: {motor}")
         return pins[motor]
 
-    def get_motor_pwm(self, motor: int) -> Optional[GPIO.PWM]:
+    def get_motor_enable_pin(self, motor: int) -> int:
+        """Get the PWM enable pin for a specific motor"""
+        pins = {1: GPIOPins.EN_A, 2: GPIOPins.EN_B, 3: GPIOPins.EN_C, 4: GPIOPins.EN_D}
+        if motor not in pins:
+            raise ValueError(f"Invalid motor number: {motor}")
+        return pins[motor]
+
+    def get_motor_duty(self, motor: int) -> float:
+        """Get the duty cycle last written to a specific motor"""
+        duty = self.shadow.duty(self.get_motor_enable_pin(motor))
+        return duty if duty is not None else 0.0
+
+    def get_motor_pwm(self, motor: int) -> Optional[PWMChannel]:
         """Get the PWM instance for a specific motor"""
         pwm_map = {1: 'A', 2: 'B', 3: 'C', 4: 'D'}
         return self.pwm_instances.get(pwm_map.get(motor))
@@ -128,17 +196,16 @@ class MotorController:
         """Set the direction of a specific motor"""
         with self._motor_locks[motor]:
             try:
+                if self._emergency_stop.is_set():
+                    direction = 'stop'
                 in1, in2 = self.get_motor_pins(motor)
-                if direction == 'forward':
-                    GPIO.output(in1, GPIO.HIGH)
-                    GPIO.output(in2, GPIO.LOW)
-                elif direction == 'backward':
-                    GPIO.output(in1, GPIO.LOW)
-                    GPIO.output(in2, GPIO.HIGH)
-                else:  # stop
-                    GPIO.output(in1, GPIO.LOW)
-                    GPIO.output(in2, GPIO.LOW)
-                logger.info(f"Motor {motor} direction set to {direction}")
+                level1, level2 = self.DIRECTION_LEVELS.get(
+                    direction, self.DIRECTION_LEVELS['stop'])
+                self.shadow.output(in1, level1)
+                self.shadow.output(in2, level2)
+                self._record_frame('single')
+                logger.debug("Motor %d direction set to %s", motor, direction,
+                             extra={'motor': motor})
             except Exception as e:
                 logger.error(f"Error setting motor {motor} direction: {str(e)}")
                 raise
@@ -149,58 +216,247 @@ class MotorController:
             try:
                 speed = float(speed)
                 speed = min(max(speed, MotorConfig.MIN_SPEED), MotorConfig.MAX_DUTY_CYCLE)
+                if self._emergency_stop.is_set():
+                    speed = 0.0
                 pwm = self.get_motor_pwm(motor)
                 if pwm:
-                    pwm.ChangeDutyCycle(speed)
-                    logger.info(f"Motor {motor} speed set to {speed}% duty cycle")
+                    self.shadow.change_duty_cycle(self.get_motor_enable_pin(motor), pwm, speed)
+                    self._record_frame('single')
+                    logger.debug("Motor %d speed set to %s%% duty cycle", motor, speed,
+                                 extra={'motor': motor})
                 else:
                     raise ValueError(f"PWM not initialized for motor {motor}")
             except Exception as e:
                 logger.error(f"Error setting motor {motor} speed: {str(e)}")
                 raise
 
+    def _record_frame(self, source: str, latency: Optional[float] = None):
+        """Append the current state of all four wheels to the telemetry ring
+
+        Called with the motor lock(s) of the writer held, so the record
+        matches what was written.
+        """
+        if self.telemetry is None:
+            return
+        directions = []
+        duties = []
+        for motor in range(1, 5):
+            in1, in2 = self.get_motor_pins(motor)
+            levels = (self.shadow.level(in1), self.shadow.level(in2))
+            if levels == self.DIRECTION_LEVELS['forward']:
+                directions.append(1)
+            elif levels == self.DIRECTION_LEVELS['backward']:
+                directions.append(-1)
+            else:
+                directions.append(0)
+            duties.append(self.get_motor_duty(motor))
+        self.telemetry.append(duties, directions, source, latency=latency)
+
+    def apply_frame(self, directions: Dict[int, str],
+                    duties: Dict[int, float], source: str = 'frame',
+                    input_time: Optional[float] = None) -> FrameTiming:
+        """Apply directions and duty cycles for several motors as one frame
+
+        All motor locks are held for the whole frame so no other writer can
+        observe or produce a half-applied wheel state. Pins and duty cycles
+        that already have the requested value are not written again. While
+        the emergency stop is active every motor in the frame is stopped.
+        The resulting wheel state is recorded in the telemetry ring with
+        the given source. input_time is the time.monotonic() timestamp of
+        the input sample the frame was computed from; the time from there
+        until all writes completed goes into the latency histogram and the
+        telemetry record.
+        """
+        locks = [self._motor_locks[motor] for motor in range(1, 5)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            start = time.perf_counter()
+            if self._emergency_stop.is_set():
+                directions = {motor: 'stop' for motor in directions}
+                duties = {motor: 0.0 for motor in duties}
+            pin_writes = duty_writes = skipped = 0
+            for motor, direction in directions.items():
+                levels = self.DIRECTION_LEVELS.get(
+                    direction, self.DIRECTION_LEVELS['stop'])
+                for pin, level in zip(self.get_motor_pins(motor), levels):
+                    if self.shadow.output(pin, level):
+                        pin_writes += 1
+                    else:
+                        skipped += 1
+            for motor, speed in duties.items():
+                speed = min(max(float(speed), MotorConfig.MIN_SPEED),
+                            MotorConfig.MAX_DUTY_CYCLE)
+                # Checked again per write: a stop raised after the check above
+                # must not be undone by the rest of this frame
+                if self._emergency_stop.is_set():
+                    speed = 0.0
+                pwm = self.get_motor_pwm(motor)
+                if not pwm:
+                    raise ValueError(f"PWM not initialized for motor {motor}")
+                if self.shadow.change_duty_cycle(self.get_motor_enable_pin(motor), pwm, speed):
+                    duty_writes += 1
+                else:
+                    skipped += 1
+            latency = None
+            if input_time is not None:
+                latency = time.monotonic() - input_time
+                self.latency.record(latency)
+            timing = FrameTiming(time.perf_counter() - start,
+                                 pin_writes, duty_writes, skipped, latency)
+            self._record_frame(source, latency)
+        except Exception as e:
+            logger.error(f"Error applying motor frame: {str(e)}")
+            raise
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        logger.debug("Frame applied in %.0f us (%d pin, %d duty, %d skipped)",
+                     timing.duration * 1e6, pin_writes, duty_writes, skipped)
+        return timing
+
+    def drive(self, x: float, y: float, r: float, source: str = 'frame',
+              input_time: Optional[float] = None) -> FrameTiming:
+        """Apply body velocities x (strafe), y (forward), r (rotation) in -1..1
+
+        Mixes the command into four wheel duties and applies them as one
+        frame; matches the output signature of command_arbiter.CommandArbiter.
+        """
+        directions, duties = frame(mix(x, y, r, MotorConfig.MAX_DUTY_CYCLE))
+        return self.apply_frame(directions, duties, source=source, input_time=input_time)
+
+    def stream_velocity(self, x: float, y: float, r: float, lease: float,
+                        source: str = 'web', input_time: Optional[float] = None) -> float:
+        """Apply body velocities and hold them for `lease` seconds
+
+        For remote clients streaming commands at a low rate: the command
+        stays in effect until the next one arrives or the lease runs out,
+        then all motors ramp to 0 over LEASE_DECAY_TIME. Returns the
+        granted lease, which is capped at velocity_lease.MAX_LEASE.
+        """
+        return self.leases.command(x, y, r, lease, source, input_time)
+
+    def _apply_lease(self, x: float, y: float, r: float, source: str,
+                     input_time: Optional[float]):
+        # A new command takes over from a decay still in progress
+        self.ramps.cancel()
+        self.drive(x, y, r, source, input_time)
+
+    def _decay_lease(self, duration: float):
+        if not self._emergency_stop.is_set():
+            for motor in range(1, 5):
+                self.ramp_motor(motor, 0, duration)
+
+    def _apply_ramp_duties(self, duties: Dict[int, float]):
+        """Write the duties of one ramp scheduler tick as a single frame"""
+        if not self._emergency_stop.is_set():
+            self.apply_frame({}, duties, source='ramp')
+
+    def ramp_motor(self, motor: int, end_speed: float, duration: float,
+                   start_speed: Optional[float] = None) -> threading.Event:
+        """Start ramping a motor to end_speed over duration seconds
+
+        Returns immediately. A running ramp of the same motor is preempted
+        and, without start_speed, the new ramp continues from the current
+        duty. The returned event is set once the ramp completes or is
+        cancelled.
+        """
+        self.get_motor_pins(motor)
+        end_speed = max(min(end_speed, MotorConfig.MAX_DUTY_CYCLE), MotorConfig.MIN_SPEED)
+        if start_speed is not None:
+            start_speed = max(min(start_speed, MotorConfig.MAX_DUTY_CYCLE), MotorConfig.MIN_SPEED)
+        if self._emergency_stop.is_set():
+            done = threading.Event()
+            done.set()
+            return done
+        return self.ramps.ramp(motor, end_speed, duration, start_speed)
+
     def accelerate_motor(self, motor: int, start_speed: float, end_speed: float, 
                         step_delay: float = MotorConfig.DEFAULT_STEP_DELAY):
-        """Accelerate or decelerate a motor between two speeds"""
-        with self._motor_locks[motor]:
+        """Accelerate or decelerate a motor between two speeds
+
+        Blocks until the ramp is done. The ramp takes as long as the former
+        1% steps of step_delay did, but is driven by the ramp scheduler.
+        """
+        try:
+            start_speed = max(min(start_speed, MotorConfig.MAX_DUTY_CYCLE), MotorConfig.MIN_SPEED)
+            end_speed = max(min(end_speed, MotorConfig.MAX_DUTY_CYCLE), MotorConfig.MIN_SPEED)
+            duration = abs(int(end_speed) - int(start_speed)) * step_delay
+            self.ramp_motor(motor, end_speed, duration, start_speed).wait()
+            logger.info("Motor %d acceleration completed: %s -> %s", motor, start_speed, end_speed,
+                        extra={'motor': motor})
+        except Exception as e:
+            logger.error(f"Error during motor {motor} acceleration: {str(e)}")
+            raise
+
+    @property
+    def emergency_stopped(self) -> bool:
+        """Whether the emergency stop is active"""
+        return self._emergency_stop.is_set()
+
+    def add_emergency_stop_callback(self, callback: Callable[[], None]):
+        """Register a callback run right after the EN pins have been zeroed"""
+        self._emergency_stop_callbacks.append(callback)
+
+    def emergency_stop(self) -> float:
+        """Immediately stop all motors, returns the time until they are guaranteed stopped
+
+        The EN pins are first written directly, without the motor locks,
+        the pin shadow or the ramp scheduler, so the motors lose power after
+        four duty writes even while a ramp or a frame holds the locks. That
+        fast path alone is no bound though: a frame that checked the stop
+        flag just before it was set may still write one non-zero duty
+        afterwards. The locks are therefore taken once more to zero every
+        pin through the shadow; once they are released no writer can
+        produce a non-zero duty, and the time until then is returned. The
+        fast-path time is kept in `estop_fast_latency`, the perf_counter()
+        time of the direct zeroing in `estop_zeroed_at`.
+        """
+        start = time.perf_counter()
+        self._emergency_stop.set()
+        for pwm in self.pwm_instances.values():
+            if pwm:
+                try:
+                    pwm.ChangeDutyCycle(0)
+                except Exception as e:
+                    logger.error(f"Error zeroing PWM during emergency stop: {str(e)}")
+        self.estop_zeroed_at = time.perf_counter()
+        self.estop_fast_latency = self.estop_zeroed_at - start
+
+        self.ramps.cancel()
+        for callback in self._emergency_stop_callbacks:
             try:
-                start_speed = max(min(start_speed, MotorConfig.MAX_DUTY_CYCLE), MotorConfig.MIN_SPEED)
-                end_speed = max(min(end_speed, MotorConfig.MAX_DUTY_CYCLE), MotorConfig.MIN_SPEED)
-                
-                if start_speed < end_speed:
-                    for speed in range(int(start_speed), int(end_speed) + 1):
-                        if self._emergency_stop:
-                            break
-                        self.set_motor_speed(motor, speed)
-                        time.sleep(step_delay)
-                else:
-                    for speed in range(int(start_speed), int(end_speed) - 1, -1):
-                        if self._emergency_stop:
-                            break
-                        self.set_motor_speed(motor, speed)
-                        time.sleep(step_delay)
-                
-                logger.info(f"Motor {motor} acceleration completed: {start_speed} -> {end_speed}")
+                callback()
             except Exception as e:
-                logger.error(f"Error during motor {motor} acceleration: {str(e)}")
-                raise
+                logger.error(f"Error in emergency stop callback: {str(e)}")
 
-    def emergency_stop(self):
-        """Immediately stop all motors"""
-        with self._emergency_stop_lock:
-            self._emergency_stop = True
-        
-        for motor in range(1, 5):
-            with self._motor_locks[motor]:
-                self.set_motor_direction(motor, 'stop')
-                self.set_motor_speed(motor, 0)
-        
-        logger.warning("Emergency stop activated")
+        locks = [self._motor_locks[motor] for motor in range(1, 5)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for motor in range(1, 5):
+                in1, in2 = self.get_motor_pins(motor)
+                en_pin = self.get_motor_enable_pin(motor)
+                for pin in (in1, in2, en_pin):
+                    self.shadow.forget(pin)
+                self.shadow.output(in1, self.gpio.LOW)
+                self.shadow.output(in2, self.gpio.LOW)
+                pwm = self.get_motor_pwm(motor)
+                if pwm:
+                    self.shadow.change_duty_cycle(en_pin, pwm, 0.0)
+            self._record_frame('estop')
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        latency = time.perf_counter() - start
+
+        logger.warning(f"Emergency stop activated (EN pins at 0 after "
+                       f"{self.estop_fast_latency * 1e6:.0f} us, locked after {latency * 1e6:.0f} us)")
+        return latency
 
     def reset_emergency_stop(self):
         """Reset the emergency stop flag"""
-        with self._emergency_stop_lock:
-            self._emergency_stop = False
+        self._emergency_stop.clear()
         logger.info("Emergency stop reset")
 
     def cleanup(self):
@@ -208,10 +464,19 @@ class MotorController:
         with self._cleanup_lock:
             if not self._cleanup_done:
                 try:
+                    self.leases.stop()
+                    if self.leases.granted:
+                        logger.info(f"Velocity leases: {self.leases.summary()}")
+                    self.ramps.stop()
                     for pwm in self.pwm_instances.values():
                         if pwm:
                             pwm.stop()
-                    GPIO.cleanup()
+                    self.gpio.cleanup()
+                    self.shadow.forget()
+                    if self.telemetry is not None:
+                        self.telemetry.close()
+                    if self.latency.count:
+                        logger.info(self.latency.summary())
                     self._cleanup_done = True
                     logger.info("GPIO cleanup completed")
                 except Exception as e:
@@ -230,96 +495,143 @@ class MotorMovement:
     
     def __init__(self, controller: MotorController):
         self.controller = controller
-
-    def _run_motor_sequence(self, motor_commands: list):
-        """Execute a sequence of motor commands in parallel"""
-        threads = []
-        for motor, direction in motor_commands:
-            thread = threading.Thread(
-                target=self._motor_control_thread,
-                args=(motor, direction)
-            )
-            threads.append(thread)
-            thread.start()
-
-        for thread in threads:
-            thread.join()
-
-    def _motor_control_thread(self, motor: int, direction: str,
-                            start_speed: float = MotorConfig.STARTUP_SPEED,
-                            end_speed: float = MotorConfig.MAX_DUTY_CYCLE,
-                            step_delay: float = MotorConfig.DEFAULT_STEP_DELAY,
-                            run_time: float = MotorConfig.DEFAULT_RUN_TIME):
-        """Control thread for a single motor"""
+        # Movements run one after another on a single long-lived worker
+        self.executor = MotionExecutor()
+        # An emergency stop also drops every queued and running movement
+        controller.add_emergency_stop_callback(self.executor.cancel_all)
+
+    def _run_motor_sequence(self, motor_commands: list, wait: bool = True) -> Future:
+        """Queue a sequence of motor commands to run in parallel
+
+        Returns a Future that resolves to True once the move completed or
+        False if it was cancelled or the emergency stop is active. With
+        wait=True the call blocks until then; that is refused from a
+        movement on the executor thread, which would wait for itself.
+        """
+        if wait and self.executor.on_worker_thread():
+            raise RuntimeError("Cannot wait for a movement from the motion executor thread")
+        future = self.executor.submit(self._execute_motor_sequence, motor_commands)
+        if wait:
+            future.result()
+        return future
+
+    def _execute_motor_sequence(self, motor_commands: list,
+                                start_speed: float = MotorConfig.STARTUP_SPEED,
+                                end_speed: float = MotorConfig.MAX_DUTY_CYCLE,
+                                step_delay: float = MotorConfig.DEFAULT_STEP_DELAY,
+                                run_time: float = MotorConfig.DEFAULT_RUN_TIME,
+                                cancel: Optional[threading.Event] = None) -> bool:
+        """Ramp up, hold and ramp down the given motors on the executor thread
+
+        All motors ramp together through the controller's ramp scheduler,
+        so no thread is created per motor.
+        """
+        cancel = cancel if cancel is not None else threading.Event()
+        motors = [motor for motor, _ in motor_commands]
+        if self.controller.emergency_stopped:
+            logger.info(f"Motor sequence {motor_commands} refused, emergency stop active")
+            return False
+        ramp_time = abs(int(end_speed) - int(start_speed)) * step_delay
         try:
-            self.controller.set_motor_direction(motor, direction)
-            self.controller.accelerate_motor(motor, start_speed, end_speed, step_delay)
-            time.sleep(run_time)
-            self.controller.accelerate_motor(motor, end_speed, start_speed, step_delay)
-            self.controller.set_motor_direction(motor, 'stop')
-            self.controller.set_motor_speed(motor, 0)
+            self.controller.apply_frame(dict(motor_commands),
+                                        {motor: start_speed for motor in motors},
+                                        source='script')
+            completed = (self._ramp_all(motors, end_speed, ramp_time, cancel)
+                         and not cancel.wait(run_time)
+                         and self._ramp_all(motors, start_speed, ramp_time, cancel))
         except Exception as e:
-            logger.error(f"Error in motor {motor} control thread: {str(e)}")
+            logger.error(f"Error in motor sequence {motor_commands}: {str(e)}")
             self.controller.emergency_stop()
-
-    def forward(self):
+            raise
+        finally:
+            for motor in motors:
+                self.controller.ramps.cancel(motor)
+        self.controller.apply_frame({motor: 'stop' for motor in motors},
+                                    {motor: 0 for motor in motors}, source='script')
+        if not completed:
+            logger.info(f"Motor sequence {motor_commands} cancelled")
+        return completed
+
+    def _ramp_all(self, motors: list, end_speed: float, duration: float,
+                  cancel: threading.Event) -> bool:
+        """Ramp several motors at once, returns False if cancelled or stopped first
+
+        ramp_motor hands back an already set event during an emergency
+        stop, so the stop flag is checked as well as the cancel event.
+        """
+        done = [self.controller.ramp_motor(motor, end_speed, duration) for motor in motors]
+        for event in done:
+            while not event.wait(MotorConfig.RAMP_TICK):
+                if cancel.is_set():
+                    return False
+        return not cancel.is_set() and not self.controller.emergency_stopped
+
+    def cancel(self):
+        """Cancel all queued movements and stop the running one"""
+        self.executor.cancel_all()
+
+    def shutdown(self, cancel: bool = True):
+        """Stop the movement executor, by default cancelling queued movements"""
+        self.executor.shutdown(wait=True, cancel=cancel)
+
+    def forward(self, wait: bool = True) -> Future:
         """Move all motors forward"""
         motor_commands = [(i, 'forward') for i in range(1, 5)]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def backward(self):
+    def backward(self, wait: bool = True) -> Future:
         """Move all motors backward"""
         motor_commands = [(i, 'backward') for i in range(1, 5)]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def right(self):
+    def right(self, wait: bool = True) -> Future:
         """Turn right (tank turn)"""
         motor_commands = [
             (1, 'backward'), (2, 'forward'),
             (3, 'forward'), (4, 'backward')
         ]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def left(self):
+    def left(self, wait: bool = True) -> Future:
         """Turn left (tank turn)"""
         motor_commands = [
             (1, 'forward'), (2, 'backward'),
             (3, 'backward'), (4, 'forward')
         ]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def turning_right(self):
+    def turning_right(self, wait: bool = True) -> Future:
         """Turn right in place"""
         motor_commands = [
             (1, 'forward'), (2, 'forward'),
             (3, 'backward'), (4, 'backward')
         ]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def turning_left(self):
+    def turning_left(self, wait: bool = True) -> Future:
         """Turn left in place"""
         motor_commands = [
             (1, 'backward'), (2, 'backward'),
             (3, 'forward'), (4, 'forward')
         ]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def forward_right(self):
+    def forward_right(self, wait: bool = True) -> Future:
         """Move forward and right"""
         motor_commands = [(2, 'forward'), (3, 'forward')]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def forward_left(self):
+    def forward_left(self, wait: bool = True) -> Future:
         """Move forward and left"""
         motor_commands = [(1, 'forward'), (4, 'forward')]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def backward_right(self):
+    def backward_right(self, wait: bool = True) -> Future:
         """Move backward and right"""
         motor_commands = [(1, 'backward'), (4, 'backward')]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
 
-    def backward_left(self):
+    def backward_left(self, wait: bool = True) -> Future:
         """Move backward and left"""
         motor_commands = [(2, 'backward'), (3, 'backward')]
-        self._run_motor_sequence(motor_commands)
+        return self._run_motor_sequence(motor_commands, wait)
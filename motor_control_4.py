@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
-import RPi.GPIO as GPIO
+from gpio_backend import get_backend
+from pin_shadow import PinShadow
+from hardware_pwm import create_pwm
+from mecanum_kinematics import WHEEL_POLARITY, frame, mix
+from control_loop import ControlLoop
+from latency_histogram import LatencyHistogram
+from axis_shaping import AxisShaper
+from joystick_input import joystick_command, open_joystick
 import time
 import threading
-import pygame
 import sys
 
 # Globaler Parameter für den PWM-Duty-Cycle
 MAX_DUTY_CYCLE = 100
+JOYSTICK_KEEPALIVE = 0.5  # Sekunden ohne Eingabe bis zum erneuten Setzen der Motoren
 
-# GPIO initialisieren
+# GPIO initialisieren (RPi.GPIO auf dem Roboter, sonst simuliert; wählbar über $ROBODOM_GPIO)
+GPIO = get_backend()
 GPIO.setmode(GPIO.BCM)
 
 # Definition der GPIO-Pins für jeden Motor
@@ -21,42 +29,41 @@ MOTOR_PINS = {
 }
 
 class Motor:
-    def __init__(self, EN, IN1, IN2, reversed=False):
+    def __init__(self, EN, IN1, IN2, shadow=None, pwm_mode='software', gpio=None):
+        self.gpio = gpio if gpio is not None else GPIO
         self.en_pin = EN
         self.in1_pin = IN1
         self.in2_pin = IN2
-        self.reversed = reversed
+        # Schattenregister: unveränderte Pegel/Duty-Cycles werden nicht erneut geschrieben
+        self.shadow = shadow if shadow is not None else PinShadow(self.gpio)
 
         # Initialisiere die GPIO-Pins
-        GPIO.setup(self.en_pin, GPIO.OUT)
-        GPIO.setup(self.in1_pin, GPIO.OUT)
-        GPIO.setup(self.in2_pin, GPIO.OUT)
-
-        # Erstelle und starte das PWM-Signal
-        self.pwm = GPIO.PWM(self.en_pin, 1000)
+        # Bei Hardware-PWM bleibt der EN-Pin in seiner PWM-Alternativfunktion
+        if pwm_mode == 'software':
+            self.gpio.setup(self.en_pin, self.gpio.OUT)
+        self.gpio.setup(self.in1_pin, self.gpio.OUT)
+        self.gpio.setup(self.in2_pin, self.gpio.OUT)
+
+        # Erstelle und starte das PWM-Signal (Software- oder Hardware-PWM)
+        self.pwm = create_pwm(self.gpio, self.en_pin, 1000, pwm_mode)
         self.pwm.start(0)
+        self.shadow.record_duty(self.en_pin, 0)
 
     def set_direction(self, direction):
-        # Falls der Motor invertiert ist, kehre die Richtung um
-        if self.reversed:
-            if direction == 'forward':
-                direction = 'backward'
-            elif direction == 'backward':
-                direction = 'forward'
         if direction == 'forward':
-            GPIO.output(self.in1_pin, GPIO.HIGH)
-            GPIO.output(self.in2_pin, GPIO.LOW)
+            self.shadow.output(self.in1_pin, self.gpio.HIGH)
+            self.shadow.output(self.in2_pin, self.gpio.LOW)
         elif direction == 'backward':
-            GPIO.output(self.in1_pin, GPIO.LOW)
-            GPIO.output(self.in2_pin, GPIO.HIGH)
+            self.shadow.output(self.in1_pin, self.gpio.LOW)
+            self.shadow.output(self.in2_pin, self.gpio.HIGH)
         else:  # Stop
-            GPIO.output(self.in1_pin, GPIO.LOW)
-            GPIO.output(self.in2_pin, GPIO.LOW)
+            self.shadow.output(self.in1_pin, self.gpio.LOW)
+            self.shadow.output(self.in2_pin, self.gpio.LOW)
         # Debug: print(f"Motor {self.en_pin} Richtung: {direction}")
 
     def set_speed(self, speed):
         speed = max(0, min(speed, MAX_DUTY_CYCLE))
-        self.pwm.ChangeDutyCycle(speed)
+        self.shadow.change_duty_cycle(self.en_pin, self.pwm, speed)
         # Debug: print(f"Motor {self.en_pin} Geschwindigkeit: {speed}")
 
     def stop(self):
@@ -64,105 +71,114 @@ class Motor:
         self.pwm.stop()
 
 class MecanumRobot:
-    def __init__(self):
-        # Motor 2 ist invertiert, da er physisch umgekehrt montiert/verkabelt wurde.
+    def __init__(self, pwm_mode='software', gpio=None):
+        self.gpio = gpio if gpio is not None else GPIO
+        # Gemeinsames Schattenregister für alle Pins, damit die Zähler den ganzen Roboter abdecken
+        self.shadow = PinShadow(self.gpio)
+        # Motor 2 ist physisch umgekehrt montiert/verkabelt; das berücksichtigt
+        # das Vorzeichen in WHEEL_POLARITY beim Mischen der Radgeschwindigkeiten.
+        self.polarity = WHEEL_POLARITY
+        # Latenz Eingabe -> PWM/Pins geschrieben, zur Laufzeit abrufbar und beim Stoppen ausgegeben
+        self.latency = LatencyHistogram('Eingabe bis PWM')
         self.motors = {
-            1: Motor(**MOTOR_PINS[1]),
-            2: Motor(**MOTOR_PINS[2], reversed=True),
-            3: Motor(**MOTOR_PINS[3]),
-            4: Motor(**MOTOR_PINS[4])
+            1: Motor(**MOTOR_PINS[1], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio),
+            2: Motor(**MOTOR_PINS[2], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio),
+            3: Motor(**MOTOR_PINS[3], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio),
+            4: Motor(**MOTOR_PINS[4], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio)
         }
 
+    def set_wheel_duties(self, duties, input_time=None):
+        """Setzt Richtung und Geschwindigkeit aller Motoren aus vorzeichenbehafteten Duty-Cycles.
+
+        input_time: time.monotonic()-Zeitstempel der Eingabe, aus der die Duty-Cycles
+        berechnet wurden; die Zeit bis zum letzten Pin-Schreibzugriff geht in self.latency.
+        """
+        directions, speeds = frame(duties)
+        for number, motor in self.motors.items():
+            motor.set_direction(directions[number])
+            motor.set_speed(speeds[number])
+        self.latency.record_since(input_time)
+
     def stop_all(self):
         for motor in self.motors.values():
             motor.stop()
-        GPIO.cleanup()
+        self.gpio.cleanup()
+        self.shadow.forget()
+        stats = self.shadow.stats()
+        print(f"GPIO-Schreibzugriffe: {stats['issued']} ausgeführt, {stats['suppressed']} unterdrückt.")
+        if self.latency.count:
+            print(self.latency.summary())
         print("Alle Motoren gestoppt und GPIO aufgeräumt.")
 
-def live_control(robot):
+def live_control(robot, backend=None, rate=None):
     """
-    Liest den Xbox-Controller via Pygame aus und berechnet anhand der Achsenwerte
+    Liest den Xbox-Controller aus und berechnet anhand der Achsenwerte
     für Translation (x, y) und Rotation (r) die gewünschten Geschwindigkeiten und Richtungen
     der einzelnen Motoren. Anschließend werden diese Werte direkt an den Motoren gesetzt.
+    backend: 'evdev' (direkt aus /dev/input, ohne Pygame/SDL), 'pygame' oder 'auto'.
+    rate: ohne Angabe ereignisgesteuert, sonst feste Regelrate in Hz (siehe control_loop).
     """
-    pygame.init()
-    pygame.joystick.init()
+    # Mit Hotplug: fehlt der Controller oder fällt er aus, stehen die Motoren
+    # still, bis er wieder da ist – ohne GPIO oder Pygame neu zu initialisieren.
     try:
-        joystick = pygame.joystick.Joystick(0)
-        joystick.init()
-        print(f"Verbunden mit {joystick.get_name()}")
-    except pygame.error:
+        inputs = open_joystick(backend, hotplug=True)
+    except OSError:
         print("Kein Xbox-Controller gefunden.")
         sys.exit()
-
-    clock = pygame.time.Clock()
+    print(f"Verbunden mit {inputs.name}" if inputs.connected else "Warte auf Xbox-Controller ...")
+
+    # Ereignisgesteuert statt Polling: wartet auf Achsen-/Tasten-Events und
+    # mischt nur bei Änderungen neu, plus Keepalive alle JOYSTICK_KEEPALIVE Sekunden
+    loop = ControlLoop(rate) if rate else None
+    # Deadzone, Expo-Kurven und Slew-Limit zwischen Controller und Mischer
+    shaper = AxisShaper()
+    last_sequence = inputs.state.sequence
+    connected = inputs.connected
     try:
         while True:
-            # Pygame-Ereignisse verarbeiten
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    raise KeyboardInterrupt
-
-            # Joystick-Achsen auslesen:
-            # Linker Stick: Achse 0 (X) und Achse 1 (Y, invertiert, da up = negativ)
-            # Rechter Stick: Achse 2 (Rotation, hier als horizontale Achse genutzt)
-            x = joystick.get_axis(0)
-            y = -joystick.get_axis(1)
-            r = -joystick.get_axis(2)
-
-            # Einfache Deadzone-Behandlung
-            threshold = 0.1
-            if abs(x) < threshold: x = 0
-            if abs(y) < threshold: y = 0
-            if abs(r) < threshold: r = 0
-
-            # Mecanum-Drive Formel:
+            if loop is None:
+                # Solange die Achsen noch nachlaufen (Slew-Limit), im Takt des Shapers aufwachen
+                inputs.wait(JOYSTICK_KEEPALIVE if shaper.settled else shaper.tick)
+            else:
+                # Feste Rate mit absoluten Deadlines; Eingaben werden während des Wartens übernommen
+                loop.wait(inputs.wait)
+            if inputs.quit:
+                raise KeyboardInterrupt
+            if inputs.connected != connected:
+                connected = inputs.connected
+                if connected:
+                    print(f"Verbunden mit {inputs.name}")
+                else:
+                    # Controller weg: Achsen sind neutral, Motoren sofort auf 0 statt per Slew-Rampe
+                    shaper.reset()
+                    print("Controller getrennt – Motoren gestoppt, warte auf Wiederverbindung.")
+
+            # Joystick-Achsen aus dem zuletzt empfangenen Zustand, geformt durch den Shaper
+            x, y, r = shaper.shape(*joystick_command(inputs.state))
+            # Nur Frames aus einer neuen Eingabe bekommen deren Zeitstempel (Keepalives nicht)
+            input_time = inputs.state.timestamp if inputs.state.sequence != last_sequence else None
+            last_sequence = inputs.state.sequence
+
+            # Mecanum-Drive Formel (siehe mecanum_kinematics.MIXING_MATRIX):
             # Motor 1 (Front Left) = y + x + r
             # Motor 2 (Front Right) = y - x - r
             # Motor 3 (Rear Left) = y - x + r
             # Motor 4 (Rear Right) = y + x - r
-            m1_val = y + x + r
-            m2_val = y - x - r
-            m3_val = y - x + r
-            m4_val = y + x - r
-
-            # Normierung, falls Werte den MAX_DUTY_CYCLE überschreiten
-            max_val = max(abs(m1_val), abs(m2_val), abs(m3_val), abs(m4_val), 1)
-            scale = MAX_DUTY_CYCLE / max_val
-
-            m1_speed = min(MAX_DUTY_CYCLE, abs(m1_val * scale))
-            m2_speed = min(MAX_DUTY_CYCLE, abs(m2_val * scale))
-            m3_speed = min(MAX_DUTY_CYCLE, abs(m3_val * scale))
-            m4_speed = min(MAX_DUTY_CYCLE, abs(m4_val * scale))
-
-            m1_dir = 'forward' if m1_val >= 0 else 'backward'
-            m2_dir = 'forward' if m2_val >= 0 else 'backward'
-            m3_dir = 'forward' if m3_val >= 0 else 'backward'
-            m4_dir = 'forward' if m4_val >= 0 else 'backward'
+            # Normierung auf MAX_DUTY_CYCLE und Polarität von Motor 2 erledigt mix().
+            duties = mix(x, y, r, MAX_DUTY_CYCLE, robot.polarity)
 
             # Setze die Motoren in Echtzeit
-            robot.motors[1].set_direction(m1_dir)
-            robot.motors[1].set_speed(m1_speed)
-
-            robot.motors[2].set_direction(m2_dir)
-            robot.motors[2].set_speed(m2_speed)
-
-            robot.motors[3].set_direction(m3_dir)
-            robot.motors[3].set_speed(m3_speed)
-
-            robot.motors[4].set_direction(m4_dir)
-            robot.motors[4].set_speed(m4_speed)
+            robot.set_wheel_duties(duties, input_time)
 
             # Optional: Debug-Ausgabe der Werte
-            # print(f"Motor1: {m1_dir} {m1_speed:.1f}, Motor2: {m2_dir} {m2_speed:.1f}, "
-            #       f"Motor3: {m3_dir} {m3_speed:.1f}, Motor4: {m4_dir} {m4_speed:.1f}")
-
-            clock.tick(60)
+            # print(f"Duty-Cycles: {duties}")
     except KeyboardInterrupt:
         pass
     finally:
         robot.stop_all()
-        pygame.quit()
+        inputs.close()
+        if loop is not None:
+            print(f"Regelschleife: {loop.summary()}")
         sys.exit()
 
 if __name__ == "__main__":
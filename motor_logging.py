@@ -0,0 +1,185 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class DroppingQueueHandler(logging.Handler):
+    """Handler that only puts records on a bounded queue
+
+    Formatting happens on the writer thread. If the queue is full the record
+    is dropped and counted instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__()
+        self.queue = log_queue
+        self.dropped = 0
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class MotorCommandFilter(logging.Filter):
+    """Rate-limit per-motor command records, counting what was dropped
+
+    Records logged with extra={'motor': n} pass at most `rate` times per
+    second per motor; WARNING and above always pass. The first record let
+    through after drops carries the number of suppressed records.
+    """
+
+    def __init__(self, rate: float = 5.0):
+        super().__init__()
+        self.interval = 1.0 / rate if rate > 0 else float('inf')
+        self._next_allowed: Dict[int, float] = {}
+        self._pending_drops: Dict[int, int] = {}
+        self.dropped: Dict[int, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        motor = getattr(record, 'motor', None)
+        if motor is None or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        if now < self._next_allowed.get(motor, 0.0):
+            self._pending_drops[motor] = self._pending_drops.get(motor, 0) + 1
+            self.dropped[motor] = self.dropped.get(motor, 0) + 1
+            return False
+        self._next_allowed[motor] = now + self.interval
+        drops = self._pending_drops.pop(motor, 0)
+        if drops:
+            record.msg = f"{record.msg} ({drops} similar records dropped)"
+        return True
+
+
+class BatchingFileHandler(logging.FileHandler):
+    """FileHandler that writes without flushing; the writer flushes per batch"""
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class AsyncLogWriter:
+    """Background thread draining the log queue into the real handlers
+
+    Records are handled in batches of up to `batch_size` and the handlers
+    are flushed once per batch, or after `flush_interval` when idle.
+    """
+
+    def __init__(self, log_queue: queue.Queue, handlers: List[logging.Handler],
+                 batch_size: int = 256, flush_interval: float = 0.5):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stop = object()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write everything still queued and stop the thread"""
+        if self._thread is None:
+            return
+        self.queue.put(self._stop)
+        self._thread.join()
+        self._thread = None
+
+    def _handle(self, record: logging.LogRecord):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            stop = record is self._stop
+            if not stop:
+                self._handle(record)
+                for _ in range(self.batch_size - 1):
+                    try:
+                        record = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is self._stop:
+                        stop = True
+                        break
+                    self._handle(record)
+            for handler in self.handlers:
+                handler.flush()
+            if stop:
+                return
+
+
+_writer: Optional[AsyncLogWriter] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_command_filter: Optional[MotorCommandFilter] = None
+
+
+def setup_logging(filename: str = 'motor_controller.log', level: int = logging.INFO,
+                  console: bool = True, command_rate: float = 5.0,
+                  queue_size: int = 10000) -> AsyncLogWriter:
+    """Route root logging through a queue to a background batching writer
+
+    Calling code only enqueues records; file and terminal I/O happen on the
+    writer thread. Per-motor command records are rate-limited to
+    `command_rate` per second and motor. Safe to call more than once.
+    """
+    global _writer, _queue_handler, _command_filter
+    if _writer is not None:
+        return _writer
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = [BatchingFileHandler(filename)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _command_filter = MotorCommandFilter(command_rate)
+    _queue_handler.addFilter(_command_filter)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+
+    _writer = AsyncLogWriter(log_queue, handlers)
+    _writer.start()
+    atexit.register(shutdown_logging)
+    return _writer
+
+
+def shutdown_logging():
+    """Flush and stop the background writer"""
+    global _writer
+    if _writer is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _writer.stop()
+    for handler in _writer.handlers:
+        handler.close()
+    _writer = None
+
+
+def dropped_counts() -> Dict[str, object]:
+    """Records dropped by the per-motor rate limit and by a full queue"""
+    return {
+        'per_motor': dict(_command_filter.dropped) if _command_filter else {},
+        'queue_full': _queue_handler.dropped if _queue_handler else 0
+    }
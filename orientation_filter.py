@@ -0,0 +1,176 @@
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+DEFAULT_BETA = 0.1  # gradient step gain, trades gyro drift against accel/mag noise
+WARMUP_BETA = 2.0  # gain while converging from the initial orientation
+WARMUP_TIME = 1.0  # seconds of samples processed with WARMUP_BETA
+
+Quaternion = Tuple[float, float, float, float]
+
+
+def _step(q0, q1, q2, q3, gx, gy, gz, ax, ay, az, mx, my, mz, beta, dt):
+    """One Madgwick update with gyro (rad/s), accel and optional mag (any unit)"""
+    # Rate of change of the quaternion from the gyroscope
+    d0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+    d1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+    d2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+    d3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+    # Gradient descent correction towards gravity and the magnetic field;
+    # skipped in free fall where the accelerometer has no direction
+    norm = math.sqrt(ax * ax + ay * ay + az * az)
+    if norm > 0.0:
+        ax /= norm
+        ay /= norm
+        az /= norm
+        q0q0, q1q1, q2q2, q3q3 = q0 * q0, q1 * q1, q2 * q2, q3 * q3
+        m_norm = math.sqrt(mx * mx + my * my + mz * mz)
+        if m_norm > 0.0:
+            mx /= m_norm
+            my /= m_norm
+            mz /= m_norm
+            q0q1, q0q2, q0q3 = q0 * q1, q0 * q2, q0 * q3
+            q1q2, q1q3, q2q3 = q1 * q2, q1 * q3, q2 * q3
+            # Field direction in the earth frame, reduced to north and vertical
+            hx = (mx * (q0q0 + q1q1 - q2q2 - q3q3) + 2.0 * my * (q1q2 - q0q3)
+                  + 2.0 * mz * (q0q2 + q1q3))
+            hy = (2.0 * mx * (q0q3 + q1q2) + my * (q0q0 - q1q1 + q2q2 - q3q3)
+                  + 2.0 * mz * (q2q3 - q0q1))
+            bx2 = math.sqrt(hx * hx + hy * hy)
+            bz2 = (2.0 * mx * (q1q3 - q0q2) + 2.0 * my * (q0q1 + q2q3)
+                   + mz * (q0q0 - q1q1 - q2q2 + q3q3))
+            # Objective function: gravity and field predicted minus measured
+            fax = 2.0 * (q1q3 - q0q2) - ax
+            fay = 2.0 * (q0q1 + q2q3) - ay
+            faz = 1.0 - 2.0 * (q1q1 + q2q2) - az
+            fmx = bx2 * (0.5 - q2q2 - q3q3) + bz2 * (q1q3 - q0q2) - mx
+            fmy = bx2 * (q1q2 - q0q3) + bz2 * (q0q1 + q2q3) - my
+            fmz = bx2 * (q0q2 + q1q3) + bz2 * (0.5 - q1q1 - q2q2) - mz
+            # Jacobian transposed times the objective
+            s0 = (-2.0 * q2 * fax + 2.0 * q1 * fay
+                  - bz2 * q2 * fmx + (-bx2 * q3 + bz2 * q1) * fmy + bx2 * q2 * fmz)
+            s1 = (2.0 * q3 * fax + 2.0 * q0 * fay - 4.0 * q1 * faz
+                  + bz2 * q3 * fmx + (bx2 * q2 + bz2 * q0) * fmy
+                  + (bx2 * q3 - 2.0 * bz2 * q1) * fmz)
+            s2 = (-2.0 * q0 * fax + 2.0 * q3 * fay - 4.0 * q2 * faz
+                  + (-2.0 * bx2 * q2 - bz2 * q0) * fmx + (bx2 * q1 + bz2 * q3) * fmy
+                  + (bx2 * q0 - 2.0 * bz2 * q2) * fmz)
+            s3 = (2.0 * q1 * fax + 2.0 * q2 * fay
+                  + (-2.0 * bx2 * q3 + bz2 * q1) * fmx + (-bx2 * q0 + bz2 * q2) * fmy
+                  + bx2 * q1 * fmz)
+        else:
+            s0 = 4.0 * q0 * q2q2 + 2.0 * q2 * ax + 4.0 * q0 * q1q1 - 2.0 * q1 * ay
+            s1 = (4.0 * q1 * q3q3 - 2.0 * q3 * ax + 4.0 * q0q0 * q1 - 2.0 * q0 * ay - 4.0 * q1
+                  + 8.0 * q1 * q1q1 + 8.0 * q1 * q2q2 + 4.0 * q1 * az)
+            s2 = (4.0 * q0q0 * q2 + 2.0 * q0 * ax + 4.0 * q2 * q3q3 - 2.0 * q3 * ay - 4.0 * q2
+                  + 8.0 * q2 * q1q1 + 8.0 * q2 * q2q2 + 4.0 * q2 * az)
+            s3 = 4.0 * q1q1 * q3 - 2.0 * q1 * ax + 4.0 * q2q2 * q3 - 2.0 * q2 * ay
+        norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+        if norm > 0.0:
+            d0 -= beta * s0 / norm
+            d1 -= beta * s1 / norm
+            d2 -= beta * s2 / norm
+            d3 -= beta * s3 / norm
+
+    q0 += d0 * dt
+    q1 += d1 * dt
+    q2 += d2 * dt
+    q3 += d3 * dt
+    norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / norm, q1 / norm, q2 / norm, q3 / norm
+
+
+def heading_from_quaternion(q, declination: float = 0.0):
+    """Compass heading in degrees (0..360, clockwise from north) of one or many quaternions
+
+    `q` is a 4-tuple or an (n, 4) array; for arrays the result is an array.
+    """
+    q = np.asarray(q, dtype=float)
+    q0, q1, q2, q3 = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    yaw = np.degrees(np.arctan2(2.0 * (q1 * q2 + q0 * q3), q0 * q0 + q1 * q1 - q2 * q2 - q3 * q3))
+    heading = (declination - yaw) % 360.0
+    return float(heading) if heading.ndim == 0 else heading
+
+
+def heading_from_field(mag, declination: float = 0.0) -> float:
+    """Compass heading in degrees of a level sensor from its field vector
+
+    `mag` is given in the accel/gyro frame. Uses the yaw and declination
+    convention of heading_from_quaternion, so both agree for the same pose.
+    """
+    # Level, the measured field is the north/down field rotated by -yaw about z
+    yaw = math.degrees(math.atan2(-mag[1], mag[0]))
+    return (declination - yaw) % 360.0
+
+
+class MadgwickFilter:
+    """Madgwick orientation filter fusing gyro, accelerometer and magnetometer
+
+    The gyro is integrated at its own rate and the accelerometer and
+    magnetometer pull the estimate towards gravity and magnetic north with
+    gain `beta`. All three vectors must be given in the same sensor frame;
+    accel and mag only need a consistent direction, not a unit. Without a
+    magnetometer sample (mag None) only roll and pitch are corrected and
+    the heading follows the gyro. The first WARMUP_TIME seconds use a
+    higher gain so the estimate converges from the identity quickly.
+    """
+
+    def __init__(self, beta: float = DEFAULT_BETA, warmup: float = WARMUP_TIME):
+        self.beta = beta
+        self.warmup = warmup
+        self.q: Quaternion = (1.0, 0.0, 0.0, 0.0)
+        self.elapsed = 0.0
+        self.updates = 0
+
+    def reset(self):
+        self.q = (1.0, 0.0, 0.0, 0.0)
+        self.elapsed = 0.0
+        self.updates = 0
+
+    def update(self, gyro, accel, mag=None, dt: float = 0.001) -> Quaternion:
+        """Advance by one sample of dt seconds, returns the new quaternion (w, x, y, z)"""
+        mx, my, mz = mag if mag is not None else (0.0, 0.0, 0.0)
+        beta = self.beta if self.elapsed >= self.warmup else WARMUP_BETA
+        self.q = _step(*self.q, gyro[0], gyro[1], gyro[2], accel[0], accel[1], accel[2],
+                       mx, my, mz, beta, dt)
+        self.elapsed += dt
+        self.updates += 1
+        return self.q
+
+    def update_batch(self, gyro: np.ndarray, accel: np.ndarray,
+                     mag: Optional[np.ndarray] = None, dt=0.001) -> np.ndarray:
+        """Run a block of samples in one call, returns the (n, 4) quaternion after each
+
+        gyro and accel are (n, 3) arrays; mag is (n, 3), a single (3,) vector
+        held for the whole block, or None. dt is a scalar or an (n,) array of
+        sample intervals, e.g. np.diff of the timestamps. The loop works on
+        plain floats, so one sample costs a few microseconds.
+        """
+        gyro = np.asarray(gyro, dtype=float).tolist()
+        accel = np.asarray(accel, dtype=float).tolist()
+        count = len(gyro)
+        if mag is None:
+            mags = [(0.0, 0.0, 0.0)] * count
+        else:
+            mag = np.asarray(mag, dtype=float)
+            mags = [tuple(mag.tolist())] * count if mag.ndim == 1 else mag.tolist()
+        dts = np.broadcast_to(np.asarray(dt, dtype=float), (count,)).tolist()
+        result = np.empty((count, 4))
+        q0, q1, q2, q3 = self.q
+        elapsed = self.elapsed
+        for index in range(count):
+            beta = self.beta if elapsed >= self.warmup else WARMUP_BETA
+            g, a, m = gyro[index], accel[index], mags[index]
+            q0, q1, q2, q3 = _step(q0, q1, q2, q3, g[0], g[1], g[2], a[0], a[1], a[2],
+                                   m[0], m[1], m[2], beta, dts[index])
+            elapsed += dts[index]
+            result[index] = (q0, q1, q2, q3)
+        self.q = (q0, q1, q2, q3)
+        self.elapsed = elapsed
+        self.updates += count
+        return result
+
+    def heading(self, declination: float = 0.0) -> float:
+        return heading_from_quaternion(self.q, declination)
@@ -0,0 +1,67 @@
+from typing import Dict, Optional
+
+
+class PinShadow:
+    """Shadow register of the last level per output pin and duty per PWM pin
+
+    Every write goes through output() or change_duty_cycle(). A write whose
+    value matches the shadow is suppressed instead of reaching the GPIO
+    layer, so an idle stick or an unchanged frame costs no syscalls.
+    """
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self._levels: Dict[int, int] = {}
+        self._duties: Dict[int, float] = {}
+        self.writes_issued = 0
+        self.writes_suppressed = 0
+
+    def output(self, pin: int, level: int) -> bool:
+        """Drive an output pin, returns False if the write was suppressed"""
+        if self._levels.get(pin) == level:
+            self.writes_suppressed += 1
+            return False
+        self.gpio.output(pin, level)
+        self._levels[pin] = level
+        self.writes_issued += 1
+        return True
+
+    def change_duty_cycle(self, pin: int, pwm, duty: float) -> bool:
+        """Change the duty of the PWM on an EN pin, returns False if suppressed"""
+        if self._duties.get(pin) == duty:
+            self.writes_suppressed += 1
+            return False
+        pwm.ChangeDutyCycle(duty)
+        self._duties[pin] = duty
+        self.writes_issued += 1
+        return True
+
+    def record_duty(self, pin: int, duty: float):
+        """Remember a duty written outside the shadow (e.g. pwm.start)"""
+        self._duties[pin] = duty
+
+    def level(self, pin: int) -> Optional[int]:
+        return self._levels.get(pin)
+
+    def duty(self, pin: int) -> Optional[float]:
+        return self._duties.get(pin)
+
+    def forget(self, pin: Optional[int] = None):
+        """Drop the shadow for one pin or all pins, forcing the next write"""
+        if pin is None:
+            self._levels.clear()
+            self._duties.clear()
+        else:
+            self._levels.pop(pin, None)
+            self._duties.pop(pin, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters of writes issued and suppressed"""
+        return {
+            'issued': self.writes_issued,
+            'suppressed': self.writes_suppressed
+        }
+
+    def reset_stats(self):
+        self.writes_issued = 0
+        self.writes_suppressed = 0
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Compare CPU usage and duty-update jitter of software and hardware PWM
+
+Drives all four EN pins with a duty sweep at a fixed update rate and reports
+the process CPU share (which includes the RPi.GPIO software-PWM threads) and
+the distribution of ChangeDutyCycle call latency and update lateness.
+Waveform jitter on the pin itself needs a scope or logic analyzer; what is
+measured here is the cost and regularity of the updates as the control loop
+sees them.
+
+    python3 pwm_benchmark.py --mode both
+    python3 pwm_benchmark.py --mode hardware --fake   # no Raspberry Pi needed
+"""
+import argparse
+import os
+import resource
+import statistics
+import tempfile
+import time
+
+from gpio_backend import create_backend
+from hardware_pwm import HARDWARE_PWM_CHANNELS, SYSFS_PWM_ROOT, HardwarePWM, make_fake_pwmchip
+
+EN_PINS = (12, 18, 13, 19)
+PWM_FREQUENCY = 1000
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_benchmark(pwms, rate: float, duration: float) -> dict:
+    """Sweep the duty of every PWM at `rate` Hz for `duration` seconds"""
+    period = 1.0 / rate
+    latencies = []
+    lateness = []
+    tick = 0
+    try:
+        # Started inside the try, so channels started before a failing one are released
+        for pwm in pwms:
+            pwm.start(0)
+        cpu_start = _cpu_seconds()
+        wall_start = time.monotonic()
+        deadline = wall_start
+        while deadline - wall_start < duration:
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lateness.append(time.monotonic() - deadline)
+            duty = float(tick % 101)
+            for pwm in pwms:
+                start = time.perf_counter()
+                pwm.ChangeDutyCycle(duty)
+                latencies.append(time.perf_counter() - start)
+            tick += 1
+        wall = time.monotonic() - wall_start
+        cpu = _cpu_seconds() - cpu_start
+    finally:
+        for pwm in pwms:
+            pwm.stop()
+    return {
+        'updates': tick,
+        'cpu_percent': 100.0 * cpu / wall,
+        'call_mean_us': statistics.mean(latencies) * 1e6,
+        'call_p99_us': _percentile(latencies, 0.99) * 1e6,
+        'call_max_us': max(latencies) * 1e6,
+        'late_stdev_us': statistics.pstdev(lateness) * 1e6,
+        'late_p99_us': _percentile(lateness, 0.99) * 1e6
+    }
+
+
+def software_pwms(gpio):
+    gpio.setmode(gpio.BCM)
+    for pin in EN_PINS:
+        gpio.setup(pin, gpio.OUT)
+    return [gpio.PWM(pin, PWM_FREQUENCY) for pin in EN_PINS]
+
+
+def hardware_pwms(sysfs_root: str):
+    return [HardwarePWM(pin, PWM_FREQUENCY, sysfs_root) for pin in EN_PINS]
+
+
+def missing_pwmchips(sysfs_root: str):
+    """pwmchip directories the EN pins need that do not exist under sysfs_root"""
+    chips = sorted({chip for chip, _ in (HARDWARE_PWM_CHANNELS[pin] for pin in EN_PINS)})
+    return [path for path in (os.path.join(sysfs_root, f"pwmchip{chip}") for chip in chips)
+            if not os.path.isdir(path)]
+
+
+def print_result(name: str, result: dict):
+    print(f"{name:>9}: {result['updates']} updates, "
+          f"CPU {result['cpu_percent']:.1f}%, "
+          f"call mean {result['call_mean_us']:.1f} us / "
+          f"p99 {result['call_p99_us']:.1f} us / "
+          f"max {result['call_max_us']:.1f} us, "
+          f"lateness stdev {result['late_stdev_us']:.1f} us / "
+          f"p99 {result['late_p99_us']:.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('software', 'hardware', 'both'), default='both')
+    parser.add_argument('--rate', type=float, default=200.0, help="duty updates per second")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per backend")
+    parser.add_argument('--fake', action='store_true',
+                        help="use a fake pwmchip tree in a temp dir for the hardware backend")
+    args = parser.parse_args()
+
+    if args.mode in ('hardware', 'both') and not args.fake:
+        missing = missing_pwmchips(SYSFS_PWM_ROOT)
+        if missing:
+            parser.exit(1, f"{', '.join(missing)} not found: no hardware PWM here "
+                           f"(enable the pwm overlay) or use --fake to benchmark a fake pwmchip tree\n")
+
+    if args.mode in ('software', 'both'):
+        try:
+            gpio = create_backend('rpi')
+        except ImportError:
+            print(" software: skipped, RPi.GPIO is not available")
+        else:
+            try:
+                print_result('software', run_benchmark(software_pwms(gpio),
+                                                       args.rate, args.duration))
+            finally:
+                gpio.cleanup()
+
+    if args.mode in ('hardware', 'both'):
+        if args.fake:
+            with tempfile.TemporaryDirectory() as root:
+                pwms = hardware_pwms(make_fake_pwmchip(root))
+                print_result('hardware', run_benchmark(pwms, args.rate, args.duration))
+        else:
+            print_result('hardware', run_benchmark(hardware_pwms(SYSFS_PWM_ROOT),
+                                                   args.rate, args.duration))
+
+
+if __name__ == "__main__":
+    main()
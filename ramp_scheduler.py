@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Ramp:
+    """Linear duty ramp of one motor"""
+
+    def __init__(self, motor: int, start: float, end: float, duration: float, t0: float):
+        self.motor = motor
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.t0 = t0
+        self.done = threading.Event()
+
+    def duty_at(self, now: float) -> float:
+        if self.duration <= 0:
+            return self.end
+        progress = min(1.0, (now - self.t0) / self.duration)
+        return self.start + (self.end - self.start) * progress
+
+    def finished(self, now: float) -> bool:
+        return now - self.t0 >= self.duration
+
+
+class RampScheduler:
+    """Advance the duty ramps of all motors from one thread on a fixed tick
+
+    Every tick the duties of all active ramps are handed to `apply` in one
+    call, so four ramping motors cost one frame per tick instead of four
+    threads each sleeping per 1% step. A new ramp for a motor preempts the
+    running one and continues from the duty it had reached. The thread
+    sleeps on a condition while no ramp is active.
+
+    Every new or cancelled ramp bumps the generation of its motor. Duties
+    are computed under the condition but applied outside it, so before
+    applying the thread drops every duty whose motor changed generation in
+    between, and cancel() waits for a tick already being applied. Once
+    cancel() returns no duty of a cancelled ramp can reach the motors, so
+    the caller's next frame is not overwritten by a stale tick.
+    """
+
+    def __init__(self, apply: Callable[[Dict[int, float]], None], tick: float = 0.01,
+                 current_duty: Optional[Callable[[int], float]] = None):
+        self.apply = apply
+        self.tick = tick
+        self.current_duty = current_duty
+        self._ramps: Dict[int, Ramp] = {}
+        self._last: Dict[int, float] = {}
+        self._generation: Dict[int, int] = {}
+        self._condition = threading.Condition()
+        # Held from the generation check until apply() returned; reentrant
+        # because a failing apply() cancels from the scheduler thread
+        self._applying = threading.RLock()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the scheduler thread"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='ramp-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Cancel all ramps and stop the scheduler thread"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.cancel()
+
+    def ramp(self, motor: int, end: float, duration: float,
+             start: Optional[float] = None) -> threading.Event:
+        """Ramp a motor to `end` over `duration` seconds, preempting its current ramp
+
+        Without `start` the ramp begins at the duty the motor currently has.
+        Returns an event that is set when the ramp completes or is cancelled.
+        """
+        with self._condition:
+            previous = self._ramps.pop(motor, None)
+            now = time.monotonic()
+            if start is None:
+                if previous is not None:
+                    start = previous.duty_at(now)
+                elif self.current_duty is not None:
+                    start = self.current_duty(motor)
+                elif motor in self._last:
+                    start = self._last[motor]
+                else:
+                    start = 0.0
+            ramp = Ramp(motor, float(start), float(end), duration, now)
+            self._ramps[motor] = ramp
+            self._generation[motor] = self._generation.get(motor, 0) + 1
+            self._condition.notify()
+        if previous is not None:
+            previous.done.set()
+        return ramp.done
+
+    def cancel(self, motor: Optional[int] = None):
+        """Cancel the ramp of one motor or of all motors, leaving the duty where it is
+
+        Returns after a tick that is being applied right now has been
+        written, so a frame written after cancel() is never overwritten.
+        """
+        with self._condition:
+            motors = list(self._generation) if motor is None else [motor]
+            for number in motors:
+                self._generation[number] = self._generation.get(number, 0) + 1
+            if motor is None:
+                cancelled = list(self._ramps.values())
+                self._ramps.clear()
+            else:
+                cancelled = [r for r in (self._ramps.pop(motor, None),) if r]
+        with self._applying:
+            pass
+        for ramp in cancelled:
+            ramp.done.set()
+
+    def is_active(self, motor: int) -> bool:
+        with self._condition:
+            return motor in self._ramps
+
+    def active_count(self) -> int:
+        with self._condition:
+            return len(self._ramps)
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self._condition:
+                while self._running and not self._ramps:
+                    self._condition.wait()
+                    next_tick = time.monotonic()
+                if not self._running:
+                    return
+                now = time.monotonic()
+                duties = {}
+                generations = {}
+                finished = []
+                for motor, ramp in list(self._ramps.items()):
+                    duties[motor] = ramp.duty_at(now)
+                    generations[motor] = self._generation[motor]
+                    if ramp.finished(now):
+                        finished.append(self._ramps.pop(motor))
+            with self._applying:
+                with self._condition:
+                    # Drop duties of ramps cancelled or replaced since they were computed
+                    duties = {motor: duty for motor, duty in duties.items()
+                              if self._generation[motor] == generations[motor]}
+                    self._last.update(duties)
+                try:
+                    if duties:
+                        self.apply(duties)
+                except Exception as e:
+                    logger.error(f"Error applying ramp duties: {str(e)}")
+                    self.cancel()
+            for ramp in finished:
+                ramp.done.set()
+                logger.debug("Motor %d ramp completed: %.1f -> %.1f", ramp.motor, ramp.start, ramp.end,
+                             extra={'motor': ramp.motor})
+            next_tick += self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                with self._condition:
+                    # A new ramp wakes the thread early so it takes effect immediately
+                    self._condition.wait(delay)
+            else:
+                next_tick = time.monotonic()
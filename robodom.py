@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
+import math
 import os
 import sys
 import time
 import threading
 import subprocess
-import pygame
-import RPi.GPIO as GPIO
+from gpio_backend import get_backend
+from pin_shadow import PinShadow
+from hardware_pwm import create_pwm
+from mecanum_kinematics import WHEEL_POLARITY, frame, mix
+from control_loop import ControlLoop
+from command_arbiter import CommandArbiter
+from velocity_lease import MAX_LEASE
+from latency_histogram import LatencyHistogram
+from axis_shaping import AxisShaper
+from joystick_input import joystick_command, open_joystick
 from flask import Flask, render_template_string, request
 
 # ----- Steuerungs-Skript: Motorensteuerung -----
+# GPIO-Backend: RPi.GPIO auf dem Roboter, sonst simuliert (wählbar über $ROBODOM_GPIO)
+GPIO = get_backend()
 MAX_DUTY_CYCLE = 100
+JOYSTICK_KEEPALIVE = 0.5  # Sekunden ohne Eingabe bis zum erneuten Setzen der Motoren
+IMU_RATE = 200  # Hz, Beschleunigung/Gyro über den FIFO für den fusionierten Kurs
 MOTOR_PINS = {
     1: {'EN': 12, 'IN1': 5,  'IN2': 6},
     2: {'EN': 18, 'IN1': 16, 'IN2': 20},
@@ -18,141 +31,185 @@ MOTOR_PINS = {
 }
 
 class Motor:
-    def __init__(self, EN, IN1, IN2, reversed=False):
+    def __init__(self, EN, IN1, IN2, shadow=None, pwm_mode='software', gpio=None):
+        self.gpio = gpio if gpio is not None else GPIO
         self.en_pin = EN
         self.in1_pin = IN1
         self.in2_pin = IN2
-        self.reversed = reversed
+        # Schattenregister: unveränderte Pegel/Duty-Cycles werden nicht erneut geschrieben
+        self.shadow = shadow if shadow is not None else PinShadow(self.gpio)
 
-        GPIO.setup(self.en_pin, GPIO.OUT)
-        GPIO.setup(self.in1_pin, GPIO.OUT)
-        GPIO.setup(self.in2_pin, GPIO.OUT)
+        # Bei Hardware-PWM bleibt der EN-Pin in seiner PWM-Alternativfunktion
+        if pwm_mode == 'software':
+            self.gpio.setup(self.en_pin, self.gpio.OUT)
+        self.gpio.setup(self.in1_pin, self.gpio.OUT)
+        self.gpio.setup(self.in2_pin, self.gpio.OUT)
 
-        self.pwm = GPIO.PWM(self.en_pin, 1000)
+        self.pwm = create_pwm(self.gpio, self.en_pin, 1000, pwm_mode)
         self.pwm.start(0)
+        self.shadow.record_duty(self.en_pin, 0)
 
     def set_direction(self, direction):
-        if self.reversed:
-            if direction == 'forward':
-                direction = 'backward'
-            elif direction == 'backward':
-                direction = 'forward'
         if direction == 'forward':
-            GPIO.output(self.in1_pin, GPIO.HIGH)
-            GPIO.output(self.in2_pin, GPIO.LOW)
+            self.shadow.output(self.in1_pin, self.gpio.HIGH)
+            self.shadow.output(self.in2_pin, self.gpio.LOW)
         elif direction == 'backward':
-            GPIO.output(self.in1_pin, GPIO.LOW)
-            GPIO.output(self.in2_pin, GPIO.HIGH)
+            self.shadow.output(self.in1_pin, self.gpio.LOW)
+            self.shadow.output(self.in2_pin, self.gpio.HIGH)
         else:  # Stop
-            GPIO.output(self.in1_pin, GPIO.LOW)
-            GPIO.output(self.in2_pin, GPIO.LOW)
+            self.shadow.output(self.in1_pin, self.gpio.LOW)
+            self.shadow.output(self.in2_pin, self.gpio.LOW)
 
     def set_speed(self, speed):
         speed = max(0, min(speed, MAX_DUTY_CYCLE))
-        self.pwm.ChangeDutyCycle(speed)
+        self.shadow.change_duty_cycle(self.en_pin, self.pwm, speed)
 
     def stop(self):
         self.set_speed(0)
         self.pwm.stop()
 
 class MecanumRobot:
-    def __init__(self):
-        # Motor 2 ist invertiert, da er physisch umgekehrt montiert/verkabelt wurde.
+    def __init__(self, pwm_mode='software', gpio=None):
+        self.gpio = gpio if gpio is not None else GPIO
+        # Gemeinsames Schattenregister für alle Pins, damit die Zähler den ganzen Roboter abdecken
+        self.shadow = PinShadow(self.gpio)
+        # Motor 2 ist physisch umgekehrt montiert/verkabelt; das berücksichtigt
+        # das Vorzeichen in WHEEL_POLARITY beim Mischen der Radgeschwindigkeiten.
+        self.polarity = WHEEL_POLARITY
+        # Latenz Eingabe -> PWM/Pins geschrieben, zur Laufzeit abrufbar und beim Stoppen ausgegeben
+        self.latency = LatencyHistogram('Eingabe bis PWM')
         self.motors = {
-            1: Motor(**MOTOR_PINS[1]),
-            2: Motor(**MOTOR_PINS[2], reversed=True),
-            3: Motor(**MOTOR_PINS[3]),
-            4: Motor(**MOTOR_PINS[4])
+            1: Motor(**MOTOR_PINS[1], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio),
+            2: Motor(**MOTOR_PINS[2], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio),
+            3: Motor(**MOTOR_PINS[3], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio),
+            4: Motor(**MOTOR_PINS[4], shadow=self.shadow, pwm_mode=pwm_mode, gpio=self.gpio)
         }
 
+    def set_wheel_duties(self, duties, input_time=None):
+        """Setzt Richtung und Geschwindigkeit aller Motoren aus vorzeichenbehafteten Duty-Cycles.
+
+        input_time: time.monotonic()-Zeitstempel der Eingabe, aus der die Duty-Cycles
+        berechnet wurden; die Zeit bis zum letzten Pin-Schreibzugriff geht in self.latency.
+        """
+        directions, speeds = frame(duties)
+        for number, motor in self.motors.items():
+            motor.set_direction(directions[number])
+            motor.set_speed(speeds[number])
+        self.latency.record_since(input_time)
+
+    def drive(self, x, y, r, source=None, input_time=None):
+        """Fährt mit den Körpergeschwindigkeiten x (seitwärts), y (vorwärts), r (Drehung) in -1..1"""
+        self.set_wheel_duties(mix(x, y, r, MAX_DUTY_CYCLE, self.polarity), input_time)
+
     def stop_all(self):
         for motor in self.motors.values():
             motor.stop()
-        GPIO.cleanup()
+        self.gpio.cleanup()
+        self.shadow.forget()
+        stats = self.shadow.stats()
+        print(f"GPIO-Schreibzugriffe: {stats['issued']} ausgeführt, {stats['suppressed']} unterdrückt.")
+        if self.latency.count:
+            print(self.latency.summary())
         print("Alle Motoren gestoppt und GPIO aufgeräumt.")
 
 class RobotController:
-    def __init__(self):
-        GPIO.setmode(GPIO.BCM)
-        self.robot = MecanumRobot()
+    def __init__(self, pwm_mode='software', gpio=None):
+        self.gpio = gpio if gpio is not None else GPIO
+        self.gpio.setmode(self.gpio.BCM)
+        self.robot = MecanumRobot(pwm_mode=pwm_mode, gpio=self.gpio)
+        # Einziger Schreiber auf die Motoren: Controller, Tastatur, Web und Skripte
+        # reichen Fahrbefehle ein, der Arbiter wählt nach Priorität und Timeout aus
+        self.arbiter = CommandArbiter(self.robot.drive)
 
-    def live_control(self):
+    def live_control(self, backend=None, rate=None):
         """
-        Liest den Xbox-Controller via Pygame aus und steuert in Echtzeit
-        die Motoren des Mecanum-Roboters.
+        Liest den Xbox-Controller aus und steuert in Echtzeit die Motoren des
+        Mecanum-Roboters. backend: 'evdev' (direkt aus /dev/input, ohne
+        Pygame/SDL), 'pygame' oder 'auto' (Standard, siehe $ROBODOM_INPUT).
+        Die Befehle gehen als Quelle 'teleop' an den Arbiter, der sie mit
+        fester Rate ausgibt. rate: Ausgaberate des Arbiters in Hz (Standard 60).
         """
-        pygame.init()
-        pygame.joystick.init()
+        # Mit Hotplug: fehlt der Controller oder fällt er aus, stehen die Motoren
+        # still, bis er wieder da ist – ohne GPIO oder Pygame neu zu initialisieren.
         try:
-            joystick = pygame.joystick.Joystick(0)
-            joystick.init()
-            print(f"Verbunden mit {joystick.get_name()}")
-        except pygame.error as e:
+            inputs = open_joystick(backend, hotplug=True)
+        except OSError:
             print("Kein Xbox-Controller gefunden. Bitte Controller verbinden.")
             # Hier nicht das ganze Programm beenden – stattdessen einfach zurückkehren.
             return
+        print(f"Verbunden mit {inputs.name}" if inputs.connected else "Warte auf Xbox-Controller ...")
 
-        clock = pygame.time.Clock()
+        # Ereignisgesteuert: nur bei Änderungen am Controller einen neuen Befehl einreichen,
+        # zusätzlich ein langsamer Keepalive, damit der Befehl im Arbiter nicht abläuft.
+        # Läuft der Arbiter schon (Webinterface), gehört er nicht diesem Modus.
+        owns_arbiter = not self.arbiter.running
+        if rate and owns_arbiter:
+            self.arbiter.loop = ControlLoop(rate)
+        self.arbiter.start()
+        # Deadzone, Expo-Kurven und Slew-Limit zwischen Controller und Mischer
+        shaper = AxisShaper()
+        last_sequence = inputs.state.sequence
+        connected = inputs.connected
         try:
             while True:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        raise KeyboardInterrupt
-
-                # Joystick-Achsen auslesen
-                x = joystick.get_axis(0)
-                y = -joystick.get_axis(1)
-                r = -joystick.get_axis(2)
-
-                # Einfache Deadzone
-                threshold = 0.1
-                if abs(x) < threshold: x = 0
-                if abs(y) < threshold: y = 0
-                if abs(r) < threshold: r = 0
-
-                # Mecanum-Drive Formel
-                m1_val = y + x + r
-                m2_val = y - x - r
-                m3_val = y - x + r
-                m4_val = y + x - r
-
-                max_val = max(abs(m1_val), abs(m2_val), abs(m3_val), abs(m4_val), 1)
-                scale = MAX_DUTY_CYCLE / max_val
-
-                m1_speed = min(MAX_DUTY_CYCLE, abs(m1_val * scale))
-                m2_speed = min(MAX_DUTY_CYCLE, abs(m2_val * scale))
-                m3_speed = min(MAX_DUTY_CYCLE, abs(m3_val * scale))
-                m4_speed = min(MAX_DUTY_CYCLE, abs(m4_val * scale))
-
-                m1_dir = 'forward' if m1_val >= 0 else 'backward'
-                m2_dir = 'forward' if m2_val >= 0 else 'backward'
-                m3_dir = 'forward' if m3_val >= 0 else 'backward'
-                m4_dir = 'forward' if m4_val >= 0 else 'backward'
-
-                # Setze die Motoren
-                self.robot.motors[1].set_direction(m1_dir)
-                self.robot.motors[1].set_speed(m1_speed)
-                self.robot.motors[2].set_direction(m2_dir)
-                self.robot.motors[2].set_speed(m2_speed)
-                self.robot.motors[3].set_direction(m3_dir)
-                self.robot.motors[3].set_speed(m3_speed)
-                self.robot.motors[4].set_direction(m4_dir)
-                self.robot.motors[4].set_speed(m4_speed)
-
-                clock.tick(60)
+                # Solange die Achsen noch nachlaufen (Slew-Limit), im Takt des Shapers aufwachen
+                inputs.wait(JOYSTICK_KEEPALIVE if shaper.settled else shaper.tick)
+                if inputs.quit:
+                    raise KeyboardInterrupt
+                if inputs.connected != connected:
+                    connected = inputs.connected
+                    if connected:
+                        print(f"Verbunden mit {inputs.name}")
+                    else:
+                        # Controller weg: Achsen sind neutral, Motoren sofort auf 0 statt per Slew-Rampe
+                        shaper.reset()
+                        # Sofort an niedrigere Quellen abgeben (oder anhalten, wenn keine aktiv ist)
+                        self.arbiter.release('teleop')
+                        print("Controller getrennt – Motoren gestoppt, warte auf Wiederverbindung.")
+
+                if not connected:
+                    continue
+
+                # Joystick-Achsen aus dem zuletzt empfangenen Zustand, geformt durch den Shaper
+                x, y, r = shaper.shape(*joystick_command(inputs.state))
+                # Nur Frames aus einer neuen Eingabe bekommen deren Zeitstempel (Keepalives nicht)
+                input_time = inputs.state.timestamp if inputs.state.sequence != last_sequence else None
+                last_sequence = inputs.state.sequence
+
+                # Mecanum-Drive: Mischen und Motoren setzen übernimmt der Arbiter-Thread
+                self.arbiter.submit('teleop', x, y, r, input_time)
         except KeyboardInterrupt:
             print("Manual Control unterbrochen.")
         finally:
-            self.robot.stop_all()
-            pygame.quit()
+            inputs.close()
+            if owns_arbiter:
+                self.arbiter.stop()
+                self.robot.stop_all()
+                print(f"Arbiter: {self.arbiter.summary()}")
+            else:
+                # Web-Befehle bleiben möglich, der Controller gibt nur ab
+                self.arbiter.release('teleop')
 
 # ----- Flask-Webfrontend -----
 class WebInterface:
     def __init__(self):
         self.app = Flask(__name__)
         self.controller = RobotController()
+        # Web-Befehle (/drive) gehen als Quelle 'web' an den Arbiter; ohne neue
+        # Befehle läuft ihr Timeout ab und die Motoren bleiben stehen
+        self.controller.arbiter.start()
+        self.imu = self.start_imu()
         self.setup_routes()
 
+    def start_imu(self):
+        """Kompass im Hintergrund abtasten; Routen lesen nur den letzten Wert, nie den I2C-Bus"""
+        try:
+            from imu_service import start_imu_service
+            return start_imu_service(fifo_rate=IMU_RATE)
+        except (ImportError, OSError, RuntimeError) as e:
+            print(f"Kein Kompass verfügbar: {str(e)}")
+            return None
+
     def setup_routes(self):
         html_template = """
         <!doctype html>
@@ -193,6 +250,55 @@ class WebInterface:
                 message = "Unbekannter Modus."
             return f"{message} <br><br><a href='/'>Zurück</a>"
 
+        @self.app.route("/drive", methods=["POST"])
+        def drive():
+            # x (seitwärts), y (vorwärts), r (Drehung) in -1..1, als Formular oder JSON.
+            # Optional lease: so viele Sekunden (höchstens MAX_LEASE) bleibt der Befehl
+            # ohne Nachfolger gültig, sonst gilt der Timeout der Quelle 'web'.
+            received = time.monotonic()
+            values = request.get_json(silent=True) or request.form
+            try:
+                x, y, r = (float(values.get(axis, 0)) for axis in 'xyr')
+                lease = values.get('lease')
+                lease = float(lease) if lease is not None else None
+            except (TypeError, ValueError):
+                return "x, y, r und lease müssen Zahlen sein.", 400
+            # NaN und Unendlich ablehnen, bevor geklemmt wird: max/min machen aus NaN sonst -1
+            if not all(math.isfinite(value) for value in (x, y, r, lease) if value is not None):
+                return "x, y, r und lease müssen endliche Zahlen sein.", 400
+            x, y, r = (max(-1.0, min(value, 1.0)) for value in (x, y, r))
+            if lease is not None:
+                lease = min(lease, MAX_LEASE)
+            if lease is not None and lease <= 0:
+                return "lease muss positiv sein.", 400
+            self.controller.arbiter.submit('web', x, y, r, received, lease)
+            return {'x': x, 'y': y, 'r': r, 'lease': lease}
+
+        @self.app.route("/latency")
+        def latency():
+            # Latenz-Histogramm Eingabe -> PWM des laufenden Manual-Modus
+            histogram = self.controller.robot.latency
+            lines = [histogram.summary()]
+            lines += [f"&le; {histogram.upper_bound(index) * 1e3:.3f} ms: {count}"
+                      for index, count in enumerate(histogram.counts) if count]
+            return "<br>".join(lines) + "<br><br><a href='/'>Zurück</a>"
+
+        @self.app.route("/heading")
+        def heading():
+            # Fusionierter Kurs (alle ~10 ms aktualisiert), sonst der reine Magnetometer-Kurs.
+            # Ohne Kalibrierung fusioniert der Filter kein Magnetometer, sein Kurs hat dann
+            # keinen Bezug zu Norden.
+            sample = None
+            if self.imu is not None:
+                if self.imu.compass.is_calibrated:
+                    sample = self.imu.latest_orientation
+                sample = sample or self.imu.latest
+            if sample is None:
+                return "Kein Kompasswert verfügbar.<br><br><a href='/'>Zurück</a>"
+            age = time.monotonic() - sample.timestamp
+            return (f"Kurs: {sample.heading:.1f}° (vor {age * 1e3:.0f} ms gemessen)"
+                    "<br><br><a href='/'>Zurück</a>")
+
     def run(self, host="0.0.0.0", port=8069):
         self.app.run(host=host, port=port)
 
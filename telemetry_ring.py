@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Binary ring buffer of applied motor frames backed by a memory-mapped file
+
+Every record holds a wall-clock timestamp taken after the writes completed,
+the four duties, the four directions (-1 backward, 0 stop, 1 forward), the
+source of the frame and the latency from the input sample that produced
+it (NaN if none) in 36 bytes. The file is mapped shared, so the kernel keeps the data when the
+process crashes and the ring continues where it left off on restart.
+
+Each record also carries the low 24 bits of its sequence number, written
+after the rest of the record. A record torn by a crash, or read while it is
+being overwritten, still has the sequence of the record it replaces and is
+dropped by the readers.
+
+    python3 telemetry_ring.py dump motor_telemetry.bin
+    python3 telemetry_ring.py dump motor_telemetry.bin --csv frames.csv
+    python3 telemetry_ring.py dump motor_telemetry.bin --npy frames.npy --last 1000
+"""
+import argparse
+import csv
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+MAGIC = b'RDTR'
+VERSION = 3
+HEADER = struct.Struct('<4sHHIQ')  # magic, version, record size, capacity, records written
+# timestamp, 4 duties, 4 directions, source, sequence (24 bit), input latency
+RECORD = struct.Struct('<d4f4bB3sf')
+SEQUENCE_OFFSET = 29  # of the sequence within a record
+SEQUENCE_MASK = 0xFFFFFF
+
+SOURCES = ('unknown', 'frame', 'single', 'ramp', 'estop', 'teleop', 'script', 'web',
+           'keyboard', 'idle')
+SOURCE_IDS = {name: index for index, name in enumerate(SOURCES)}
+
+DEFAULT_CAPACITY = 65536  # records, 2.25 MiB of data
+
+Record = Tuple[float, Tuple[float, ...], Tuple[int, ...], str, float]
+
+
+class TelemetryRing:
+    """Fixed-size ring of frame records in a memory-mapped file"""
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY):
+        if not 0 < capacity <= SEQUENCE_MASK:
+            raise ValueError(f"capacity must be between 1 and {SEQUENCE_MASK}")
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        size = HEADER.size + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, version, record_size, stored_capacity, written = HEADER.unpack_from(self._map, 0)
+        if (magic, version, record_size, stored_capacity) == (MAGIC, VERSION, RECORD.size, capacity):
+            self.written = written
+        else:
+            self.written = 0
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, capacity, 0)
+
+    def append(self, duties: Sequence[float], directions: Sequence[int],
+               source: str = 'frame', timestamp: Optional[float] = None,
+               latency: Optional[float] = None):
+        """Write one frame record, overwriting the oldest once the ring is full"""
+        if timestamp is None:
+            timestamp = time.time()
+        if latency is None:
+            latency = math.nan
+        with self._lock:
+            if self._map.closed:
+                return
+            offset = HEADER.size + (self.written % self.capacity) * RECORD.size
+            sequence = offset + SEQUENCE_OFFSET
+            # The old sequence stays in place until the payload is complete
+            RECORD.pack_into(self._map, offset, timestamp,
+                             duties[0], duties[1], duties[2], duties[3],
+                             directions[0], directions[1], directions[2], directions[3],
+                             SOURCE_IDS.get(source, 0), self._map[sequence:sequence + 3], latency)
+            self._map[sequence:sequence + 3] = _sequence_bytes(self.written)
+            self.written += 1
+            struct.pack_into('<Q', self._map, HEADER.size - 8, self.written)
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        with self._lock:
+            if self._map.closed:
+                return
+            self._map.flush()
+            self._map.close()
+
+
+def _sequence_bytes(index: int) -> bytes:
+    return (index & SEQUENCE_MASK).to_bytes(3, 'little')
+
+
+def _open_readonly(path: str) -> Tuple[bytes, int, int]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, record_size, capacity, written = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"{path} is not a motor telemetry ring")
+    return data, capacity, written
+
+
+def _ordered_indices(capacity: int, written: int, last: Optional[int]) -> List[int]:
+    """Sequence numbers of the records still in the ring, oldest first"""
+    count = min(written, capacity)
+    if last is not None:
+        count = min(count, last)
+    return list(range(written - count, written))
+
+
+def read_records(path: str, last: Optional[int] = None) -> Iterator[Record]:
+    """Yield (timestamp, duties, directions, source, latency) oldest first
+
+    Records whose sequence does not match their position are torn and skipped.
+    """
+    data, capacity, written = _open_readonly(path)
+    for index in _ordered_indices(capacity, written, last):
+        values = RECORD.unpack_from(data, HEADER.size + (index % capacity) * RECORD.size)
+        if values[10] != _sequence_bytes(index):
+            continue
+        source = values[9]
+        yield (values[0], values[1:5], values[5:9],
+               SOURCES[source] if source < len(SOURCES) else 'unknown', values[11])
+
+
+def to_numpy(path: str, last: Optional[int] = None):
+    """Return the ring as a NumPy structured array, oldest record first, torn records dropped"""
+    import numpy as np
+    data, capacity, written = _open_readonly(path)
+    dtype = np.dtype({'names': ['timestamp', 'duty', 'direction', 'source', 'latency'],
+                      'formats': ['<f8', ('<f4', 4), ('i1', 4), 'u1', '<f4'],
+                      'offsets': [0, 8, 24, 28, 32],
+                      'itemsize': RECORD.size})
+    records = np.frombuffer(data, dtype=dtype, count=capacity, offset=HEADER.size)
+    raw = np.frombuffer(data, dtype=np.uint8, count=capacity * RECORD.size,
+                        offset=HEADER.size).reshape(capacity, RECORD.size)
+    sequence = raw[:, SEQUENCE_OFFSET:SEQUENCE_OFFSET + 3].astype(np.uint32)
+    sequence = sequence[:, 0] | sequence[:, 1] << 8 | sequence[:, 2] << 16
+    indices = np.array(_ordered_indices(capacity, written, last), dtype=np.int64)
+    slots = indices % capacity
+    valid = sequence[slots] == (indices & SEQUENCE_MASK)
+    return records[slots[valid]]
+
+
+def write_csv(path: str, out, last: Optional[int] = None):
+    writer = csv.writer(out)
+    writer.writerow(['timestamp', 'duty1', 'duty2', 'duty3', 'duty4',
+                     'dir1', 'dir2', 'dir3', 'dir4', 'source', 'latency_ms'])
+    for timestamp, duties, directions, source, latency in read_records(path, last):
+        writer.writerow([f"{timestamp:.6f}", *(f"{d:.2f}" for d in duties), *directions, source,
+                         '' if math.isnan(latency) else f"{latency * 1e3:.3f}"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dump or convert a motor telemetry ring")
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help="print or convert the records, oldest first")
+    dump.add_argument('path')
+    dump.add_argument('--last', type=int, help="only the newest N records")
+    output = dump.add_mutually_exclusive_group()
+    output.add_argument('--csv', metavar='FILE', help="write CSV to FILE ('-' for stdout)")
+    output.add_argument('--npy', metavar='FILE', help="write a NumPy structured array to FILE")
+    args = parser.parse_args()
+
+    if args.npy:
+        import numpy as np
+        np.save(args.npy, to_numpy(args.path, args.last))
+    elif args.csv and args.csv != '-':
+        with open(args.csv, 'w', newline='') as out:
+            write_csv(args.path, out, args.last)
+    else:
+        write_csv(args.path, sys.stdout, args.last)
+
+
+if __name__ == "__main__":
+    main()
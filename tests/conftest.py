@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules live flat in the repository root; simulate the GPIO pins off the robot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ROBODOM_GPIO', 'sim')
@@ -0,0 +1,56 @@
+import math
+
+import numpy as np
+import pytest
+
+from imu_service import mag_to_accel_frame
+from orientation_filter import MadgwickFilter, heading_from_field, heading_from_quaternion
+
+DECLINATION = 2.0
+# Earth field pointing north and down at the Aachen inclination, in uT
+FIELD = (48.0 * math.cos(math.radians(66.0)), 0.0, 48.0 * math.sin(math.radians(66.0)))
+
+
+def level_pose(heading):
+    """Quaternion of a level sensor at `heading` and its field in the AK8963 frame"""
+    yaw = math.radians(DECLINATION - heading)
+    quaternion = (math.cos(yaw / 2), 0.0, 0.0, math.sin(yaw / 2))
+    # Earth to body frame is the inverse rotation about z
+    bx, by, bz = FIELD
+    accel_frame = (bx * math.cos(yaw) + by * math.sin(yaw),
+                   -bx * math.sin(yaw) + by * math.cos(yaw), bz)
+    # Inverse of mag_to_accel_frame: swap X and Y, invert Z
+    ak8963 = (accel_frame[1], accel_frame[0], -accel_frame[2])
+    return quaternion, ak8963
+
+
+def angle_difference(a, b):
+    return abs((a - b + 180.0) % 360.0 - 180.0)
+
+
+@pytest.mark.parametrize('heading', [0.0, 45.0, 90.0, 135.0, 180.0, 270.0, 315.0])
+def test_field_and_quaternion_headings_agree_when_level(heading):
+    quaternion, mag = level_pose(heading)
+    fused = heading_from_quaternion(quaternion, DECLINATION)
+    magnetic = heading_from_field(mag_to_accel_frame(mag), DECLINATION)
+    assert angle_difference(fused, heading) < 1e-9
+    assert angle_difference(magnetic, heading) < 1e-9
+
+
+@pytest.mark.parametrize('heading', [0.0, 90.0, 200.0, 270.0])
+def test_filter_converges_to_the_field_heading(heading):
+    _, mag = level_pose(heading)
+    samples = 30000  # 30 s at 1 kHz, the default gain turns slowly after the warmup
+    orientation = MadgwickFilter()
+    orientation.update_batch(np.zeros((samples, 3)), np.tile((0.0, 0.0, 1.0), (samples, 1)),
+                             np.array(mag_to_accel_frame(mag)), 0.001)
+    assert angle_difference(orientation.heading(DECLINATION),
+                            heading_from_field(mag_to_accel_frame(mag), DECLINATION)) < 1.0
+
+
+@pytest.mark.parametrize('heading', [0.0, 90.0, 270.0])
+def test_compass_heading_matches_the_fused_convention(heading):
+    compass = pytest.importorskip('compass')
+    quaternion, mag = level_pose(heading)
+    magnetic = compass.MPU9250.calculate_heading(compass.MPU9250.__new__(compass.MPU9250), mag)
+    assert angle_difference(magnetic, heading_from_quaternion(quaternion, DECLINATION)) < 1e-9
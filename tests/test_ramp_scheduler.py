@@ -0,0 +1,43 @@
+import threading
+import time
+
+from ramp_scheduler import RampScheduler
+
+
+def test_no_stale_tick_after_cancel():
+    written = {}
+    lock = threading.Lock()
+
+    def apply(duties):
+        # Widen the window between computing a tick and writing it
+        time.sleep(0.002)
+        with lock:
+            written.update(duties)
+
+    scheduler = RampScheduler(apply, tick=0.001)
+    scheduler.start()
+    try:
+        for _ in range(20):
+            for motor in range(1, 5):
+                scheduler.ramp(motor, 100, 1.0, start=50)
+            time.sleep(0.003)
+            scheduler.cancel()
+            with lock:
+                # The caller's frame right after cancelling
+                written.update({motor: 0.0 for motor in range(1, 5)})
+            time.sleep(0.004)
+            with lock:
+                assert all(written[motor] == 0.0 for motor in range(1, 5))
+    finally:
+        scheduler.stop()
+
+
+def test_ramp_reaches_its_end():
+    written = {}
+    scheduler = RampScheduler(written.update, tick=0.001)
+    scheduler.start()
+    try:
+        assert scheduler.ramp(1, 80, 0.02, start=0).wait(1.0)
+        assert written[1] == 80
+    finally:
+        scheduler.stop()
@@ -0,0 +1,46 @@
+import math
+
+import pytest
+
+pytest.importorskip('flask')
+
+import robodom
+
+
+@pytest.fixture
+def web():
+    interface = robodom.WebInterface()
+    interface.app.testing = True
+    yield interface
+    interface.controller.arbiter.stop()
+
+
+def submitted(web):
+    return web.controller.arbiter.sources['web'].command
+
+
+@pytest.mark.parametrize('field', ['x', 'y', 'r', 'lease'])
+@pytest.mark.parametrize('value', ['nan', 'NaN', 'inf', '-inf'])
+def test_drive_rejects_non_finite_form_values(web, field, value):
+    response = web.app.test_client().post('/drive', data={field: value})
+    assert response.status_code == 400
+    assert submitted(web) is None
+
+
+@pytest.mark.parametrize('field', ['x', 'y', 'r', 'lease'])
+def test_drive_rejects_non_finite_json_values(web, field):
+    # json.loads accepts the NaN literal, so it has to be rejected after parsing
+    response = web.app.test_client().post('/drive', data=f'{{"{field}": NaN}}',
+                                          content_type='application/json')
+    assert response.status_code == 400
+    assert submitted(web) is None
+
+
+def test_drive_clamps_and_submits_finite_values(web):
+    response = web.app.test_client().post('/drive', json={'x': 2, 'y': -0.5, 'r': -3,
+                                                          'lease': 5})
+    assert response.status_code == 200
+    command = submitted(web)
+    assert (command.x, command.y, command.r) == (1.0, -0.5, -1.0)
+    assert command.lease == robodom.MAX_LEASE
+    assert all(math.isfinite(value) for value in response.get_json().values())
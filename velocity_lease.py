@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+MAX_LEASE = 1.0  # seconds, longer leases are cut to this
+DEFAULT_DECAY_TIME = 0.3  # seconds from the last commanded duty to 0 after expiry
+
+# apply(x, y, r, source, input_time) and decay(duration)
+Apply = Callable[[float, float, float, str, Optional[float]], object]
+Decay = Callable[[float], object]
+
+
+class VelocityLease:
+    """Hold a streamed velocity command until its lease runs out
+
+    Every command carries a lease in seconds and is applied at once; it
+    then stays in effect without further writes until either a new command
+    replaces it or the lease expires, at which point `decay` ramps the
+    motors to zero. A client sending every 50-100 ms with a lease of a few
+    intervals therefore drives smoothly and the robot still comes to rest
+    when the packets stop. One thread sleeps on a condition until the
+    earliest deadline; it is idle while no lease is held.
+    """
+
+    def __init__(self, apply: Apply, decay: Decay,
+                 decay_time: float = DEFAULT_DECAY_TIME, max_lease: float = MAX_LEASE):
+        self.apply = apply
+        self.decay = decay
+        self.decay_time = decay_time
+        self.max_lease = max_lease
+        self.source: Optional[str] = None
+        self.granted = 0
+        self.expired = 0
+        self.cancelled = 0
+        # Time between two commands of the stream, to tune client rate against the lease
+        self.intervals = LatencyHistogram('lease renewal interval')
+        self._deadline: Optional[float] = None
+        self._last_command: Optional[float] = None
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='velocity-lease', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the expiry thread without touching the motors"""
+        with self._condition:
+            self._running = False
+            self._deadline = None
+            self._condition.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    @property
+    def active(self) -> bool:
+        with self._condition:
+            return self._deadline is not None
+
+    def command(self, x: float, y: float, r: float, lease: float,
+                source: str = 'web', input_time: Optional[float] = None) -> float:
+        """Apply a command for `lease` seconds, returns the granted lease"""
+        if lease <= 0:
+            raise ValueError("lease must be positive")
+        lease = min(lease, self.max_lease)
+        with self._condition:
+            now = time.monotonic()
+            if self._deadline is not None and self._last_command is not None:
+                self.intervals.record(now - self._last_command)
+            self._last_command = now
+            self.apply(x, y, r, source, input_time)
+            self._deadline = now + lease
+            self.source = source
+            self.granted += 1
+            self._condition.notify()
+        return lease
+
+    def cancel(self):
+        """Drop the lease without decaying, e.g. after an emergency stop"""
+        with self._condition:
+            if self._deadline is not None:
+                self._deadline = None
+                self.cancelled += 1
+                self._condition.notify()
+
+    def _run(self):
+        with self._condition:
+            while self._running:
+                if self._deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                self._deadline = None
+                self.expired += 1
+                logger.warning(f"Velocity lease of {self.source} expired, ramping to 0 "
+                               f"in {self.decay_time:.2f} s")
+                try:
+                    self.decay(self.decay_time)
+                except Exception as e:
+                    logger.error(f"Error decaying expired lease: {str(e)}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                'granted': self.granted,
+                'expired': self.expired,
+                'cancelled': self.cancelled,
+                'active': self._deadline is not None,
+                'interval_p99': self.intervals.percentile(0.99),
+                'interval_max': self.intervals.maximum
+            }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (f"{stats['granted']} commands, {stats['expired']} leases expired, "
+                f"{stats['cancelled']} cancelled, renewal interval p99 "
+                f"{stats['interval_p99'] * 1e3:.1f} ms, max {stats['interval_max'] * 1e3:.1f} ms")